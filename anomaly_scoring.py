@@ -0,0 +1,137 @@
+"""
+Per-group anomaly scores for monthly spend.
+
+score_groups() is a single-pass, vectorized replacement for
+`df.groupby('inferred_category').apply(calculate_safe_zscore)`: group means,
+spreads and sizes come from groupby-transform, so there is no per-group
+Python call, no group copies and no concat. It keeps the same rules:
+groups with fewer than 3 rows score 0, NaN amounts are ignored when
+computing the statistics, and NaN scores become 0.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Scales MAD so the robust score is comparable to a normal Z-score
+MAD_SCALE = 0.6745
+# Used instead when MAD is 0: mean absolute deviation * sqrt(pi/2)
+MEAN_AD_SCALE = 1.253314
+
+# --- REFERENCE IMPLEMENTATION (the original per-group function) ---
+def calculate_safe_zscore(group):
+    """
+    Calculates Z-score for a group.
+    Handles groups with too few data points to be statistically valid.
+    """
+    # A Z-score is meaningless with 2 or fewer data points
+    if len(group) < 3:
+        group['z_score'] = 0.0 # Assign a neutral score
+    else:
+        # Calculate Z-score for 'total_amount'
+        # nan_policy='omit' will ignore nulls
+        # ddof=0 calculates the population standard deviation
+        group['z_score'] = stats.zscore(group['total_amount'], ddof=0, nan_policy='omit')
+
+    return group
+
+# --- VECTORIZED ENGINE ---
+def score_groups(df, group_cols=('inferred_category',), value_col='total_amount',
+                 method='zscore', min_points=3):
+    """
+    Returns a Series of scores aligned with df.index.
+
+    method='zscore' is the population Z-score (ddof=0), matching
+    calculate_safe_zscore. method='mad' is the robust modified Z-score,
+    0.6745 * (x - median) / MAD, falling back to the mean absolute
+    deviation when MAD is 0.
+    """
+    keys = [df[col] for col in group_cols]
+    values = df[value_col].astype('float64')
+    # Row count including NaN amounts, like len(group) in the original
+    size = values.groupby(keys).transform('size')
+
+    if method == 'zscore':
+        deviation = values - values.groupby(keys).transform('mean')
+        # Two-pass population std, the same arithmetic scipy.stats.zscore uses
+        spread = np.sqrt((deviation ** 2).groupby(keys).transform('mean'))
+        scores = deviation / spread
+    elif method == 'mad':
+        deviation = values - values.groupby(keys).transform('median')
+        abs_deviation = deviation.abs()
+        mad = abs_deviation.groupby(keys).transform('median')
+        mean_ad = abs_deviation.groupby(keys).transform('mean')
+        scores = (MAD_SCALE * deviation / mad).where(mad > 0, deviation / (MEAN_AD_SCALE * mean_ad))
+    else:
+        raise ValueError(f"Unknown scoring method: {method}")
+
+    scores = scores.where(size >= min_points, 0.0)
+    # 0/0 (constant groups, NaN amounts, NaN group keys) means "nothing unusual"
+    return scores.fillna(0.0)
+
+# --- INCREMENTAL ENGINE (persisted Welford / Chan running statistics) ---
+STAT_COLUMNS = ['n_rows', 'n_values', 'mean', 'm2']
+
+def summarize_groups(df, group_cols, value_col='total_amount'):
+    """
+    Per-group running-statistics state: n_rows (including NaN amounts),
+    n_values, mean and m2 (sum of squared deviations) over non-NaN amounts.
+    Returns a DataFrame indexed by the group columns.
+    """
+    keys = [df[col] for col in group_cols]
+    values = df[value_col].astype('float64')
+    grouped = values.groupby(keys)
+    deviation = values - grouped.transform('mean')
+    summary = grouped.agg(['size', 'count', 'mean'])
+    summary.columns = ['n_rows', 'n_values', 'mean']
+    summary['m2'] = (deviation ** 2).groupby(keys).sum()
+    return summary.fillna({'mean': 0.0, 'm2': 0.0})
+
+def combine_stats(state, delta, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) the rows summarized in `delta` from
+    `state`, using Chan et al.'s pairwise update of count, mean and M2.
+    Both are summarize_groups() outputs; groups left with no rows are dropped.
+    """
+    index = state.index.union(delta.index)
+    a = state.reindex(index).fillna(0.0)
+    b = delta.reindex(index).fillna(0.0)
+
+    n_a = a['n_values']
+    n_b = b['n_values']
+    n = n_a + sign * n_b
+    safe_n = n.where(n > 0, 1.0)
+
+    if sign == 1:
+        delta_mean = b['mean'] - a['mean']
+        mean = a['mean'] + delta_mean * n_b / safe_n
+        m2 = a['m2'] + b['m2'] + delta_mean ** 2 * n_a * n_b / safe_n
+    else:
+        # Solve the merge formula backwards for the part that remains
+        mean = (n_a * a['mean'] - n_b * b['mean']) / safe_n
+        delta_mean = b['mean'] - mean
+        m2 = a['m2'] - b['m2'] - delta_mean ** 2 * n * n_b / n_a.where(n_a > 0, 1.0)
+
+    result = pd.DataFrame({
+        'n_rows': a['n_rows'] + sign * b['n_rows'],
+        'n_values': n,
+        'mean': mean.where(n > 0, 0.0),
+        # Rounding can leave a constant group with a tiny M2; call that 0
+        'm2': m2.where((n > 0) & (m2 > 1e-12 * n * mean ** 2), 0.0),
+    }, index=index)
+    return result[result['n_rows'] > 0]
+
+def apply_changes(state, changed, group_cols, value_col='total_amount', removed=None):
+    """
+    Folds new and changed rows into the state. `changed` carries the new
+    value in value_col, the value previously folded in as
+    'previous_amount' and an 'is_new' flag. `removed` rows (their folded
+    value in value_col) are no longer in the source and are taken out.
+    """
+    if removed is not None and not removed.empty:
+        state = combine_stats(state, summarize_groups(removed, group_cols, value_col), sign=-1)
+    if changed.empty:
+        return state
+    previous = changed[~changed['is_new']]
+    if not previous.empty:
+        state = combine_stats(state, summarize_groups(previous, group_cols, 'previous_amount'), sign=-1)
+    return combine_stats(state, summarize_groups(changed, group_cols, value_col))
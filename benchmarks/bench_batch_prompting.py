@@ -0,0 +1,60 @@
+"""
+Benchmark: K-message batch prompting vs one message per request, against
+the local Groq stub. A few messages are poison pills the stub drops from
+batched replies (and garbles in single replies) to exercise bisection.
+
+Reports calls, tokens per message and success rate for each K.
+
+    python benchmarks/bench_batch_prompting.py --messages 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from groq import Groq
+
+from groq_engine import GroqEngine, RateLimiter
+from groq_stub_server import start_stub_server
+from llm_extraction import extract_batch
+from synthetic_sms import generate_messages
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--poison-every", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    messages = []
+    for i, (_, _, body) in enumerate(generate_messages(args.messages)):
+        if i % args.poison_every == 0:
+            body = f"POISON {body}"
+        messages.append((i + 1, body))
+    n_poison = sum(1 for _, body in messages if body.startswith("POISON"))
+
+    server = start_stub_server(rpm=1_000_000, tpm=1_000_000_000, latency=args.latency)
+    client = Groq(api_key="stub", base_url=server.base_url, max_retries=0)
+
+    print(f"{args.messages} messages, {n_poison} poison pills")
+    for k in (1, 5, 10, 20):
+        engine = GroqEngine(client, RateLimiter(1_000_000, 1_000_000_000), max_workers=16)
+        batches = [messages[i:i + k] for i in range(0, len(messages), k)]
+        start = time.perf_counter()
+        outputs = engine.map(lambda batch: extract_batch(engine, batch, "llama-3.1-8b-instant"), batches)
+        seconds = time.perf_counter() - start
+
+        ok = sum(1 for results, _, _ in outputs for r in results.values() if r)
+        calls = sum(c for _, _, c in outputs)
+        tokens = sum(t for _, t, _ in outputs)
+        print(f"  K={k:>2}: {calls:5d} calls, {tokens / len(messages):6.1f} tokens/msg, "
+              f"{ok}/{len(messages)} ok ({ok / len(messages):.1%}), {seconds:5.1f}s")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
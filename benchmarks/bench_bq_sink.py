@@ -0,0 +1,101 @@
+"""
+Benchmark: per-batch BigQuery load jobs vs BufferedBigQuerySink, against
+an in-memory fake client. Also checks that statuses are only committed
+after a successful flush.
+
+    python benchmarks/bench_bq_sink.py --batches 500 --batch-rows 20
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+from google.cloud import bigquery
+
+from bq_sink import BufferedBigQuerySink
+from fake_bigquery import FakeBigQueryClient
+from warehouse import BigQueryBackend
+
+SCHEMA = [
+    ("message_auto_id", "INT64"),
+    ("timestamp_utc", "TIMESTAMP"),
+    ("sender_address", "STRING"),
+    ("message_body", "STRING"),
+    ("is_transaction", "BOOL"),
+    ("vendor_name", "STRING"),
+    ("amount", "FLOAT64"),
+    ("currency", "STRING"),
+    ("transaction_type", "STRING"),
+    ("inferred_category", "STRING"),
+]
+
+def make_batch(start_id, n):
+    ids = list(range(start_id, start_id + n))
+    return pd.DataFrame({
+        "message_auto_id": ids,
+        "timestamp_utc": pd.Timestamp("2025-01-01") + pd.to_timedelta(ids, unit="min"),
+        "sender_address": "HP-HDFCBK",
+        "message_body": [f"Rs.{i}.00 debited to NETFLIX" for i in ids],
+        "is_transaction": True,
+        "vendor_name": "Netflix",
+        "amount": [float(i) for i in ids],
+        "currency": "INR",
+        "transaction_type": "debit",
+        "inferred_category": "Subscription",
+    }), ids
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=500)
+    parser.add_argument("--batch-rows", type=int, default=20)
+    parser.add_argument("--max-rows", type=int, default=5000)
+    parser.add_argument("--job-seconds", type=float, default=2.0,
+                        help="typical wall time of one real BigQuery load job")
+    args = parser.parse_args()
+    batches = [make_batch(i * args.batch_rows, args.batch_rows) for i in range(args.batches)]
+
+    # 1. Old path: one load job per batch
+    client = FakeBigQueryClient()
+    start = time.perf_counter()
+    for df, _ in batches:
+        client.load_table_from_dataframe(df, "t", job_config=bigquery.LoadJobConfig(
+            schema=[bigquery.SchemaField(name, field_type) for name, field_type in SCHEMA])).result()
+    print(f"per-batch loads: {client.load_jobs} load jobs "
+          f"(~{client.load_jobs * args.job_seconds:.0f}s waiting on BigQuery), "
+          f"{time.perf_counter() - start:.2f}s locally")
+
+    # 2. Buffered sink
+    client = FakeBigQueryClient()
+    committed = []
+    backend = BigQueryBackend("bench", "bench", client=client)
+    sink = BufferedBigQuerySink(backend, "t", SCHEMA, on_flush=committed.extend, max_rows=args.max_rows)
+    start = time.perf_counter()
+    for df, ids in batches:
+        sink.add(df, ids)
+    sink.flush()
+    print(f"buffered sink:   {client.load_jobs} load jobs "
+          f"(~{client.load_jobs * args.job_seconds:.0f}s waiting on BigQuery), "
+          f"{time.perf_counter() - start:.2f}s locally")
+    assert len(client.tables[backend.table_id("t")]) == len(committed) == args.batches * args.batch_rows
+
+    # 3. A failed flush must not commit any statuses
+    client = FakeBigQueryClient()
+    committed = []
+    sink = BufferedBigQuerySink(BigQueryBackend("bench", "bench", client=client), "t", SCHEMA,
+                                on_flush=committed.extend)
+    sink.add(*batches[0])
+    client.fail_next_load = True
+    try:
+        sink.flush()
+    except RuntimeError:
+        pass
+    assert committed == [], "statuses were committed for a failed load"
+    print("failed flush left statuses uncommitted: OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark: import-time cost of the DAG file and the task modules.
+
+Every import runs in a fresh interpreter with the credential variables
+removed and socket connects / DNS lookups turned into errors, so any
+client created at import time (or any exit on a missing credential)
+fails the check. For each target it reports the import time, whether a
+pipeline context was created, and which heavy libraries got loaded.
+The DAG file must parse in milliseconds without loading any of them.
+
+Without Airflow installed the DAG is parsed against a minimal stand-in
+for DAG/PythonOperator, which measures this repo's own import cost.
+
+    python benchmarks/bench_dag_import.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAG_FILE = os.path.join(REPO_ROOT, "dags", "sms_pipeline_dag.py")
+
+TASK_MODULES = ["ingest_xml", "pre_filter_data", "process_nlp_groq", "run_analytics"]
+HEAVY_MODULES = ["pandas", "sqlalchemy", "groq", "google.cloud.bigquery", "duckdb", "pyarrow"]
+CREDENTIAL_VARIABLES = ["VARIABLE_NAME", "GOOGLE_APPLICATION_CREDENTIALS", "PIPELINE_DATABASE_URL"]
+
+def block_network():
+    import socket
+
+    def refuse(*args, **kwargs):
+        raise RuntimeError("network access at import time")
+
+    socket.socket.connect = refuse
+    socket.socket.connect_ex = refuse
+    socket.getaddrinfo = refuse
+    socket.create_connection = refuse
+
+def install_airflow_stand_in():
+    """DAG / PythonOperator that only record the tasks, for parsing without Airflow."""
+    class DAG:
+        def __init__(self, dag_id, **kwargs):
+            self.dag_id = dag_id
+            self.tasks = []
+        def __enter__(self):
+            DAG.current = self
+            return self
+        def __exit__(self, *exc):
+            DAG.current = None
+
+    class PythonOperator:
+        def __init__(self, task_id, python_callable, **kwargs):
+            self.task_id = task_id
+            self.python_callable = python_callable
+            DAG.current.tasks.append(self)
+        def __rshift__(self, other):
+            return other
+        def __rrshift__(self, other):
+            return self
+
+    airflow = types.ModuleType("airflow")
+    airflow.DAG = DAG
+    operators = types.ModuleType("airflow.operators")
+    python = types.ModuleType("airflow.operators.python")
+    python.PythonOperator = PythonOperator
+    sys.modules.update({"airflow": airflow, "airflow.operators": operators, "airflow.operators.python": python})
+
+def child(target):
+    """Imports one target in this (fresh) interpreter and prints a JSON report."""
+    sys.path.insert(0, REPO_ROOT)
+    block_network()
+    stand_in = False
+    if target == "dag":
+        try:
+            import airflow # noqa: F401 (imported first so its own cost is not counted)
+        except ImportError:
+            install_airflow_stand_in()
+            stand_in = True
+
+    preloaded = set(sys.modules)
+    tasks = None
+    start = time.perf_counter()
+    try:
+        if target == "dag":
+            namespace = {"__name__": "sms_pipeline_dag", "__file__": DAG_FILE}
+            with open(DAG_FILE) as f:
+                exec(compile(f.read(), DAG_FILE, "exec"), namespace)
+            tasks = len(namespace["dag"].tasks)
+        else:
+            __import__(target)
+        error = None
+    except SystemExit as e:
+        error = f"exited at import (code {e.code})"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+
+    context = sys.modules.get("pipeline_context")
+    print(json.dumps({
+        "seconds": seconds,
+        "error": error,
+        "tasks": tasks,
+        "stand_in": stand_in,
+        "context_created": bool(context and context._context is not None),
+        "heavy": [m for m in HEAVY_MODULES if m in sys.modules and m not in preloaded],
+    }))
+
+def measure(target, repeat):
+    env = {k: v for k, v in os.environ.items() if k not in CREDENTIAL_VARIABLES}
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", target],
+                             env=env, capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    report = runs[-1]
+    report["median_ms"] = statistics.median(r["seconds"] for r in runs) * 1000
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-dag-ms", type=float, default=50.0)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    failed = False
+    reports = {}
+    print(f"{'target':<20} {'median':>10}  {'context':<8} heavy imports")
+    for target in ["dag"] + TASK_MODULES:
+        report = reports[target] = measure(target, args.repeat)
+        label = target + (" (stand-in)" if report["stand_in"] else "")
+        print(f"{label:<20} {report['median_ms']:8.1f}ms  {'built' if report['context_created'] else 'no':<8} "
+              f"{', '.join(report['heavy']) or '-'}")
+        if report["error"]:
+            print(f"  FAILED: {report['error']}")
+            failed = True
+        elif report["context_created"]:
+            print("  FAILED: clients were created at import time")
+            failed = True
+
+    dag = reports["dag"]
+    if dag["heavy"] or dag["median_ms"] > args.max_dag_ms:
+        print(f"FAILED: DAG parse took {dag['median_ms']:.1f}ms and loaded {dag['heavy'] or 'nothing heavy'}")
+        failed = True
+    else:
+        print(f"DAG parse: {dag['median_ms']:.1f}ms for {dag['tasks']} tasks, no network or credentials touched.")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
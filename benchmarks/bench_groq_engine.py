@@ -0,0 +1,92 @@
+"""
+Benchmark: concurrent, rate-limited GroqEngine vs the old one-at-a-time loop,
+both against the local stub server (no network, no API key).
+
+Reports wall time, throughput, 429s seen and whether the stub's limits
+were ever exceeded.
+
+    python benchmarks/bench_groq_engine.py --messages 500 --rpm 600
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from groq import Groq
+
+from groq_engine import GroqEngine, RateLimiter
+from groq_stub_server import start_stub_server
+from synthetic_sms import generate_messages
+
+SYSTEM_PROMPT = "You are an expert financial SMS parser. Respond with a single JSON object."
+
+def prompt_for(sms_text):
+    return [{"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Here is the SMS message to process:\n{sms_text}"}]
+
+def run_sequential(client, bodies, rpm):
+    """The old loop: one call, then sleep 60/RPM seconds."""
+    start = time.perf_counter()
+    for body in bodies:
+        client.chat.completions.create(messages=prompt_for(body), model="llama-3.1-8b-instant",
+                                       temperature=0.0, response_format={"type": "json_object"})
+        time.sleep(60 / rpm)
+    return time.perf_counter() - start
+
+def run_engine(client, bodies, rpm, tpm, workers):
+    engine = GroqEngine(client, RateLimiter(rpm, tpm), max_workers=workers, backoff_base=0.5)
+    start = time.perf_counter()
+    engine.map(lambda body: engine.complete_json(prompt_for(body)), bodies)
+    return time.perf_counter() - start, engine.stats
+
+def report(label, server, n, seconds, stats=None):
+    state = server.state
+    peak = state.max_requests_in_window()
+    print(f"{label:>24}: {n} msgs in {seconds:6.1f}s ({n / seconds:5.1f} msg/s), "
+          f"stub 429s={state.rejected}, peak/window={peak} (limit {state.rpm}) "
+          f"{'OK' if peak <= state.rpm else 'EXCEEDED'}")
+    if stats:
+        print(f"{'':>24}  engine stats: {stats}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.25)
+    parser.add_argument("--sequential-sample", type=int, default=40,
+                        help="the old loop is slow; time this many and extrapolate")
+    args = parser.parse_args()
+
+    bodies = [body for _, _, body in generate_messages(args.messages)]
+
+    # 1. Old loop on a sample, extrapolated
+    server = start_stub_server(args.rpm, args.tpm, args.latency)
+    client = Groq(api_key="stub", base_url=server.base_url, max_retries=0)
+    sample = bodies[:args.sequential_sample]
+    seconds = run_sequential(client, sample, args.rpm)
+    report("sequential (sample)", server, len(sample), seconds)
+    print(f"{'':>24}  extrapolated to {args.messages} msgs: {seconds / len(sample) * args.messages:.0f}s")
+    server.shutdown()
+
+    # 2. Engine configured with the server's real limits
+    server = start_stub_server(args.rpm, args.tpm, args.latency)
+    client = Groq(api_key="stub", base_url=server.base_url, max_retries=0)
+    seconds, stats = run_engine(client, bodies, args.rpm, args.tpm, args.workers)
+    report("engine", server, len(bodies), seconds, stats)
+    server.shutdown()
+
+    # 3. Engine that believes it has twice the real budget: must adapt to 429s
+    server = start_stub_server(args.rpm // 2, args.tpm, args.latency)
+    client = Groq(api_key="stub", base_url=server.base_url, max_retries=0)
+    seconds, stats = run_engine(client, bodies, args.rpm, args.tpm, args.workers)
+    report("engine (over-configured)", server, len(bodies), seconds, stats)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
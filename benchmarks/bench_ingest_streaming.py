@@ -0,0 +1,74 @@
+"""
+Benchmark: streaming (iterparse) vs full-tree XML parsing in ingest_xml.py.
+
+Each mode runs in its own subprocess so that peak RSS is measured cleanly.
+Only parsing and record building is timed; nothing is written to Postgres.
+
+    python benchmarks/bench_ingest_streaming.py --messages 1000000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def run_mode(mode, xml_path, batch_size):
+    import ingest_xml
+
+    start = time.perf_counter()
+    total = 0
+    if mode == "streaming":
+        for batch in ingest_xml.iter_sms_batches(xml_path, batch_size):
+            total += len(batch)
+    else:
+        # The original approach: whole tree + full list of records
+        root = ET.parse(xml_path).getroot()
+        records = []
+        for sms in root.findall('sms'):
+            record = ingest_xml.build_sms_record(sms.get('address'), sms.get('date'), sms.get('body'))
+            if record:
+                records.append(record)
+        total = len(records)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is reported in KB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:>10}: {total} messages in {elapsed:.1f}s "
+          f"({total / elapsed:,.0f} msg/s), peak RSS {peak_rss_mb:,.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--mode", choices=["streaming", "tree"])
+    parser.add_argument("--xml")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.xml, args.batch_size)
+        return
+
+    from synthetic_sms import write_backup
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path = os.path.join(tmp, "backup.xml")
+        print(f"Generating synthetic backup with {args.messages} messages...")
+        write_backup(xml_path, args.messages)
+        print(f"File size: {os.path.getsize(xml_path) / 1024 / 1024:,.0f} MB")
+
+        for mode in ("streaming", "tree"):
+            subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--xml", xml_path,
+                 "--batch-size", str(args.batch_size)],
+                check=True,
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: serial fetch -> enrich -> load loop vs the bounded-queue Pipeline.
+
+Stages are simulated with sleeps that release the GIL like real I/O
+(Postgres reads, Groq calls, BigQuery loads). Also checks that:
+  - batches come out in order and none are lost,
+  - backpressure keeps the source at most a few batches ahead,
+  - an error in any stage stops the others and is re-raised.
+
+    python benchmarks/bench_pipeline.py --batches 50 --fetch 0.02 --enrich 0.08 --load 0.04
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from pipeline_runner import Pipeline, format_stats
+
+def make_stages(args, produced, fail_at=None, fail_stage=None):
+    def check(stage, i):
+        if stage == fail_stage and i == fail_at:
+            raise RuntimeError(f"injected {stage} failure at batch {i}")
+
+    def source():
+        for i in range(args.batches):
+            time.sleep(args.fetch)
+            check('fetch', i)
+            produced.append(i)
+            yield i
+
+    def enrich(i):
+        time.sleep(args.enrich)
+        check('enrich', i)
+        return i
+
+    def load(i, out):
+        time.sleep(args.load)
+        check('load', i)
+        out.append(i)
+
+    return source, enrich, load
+
+def run_serial(args):
+    produced, out = [], []
+    source, enrich, load = make_stages(args, produced)
+    start = time.perf_counter()
+    for batch in source():
+        load(enrich(batch), out)
+    return time.perf_counter() - start
+
+def run_pipelined(args):
+    produced, out = [], []
+    source, enrich, load = make_stages(args, produced)
+    max_ahead = [0]
+
+    def sink(i):
+        max_ahead[0] = max(max_ahead[0], len(produced) - len(out))
+        load(i, out)
+
+    stats = Pipeline(queue_size=args.queue_size).run(source(), [('enrich', enrich)], sink)
+    assert out == list(range(args.batches)), "batches lost or reordered"
+    return stats, max_ahead[0]
+
+def check_error_propagation(args):
+    for stage in ('fetch', 'enrich', 'load'):
+        produced, out = [], []
+        source, enrich, load = make_stages(args, produced, fail_at=3, fail_stage=stage)
+        start = time.perf_counter()
+        try:
+            Pipeline(queue_size=args.queue_size).run(source(), [('enrich', enrich)], lambda i: load(i, out))
+        except RuntimeError as e:
+            assert 'injected' in str(e)
+        else:
+            sys.exit(f"FAILED: {stage} error was swallowed")
+        leftover = [t.name for t in threading.enumerate() if t.name in ('fetch', 'enrich')]
+        assert not leftover, f"threads still running after {stage} failure: {leftover}"
+        print(f"  {stage} failure re-raised after {time.perf_counter() - start:.2f}s, "
+              f"{len(out)} batches loaded, source stopped after {len(produced)}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--fetch", type=float, default=0.02)
+    parser.add_argument("--enrich", type=float, default=0.08)
+    parser.add_argument("--load", type=float, default=0.04)
+    parser.add_argument("--queue-size", type=int, default=2)
+    args = parser.parse_args()
+
+    serial = run_serial(args)
+    stats, max_ahead = run_pipelined(args)
+    slowest = max(args.fetch, args.enrich, args.load) * args.batches
+    print(f"Serial:    {serial:6.2f}s (sum of stages)")
+    print(f"Pipelined: {stats['total_seconds']:6.2f}s (slowest stage alone: {slowest:.2f}s), "
+          f"{serial / stats['total_seconds']:.1f}x faster")
+    print(format_stats(stats))
+    # Source, one batch in each queue slot, one in each stage's hands
+    bound = 2 * args.queue_size + 3
+    print(f"Backpressure: source ran at most {max_ahead} batches ahead of the sink (bound {bound})")
+    assert max_ahead <= bound
+
+    print("Error propagation:")
+    check_error_propagation(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark + parity check: classify_messages vs the per-row pre_filter_message.
+
+Fails loudly if the two ever disagree on a label.
+
+    python benchmarks/bench_prefilter.py --messages 3000000
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+import sms_classifier
+from synthetic_sms import generate_messages
+
+# Hand-picked edge cases on top of the synthetic corpus
+EDGE_CASES = [
+    None, "", "Rs.5", "short paid", "Paid Rs.500 to SWIGGY via UPI.",
+    "Payment of Rs 500 received — thanks", "paid\nRS. 100\nto shop ok",
+    "Your OTP is 123456 for the payment of Rs. 10", "G-123456 is your Google verification code.",
+    "A/C XX1234 debited by INR 99.00 on 01-Jan", "nothing to see here at all, move along",
+    "Transactional alert: ＲＳ 100 spent", "rs.100 spent at STORE      ", "xpaidx xrs.x but no keyword",
+]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=3_000_000)
+    args = parser.parse_args()
+
+    bodies = pd.Series(
+        [body for _, _, body in generate_messages(args.messages)] + EDGE_CASES,
+        dtype=object,
+    )
+    print(f"Classifying {len(bodies):,} messages...")
+
+    start = time.perf_counter()
+    expected = bodies.apply(sms_classifier.pre_filter_message)
+    row_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = sms_classifier.classify_messages(bodies)
+    vector_seconds = time.perf_counter() - start
+
+    mismatches = (expected != actual).sum()
+    if mismatches:
+        print(bodies[expected != actual].head(20).to_string())
+        sys.exit(f"PARITY FAILED: {mismatches} labels differ")
+
+    print(f"Parity OK ({(actual == 'pre_filtered').sum():,} pre_filtered)")
+    print(f"  per-row apply: {row_seconds:6.2f}s ({len(bodies) / row_seconds:,.0f} msg/s)")
+    print(f"  vectorized:    {vector_seconds:6.2f}s ({len(bodies) / vector_seconds:,.0f} msg/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Accuracy + scaling benchmark for the recurring-subscription detector.
+
+Synthetic transactions mix planted subscriptions (weekly, monthly and
+annual, with jitter, skipped charges, price changes, drift, new and
+cancelled series) with irregular shopping at other vendors. Accuracy is
+checked against the planted truth, then detection is timed at growing
+sizes to show it scales like the sort (n log n), not pairwise.
+
+    python benchmarks/bench_subscriptions.py --sizes 100000 1000000 5000000
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+import pandas as pd
+
+from subscription_detector import CADENCES, detect_subscriptions
+
+AS_OF = pd.Timestamp("2025-01-01", tz="UTC")
+HISTORY_DAYS = 6 * 365
+# Charge dates wobble by up to this many days (plus rounding to whole days)
+JITTER_DAYS = {'weekly': 0, 'monthly': 1, 'annual': 4}
+
+def planted_series(rng, vendor_id):
+    cadence = rng.choice(['weekly', 'monthly', 'monthly', 'monthly', 'annual'])
+    period = CADENCES[cadence][0]
+    kind = rng.choice(['plain', 'plain', 'plain', 'price_changed', 'drifting', 'missed', 'new', 'skipped'])
+
+    end = AS_OF - pd.Timedelta(days=rng.uniform(0, period * 0.5))
+    if kind == 'missed':
+        end -= pd.Timedelta(days=period * rng.integers(2, 4))
+    if kind == 'new':
+        count = rng.integers(3, 4)
+    else:
+        count = max(4, min(int(HISTORY_DAYS / period), int(rng.integers(6, 200))))
+    beats = np.arange(count)[::-1]
+    if kind == 'skipped':
+        beats = np.delete(beats, count // 2) # one charge never happened
+    jitter = rng.integers(-JITTER_DAYS[cadence], JITTER_DAYS[cadence] + 1, len(beats))
+    times = end - pd.to_timedelta(beats * period + jitter, unit='D')
+
+    amount = np.full(len(beats), round(rng.uniform(49, 2000), 0))
+    if kind == 'drifting':
+        amount = amount * (1.005 ** np.arange(len(beats)))
+    if kind == 'price_changed':
+        amount[-1] *= rng.choice([0.8, 1.25])
+
+    truth = {'vendor': f"sub{vendor_id}", 'cadence': cadence, 'kind': kind}
+    frame = pd.DataFrame({
+        'timestamp_utc': times,
+        'vendor_name': f"SUB{vendor_id}." if vendor_id % 2 else None, # punctuation, or no vendor at all
+        'sender_address': f"VM-SUB{vendor_id}",
+        'amount': amount,
+        'transaction_type': 'debit',
+    })
+    return frame, truth
+
+def synthetic_transactions(n_rows, seed=21):
+    """About 60% of rows are planted subscriptions, the rest irregular shopping."""
+    rng = np.random.default_rng(seed)
+    frames, truth = [], []
+    rows = 0
+    while rows < n_rows * 0.6:
+        frame, planted = planted_series(rng, len(truth))
+        frames.append(frame)
+        truth.append(planted)
+        rows += len(frame)
+
+    n_noise = n_rows - rows
+    noise_vendors = max(1, n_noise // 30)
+    frames.append(pd.DataFrame({
+        'timestamp_utc': AS_OF - pd.to_timedelta(rng.uniform(0, HISTORY_DAYS, n_noise), unit='D'),
+        'vendor_name': pd.Series([f"Shop {v}" for v in range(noise_vendors)])[rng.integers(0, noise_vendors, n_noise)].to_numpy(),
+        'sender_address': "AD-PAYTM",
+        'amount': rng.lognormal(6, 1, n_noise).round(2),
+        'transaction_type': rng.choice(['debit', 'debit', 'debit', 'credit'], n_noise),
+    }))
+    return pd.concat(frames, ignore_index=True), pd.DataFrame(truth)
+
+def check_accuracy(n_rows=300_000):
+    transactions, truth = synthetic_transactions(n_rows)
+    found = detect_subscriptions(transactions, as_of=AS_OF).set_index('vendor_key')
+    truth = truth.set_index('vendor')
+
+    detected = truth.index.intersection(found.index)
+    false_positives = found.index.difference(truth.index)
+    print(f"Accuracy on {len(transactions):,} transactions, {len(truth):,} planted subscriptions:")
+    print(f"  recall    {len(detected) / len(truth):6.1%}")
+    print(f"  precision {len(detected) / max(len(found), 1):6.1%} ({len(false_positives)} false positives)")
+    found.index = found.index.astype(object).rename('vendor')
+    cadence_ok = (found.loc[detected, 'cadence'] == truth.loc[detected, 'cadence']).mean()
+    print(f"  cadence   {cadence_ok:6.1%} correct")
+
+    for kind, flag in (('new', 'is_newly_started'), ('price_changed', 'is_price_changed'), ('missed', 'is_missed')):
+        expected = truth.loc[detected, 'kind'] == kind
+        actual = found.loc[detected, flag]
+        hits = (expected & actual).sum()
+        print(f"  {flag:<17} recall {hits / max(expected.sum(), 1):6.1%}, "
+              f"precision {hits / max(actual.sum(), 1):6.1%}")
+    drifting = truth.loc[detected, 'kind'] == 'drifting'
+    print(f"  drifting amounts recognised: {(found.loc[detected][drifting]['amount_pattern'] == 'drifting').mean():6.1%}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    args = parser.parse_args()
+
+    check_accuracy()
+
+    print("Scaling:")
+    previous = None
+    for size in args.sizes:
+        transactions, _ = synthetic_transactions(size, seed=size)
+        start = time.perf_counter()
+        found = detect_subscriptions(transactions, as_of=AS_OF)
+        seconds = time.perf_counter() - start
+        growth = f" ({seconds / previous[1]:.1f}x time for {size / previous[0]:.0f}x rows)" if previous else ""
+        print(f"  {len(transactions):>10,} rows: {seconds:6.2f}s, "
+              f"{len(transactions) / seconds:>12,.0f} rows/s, {len(found):,} subscriptions{growth}")
+        previous = (size, seconds)
+
+if __name__ == "__main__":
+    main()
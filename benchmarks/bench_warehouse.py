@@ -0,0 +1,131 @@
+"""
+Local end-to-end analytics run on the embedded DuckDB warehouse backend.
+
+Backfills years of synthetic enriched transactions through the buffered
+sink, then times the modeling step (agg_monthly_spend), the first and a
+follow-up incremental anomaly run, a full recompute, and subscription
+detection. Checks that incremental and full runs flag the same anomalies.
+No GCP project or credentials needed.
+
+    python benchmarks/bench_warehouse.py --rows 5000000 --years 5
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+import pandas as pd
+
+import run_analytics
+from bq_sink import BufferedBigQuerySink
+from pipeline_context import PipelineContext, set_context
+from warehouse import DuckDBBackend, record_dirty_months
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_warehouse_")
+
+SCHEMA = [
+    ("message_auto_id", "INT64"),
+    ("timestamp_utc", "TIMESTAMP"),
+    ("sender_address", "STRING"),
+    ("message_body", "STRING"),
+    ("is_transaction", "BOOL"),
+    ("vendor_name", "STRING"),
+    ("amount", "FLOAT64"),
+    ("currency", "STRING"),
+    ("transaction_type", "STRING"),
+    ("inferred_category", "STRING"),
+]
+CATEGORIES = ["Food", "Subscription", "Utilities", "Bank Alert", "Transport", "Shopping", "Other"]
+
+def transactions(n_rows, start, days, first_id, seed):
+    rng = np.random.default_rng(seed)
+    vendors = np.array([f"vendor_{v}" for v in range(2000)])
+    return pd.DataFrame({
+        "message_auto_id": np.arange(first_id, first_id + n_rows),
+        "timestamp_utc": start + pd.to_timedelta(rng.uniform(0, days, n_rows), unit="D"),
+        "sender_address": "VM-HDFCBK",
+        "message_body": "Rs debited",
+        "is_transaction": True,
+        "vendor_name": vendors[rng.integers(0, len(vendors), n_rows)],
+        "amount": rng.lognormal(6, 1, n_rows).round(2),
+        "currency": "INR",
+        "transaction_type": rng.choice(["debit", "debit", "debit", "credit"], n_rows),
+        "inferred_category": rng.choice(CATEGORIES, n_rows),
+    })
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"  {label:<34} {time.perf_counter() - start:7.2f}s")
+    return result
+
+def anomaly_keys(backend):
+    df = backend.query_dataframe(
+        "SELECT spend_month, inferred_category, z_score FROM fct_anomalies")
+    return df.sort_values(["spend_month", "inferred_category"]).reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--chunk", type=int, default=500_000)
+    parser.add_argument("--keep", action="store_true", help="keep the DuckDB file for inspection")
+    args = parser.parse_args()
+
+    # run_analytics gets its backend from the shared context
+    backend = DuckDBBackend(os.path.join(WORK_DIR, "warehouse.duckdb"))
+    context = PipelineContext(warehouse=backend)
+    set_context(context)
+    start_date = pd.Timestamp("2020-01-01", tz="UTC")
+    days = 365 * args.years
+    print(f"Warehouse file: {backend.path}")
+
+    def backfill():
+        sink = BufferedBigQuerySink(backend, "enriched_transactions", SCHEMA,
+                                    max_rows=args.chunk * 4, spool_dir=WORK_DIR, partition_field="timestamp_utc")
+        for i, first in enumerate(range(0, args.rows, args.chunk)):
+            size = min(args.chunk, args.rows - first)
+            df = transactions(size, start_date, days, first, seed=i)
+            sink.add(df, df["message_auto_id"].tolist())
+        sink.flush()
+        return sink.load_jobs
+
+    print(f"Backfill of {args.rows:,} transactions over {args.years} years:")
+    jobs = timed("load via buffered sink", backfill)
+    print(f"  ({jobs} load jobs)")
+
+    timed("build agg_monthly_spend", run_analytics.build_monthly_spend)
+    timed("incremental anomalies (first run)", run_analytics.run_anomaly_detection)
+    timed("incremental anomalies (no changes)", run_analytics.run_anomaly_detection)
+
+    # One more day of traffic lands: only the current month changes
+    new_day = transactions(args.rows // days, start_date + pd.Timedelta(days=days - 1), 1, args.rows, seed=999)
+    record_dirty_months(backend, "enriched_transactions", {new_day["timestamp_utc"].min().date().replace(day=1)})
+    backend.load_dataframe(new_day, "enriched_transactions")
+    timed("build agg_monthly_spend (one month)", run_analytics.build_monthly_spend)
+    timed("incremental anomalies (one day)", run_analytics.run_anomaly_detection)
+    incremental = anomaly_keys(backend)
+
+    timed("full recompute", run_analytics.run_full_anomaly_detection)
+    full = anomaly_keys(backend)
+    same = (len(full) == len(incremental)
+            and (full[["spend_month", "inferred_category"]] == incremental[["spend_month", "inferred_category"]]).all().all()
+            and np.allclose(full["z_score"], incremental["z_score"]))
+    print(f"  incremental vs full: {len(incremental)} vs {len(full)} anomalies, {'MATCH' if same else 'MISMATCH'}")
+    if not same:
+        sys.exit(1)
+
+    timed("subscription detection", run_analytics.run_subscription_detection)
+
+    if not args.keep:
+        context.close()
+        shutil.rmtree(WORK_DIR)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Benchmark + parity check for the vectorized anomaly scoring engine.
+
+1. Parity: score_groups(method='zscore') vs the original
+   groupby('inferred_category').apply(calculate_safe_zscore), including
+   tiny groups, constant groups and NaN amounts.
+2. Incremental parity: run_analytics.run_incremental_anomaly_detection on
+   an in-memory DuckDB warehouse, after new, changed and removed months,
+   vs run_full_anomaly_detection, and its persisted group stats vs
+   summarize_groups over the final data.
+3. Throughput: score_groups on N synthetic monthly-spend rows (10M by
+   default) vs groupby.apply timed on a sample and extrapolated, and the
+   incremental run for a small batch of changes.
+
+    python benchmarks/bench_zscore.py --rows 10000000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import warnings
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+import pandas as pd
+
+import run_analytics
+from anomaly_scoring import calculate_safe_zscore, score_groups, summarize_groups
+from pipeline_context import PipelineContext, set_context
+from warehouse import DuckDBBackend
+
+def synthetic_monthly_spend(n_rows, n_groups, seed=7, start="2015-01-01"):
+    rng = np.random.default_rng(seed)
+    groups = rng.integers(0, n_groups, n_rows)
+    base = rng.uniform(100, 5000, n_groups)[groups]
+    amounts = base * rng.lognormal(0, 0.3, n_rows)
+    # A few spikes, some missing amounts
+    amounts[rng.random(n_rows) < 0.002] *= 10
+    amounts[rng.random(n_rows) < 0.001] = np.nan
+    return pd.DataFrame({
+        "spend_month": pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, 3650, n_rows), unit="D"),
+        "inferred_category": pd.Series([f"cat_{g}" for g in range(n_groups)])[groups].to_numpy(),
+        "total_amount": amounts,
+    })
+
+def original_scores(df):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        scored = df.groupby('inferred_category').apply(calculate_safe_zscore)
+        scored['z_score'] = scored['z_score'].fillna(0.0)
+    return scored.reset_index(level=0, drop=True)['z_score'].sort_index()
+
+def check_parity():
+    df = synthetic_monthly_spend(100_000, 2_000)
+    edge = pd.DataFrame({
+        "spend_month": pd.Timestamp("2024-01-01"),
+        "inferred_category": ["one", "two", "two", "const", "const", "const", "nan3", "nan3", "nan3", "nan3"],
+        "total_amount": [5.0, 1.0, 9.0, 7.0, 7.0, 7.0, np.nan, 1.0, 2.0, 300.0],
+    })
+    df = pd.concat([df, edge], ignore_index=True)
+
+    expected = original_scores(df)
+    actual = score_groups(df).sort_index()
+    if not np.allclose(expected.to_numpy(), actual.to_numpy(), rtol=1e-9, atol=1e-9):
+        worst = (expected - actual).abs().idxmax()
+        sys.exit(f"PARITY FAILED at row {worst}: {expected[worst]} vs {actual[worst]}")
+    flagged = (expected.abs() >= 2.5) == (actual.abs() >= 2.5)
+    assert flagged.all()
+    print(f"Parity OK on {len(df):,} rows ({(actual.abs() >= 2.5).sum()} anomalies)")
+
+def unique_months(df):
+    """agg_monthly_spend has one row per month and group."""
+    return df.drop_duplicates(["spend_month", "inferred_category"]).reset_index(drop=True)
+
+def anomaly_keys(backend):
+    df = backend.query_dataframe("SELECT spend_month, inferred_category, z_score FROM fct_anomalies")
+    return df.sort_values(["spend_month", "inferred_category"]).reset_index(drop=True)
+
+def incremental_run(df, changed_rows, changed_amounts, new_rows, removed_rows):
+    """
+    Two runs of run_analytics' incremental path on an in-memory DuckDB
+    warehouse: `df` is scored first, then `changed_rows` get new totals,
+    `new_rows` arrive and `removed_rows` disappear from agg_monthly_spend.
+    Returns (backend, updated data, seconds of the second run).
+    """
+    backend = DuckDBBackend(":memory:")
+    set_context(PipelineContext(warehouse=backend))
+    backend.load_dataframe(df, run_analytics.SOURCE_TABLE, mode='truncate')
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_analytics.run_incremental_anomaly_detection()
+
+    updated = df.copy()
+    updated.loc[changed_rows, 'total_amount'] = changed_amounts
+    updated = pd.concat([updated.drop(index=removed_rows), new_rows], ignore_index=True)
+    backend.load_dataframe(updated, run_analytics.SOURCE_TABLE, mode='truncate')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_analytics.run_incremental_anomaly_detection()
+    return backend, updated, time.perf_counter() - start
+
+def check_incremental_parity(n_rows=200_000, n_groups=2_000):
+    rng = np.random.default_rng(11)
+    df = unique_months(synthetic_monthly_spend(n_rows, n_groups, seed=3))
+    edge = pd.DataFrame({
+        "spend_month": pd.Timestamp("2026-01-01") + pd.to_timedelta(range(10), unit="D"),
+        "inferred_category": ["grow", "grow", "const", "const", "const", "nan3", "nan3", "gone", "gone", None],
+        "total_amount": [5.0, 9.0, 7.0, 7.0, 7.0, np.nan, 1.0, 3.0, 4.0, 50.0],
+    })
+    df = pd.concat([df, edge], ignore_index=True)
+    picked = rng.choice(len(df) - len(edge), 700, replace=False)
+    changed_rows = picked[:500]
+    changed_amounts = df.loc[changed_rows, 'total_amount'].to_numpy() * rng.uniform(0.5, 3, 500)
+    changed_amounts[:20] = np.nan # A month losing its total
+    # Months that no longer have debits, and a whole group that disappears
+    removed_rows = np.concatenate([picked[500:], df.index[df['inferred_category'] == 'gone']])
+    new_rows = pd.concat([
+        unique_months(synthetic_monthly_spend(2_000, n_groups, seed=4, start="2027-01-01")),
+        pd.DataFrame({
+            "spend_month": pd.Timestamp("2040-02-01"),
+            "inferred_category": ["grow", "const", "nan3", "brand_new"],
+            "total_amount": [400.0, 7.0, 2.0, 10.0],
+        }),
+    ], ignore_index=True)
+
+    backend, updated, _ = incremental_run(df, changed_rows, changed_amounts, new_rows, removed_rows)
+    incremental = anomaly_keys(backend)
+    state = backend.query_dataframe("SELECT * FROM anomaly_group_state").set_index('inferred_category').sort_index()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_analytics.run_full_anomaly_detection()
+    full = anomaly_keys(backend)
+
+    keys = ["spend_month", "inferred_category"]
+    if len(full) != len(incremental) or not (full[keys] == incremental[keys]).all().all():
+        sys.exit(f"INCREMENTAL PARITY FAILED: {len(incremental)} vs {len(full)} anomalies, or different months")
+    if not np.allclose(full["z_score"], incremental["z_score"], rtol=1e-7, atol=1e-7):
+        worst = (full["z_score"] - incremental["z_score"]).abs().idxmax()
+        sys.exit(f"INCREMENTAL PARITY FAILED at {full.loc[worst, keys].tolist()}: "
+                 f"{incremental.loc[worst, 'z_score']} vs {full.loc[worst, 'z_score']}")
+    expected = summarize_groups(updated, ['inferred_category'])
+    assert state.index.equals(expected.index) and 'gone' not in state.index
+    assert (state['n_rows'] == expected['n_rows']).all() and (state['n_values'] == expected['n_values']).all()
+    assert np.allclose(state[['mean', 'm2']], expected[['mean', 'm2']], rtol=1e-7, atol=1e-6)
+    print(f"Incremental parity OK on {len(updated):,} rows ({len(changed_rows)} changed, "
+          f"{len(new_rows):,} new, {len(removed_rows)} removed; {len(full)} anomalies)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--groups", type=int, default=20_000)
+    parser.add_argument("--apply-sample", type=int, default=500_000)
+    args = parser.parse_args()
+
+    check_parity()
+    check_incremental_parity()
+
+    df = synthetic_monthly_spend(args.rows, args.groups)
+    print(f"Scoring {len(df):,} rows in {args.groups:,} groups...")
+    for method in ("zscore", "mad"):
+        start = time.perf_counter()
+        score_groups(df, method=method)
+        print(f"  score_groups({method}): {time.perf_counter() - start:6.2f}s")
+
+    # Sample whole groups so group sizes (and per-group overhead) match the full run
+    keep = max(1, args.groups * args.apply_sample // args.rows)
+    sample = df[df['inferred_category'].isin([f"cat_{g}" for g in range(keep)])]
+    start = time.perf_counter()
+    original_scores(sample)
+    seconds = time.perf_counter() - start
+    print(f"  groupby.apply on {len(sample):,} rows: {seconds:6.2f}s "
+          f"(~{seconds * len(df) / len(sample):.0f}s extrapolated to {len(df):,})")
+
+    # A daily run: 0.1% of months changed, 0.1% new, spread over all groups
+    df = unique_months(df)
+    rng = np.random.default_rng(5)
+    n_changes = max(1, len(df) // 1000)
+    changed_rows = rng.choice(len(df), n_changes, replace=False)
+    new_rows = unique_months(synthetic_monthly_spend(n_changes, args.groups, seed=9, start="2027-01-01"))
+    *_, seconds = incremental_run(df, changed_rows, df.loc[changed_rows, 'total_amount'].to_numpy() * 2,
+                                  new_rows, removed_rows=[])
+    print(f"  incremental run ({n_changes:,} changed + {len(new_rows):,} new months, DuckDB): {seconds:6.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+In-memory stand-in for google.cloud.bigquery.Client, used by the benchmarks.
+
+Supports the load paths the pipeline uses and keeps every loaded table as
+a pandas DataFrame. Set `fail_next_load = True` to make the next load job
+raise, to check that nothing is marked processed on failure.
+"""
+import pandas as pd
+
+class FakeJob:
+    def __init__(self, error=None):
+        self.error = error
+
+    def result(self):
+        if self.error:
+            raise self.error
+        return self
+
+class FakeBigQueryClient:
+    def __init__(self):
+        self.tables = {}
+        self.load_jobs = 0
+        self.fail_next_load = False
+
+    def _append(self, table_id, df, write_disposition):
+        self.load_jobs += 1
+        if self.fail_next_load:
+            self.fail_next_load = False
+            return FakeJob(RuntimeError("simulated load job failure"))
+        if write_disposition == "WRITE_TRUNCATE" or table_id not in self.tables:
+            self.tables[table_id] = df.reset_index(drop=True)
+        else:
+            self.tables[table_id] = pd.concat([self.tables[table_id], df], ignore_index=True)
+        return FakeJob()
+
+    def load_table_from_file(self, file_obj, table_id, job_config=None):
+        return self._append(table_id, pd.read_parquet(file_obj), getattr(job_config, "write_disposition", None))
+
+    def load_table_from_dataframe(self, df, table_id, job_config=None):
+        return self._append(table_id, df.copy(), getattr(job_config, "write_disposition", None))
@@ -0,0 +1,141 @@
+"""
+Local stand-in for the Groq chat completions API, used by the benchmarks.
+
+Enforces its own requests/minute and tokens/minute limits over a sliding
+window, answers over-limit calls with 429 + retry-after, and sends the same
+x-ratelimit-* headers as Groq. Replies are JSON objects built from the SMS
+text, so no network or API key is needed.
+
+    server = start_stub_server(rpm=600, tpm=100_000, latency=0.25)
+    client = Groq(api_key="stub", base_url=server.base_url, max_retries=0)
+"""
+import json
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AMOUNT_REGEX = re.compile(r'(?:rs\.?|inr|₹)\s*([\d,]+(?:\.\d+)?)', re.IGNORECASE)
+
+def fake_extraction(sms_text):
+    """A deterministic 'LLM' answer for one SMS."""
+    amount = AMOUNT_REGEX.search(sms_text)
+    return {
+        "is_transaction": True,
+        "vendor_name": sms_text.split()[-1].strip('.') if sms_text.split() else "null",
+        "amount": float(amount.group(1).replace(',', '')) if amount else "null",
+        "transaction_type": "credit" if "credited" in sms_text.lower() else "debit",
+        "inferred_category": "Subscription" if "subscription" in sms_text.lower() else "Other",
+    }
+
+class StubState:
+    def __init__(self, rpm, tpm, latency, window=60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency = latency
+        self.window = window
+        self.accepted = deque() # (timestamp, tokens)
+        self.accepted_log = []
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def admit(self, tokens):
+        """Returns (ok, retry_after_seconds, remaining_requests, remaining_tokens)."""
+        with self.lock:
+            now = time.monotonic()
+            while self.accepted and now - self.accepted[0][0] >= self.window:
+                self.accepted.popleft()
+            used_tokens = sum(t for _, t in self.accepted)
+            if len(self.accepted) + 1 > self.rpm or used_tokens + tokens > self.tpm:
+                self.rejected += 1
+                retry_after = self.window - (now - self.accepted[0][0]) if self.accepted else 1.0
+                return False, retry_after, self.rpm - len(self.accepted), self.tpm - used_tokens
+            self.accepted.append((now, tokens))
+            self.accepted_log.append(now)
+            return True, 0, self.rpm - len(self.accepted), self.tpm - used_tokens - tokens
+
+    def max_requests_in_window(self):
+        """Highest number of accepted requests inside any sliding window."""
+        times = sorted(self.accepted_log)
+        best = 0
+        start = 0
+        for end in range(len(times)):
+            while times[end] - times[start] >= self.window:
+                start += 1
+            best = max(best, end - start + 1)
+        return best
+
+def build_reply(messages):
+    """Answers single-message prompts with one object, batched prompts with {"results": [...]}."""
+    user_text = messages[-1]["content"]
+    try:
+        batch = json.loads(user_text[user_text.index("["):])
+    except (ValueError, json.JSONDecodeError):
+        batch = None
+
+    if isinstance(batch, list):
+        results = []
+        for item in batch:
+            if "POISON" in item["text"]:
+                continue # Simulate the model dropping an item
+            results.append({"id": item["id"], **fake_extraction(item["text"])})
+        return json.dumps({"results": results})
+
+    sms_text = user_text.split("\n", 1)[-1]
+    if "POISON" in sms_text:
+        return "this is not json"
+    return json.dumps(fake_extraction(sms_text))
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+            ok, retry_after, remaining_requests, remaining_tokens = state.admit(prompt_tokens + 30)
+            headers = {
+                "x-ratelimit-limit-requests": str(state.rpm),
+                "x-ratelimit-limit-tokens": str(state.tpm),
+                "x-ratelimit-remaining-requests": str(max(remaining_requests, 0)),
+                "x-ratelimit-remaining-tokens": str(max(remaining_tokens, 0)),
+            }
+            if not ok:
+                headers["retry-after"] = f"{retry_after:.2f}"
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "tokens"}}, headers)
+                return
+
+            time.sleep(state.latency)
+            content = build_reply(body["messages"])
+            self._send(200, {
+                "id": "stub", "object": "chat.completion", "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 30,
+                          "total_tokens": prompt_tokens + 30},
+            }, headers)
+
+        def _send(self, status, payload, headers):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+def start_stub_server(rpm, tpm, latency=0.25, window=60.0):
+    """Starts the stub on a free localhost port in a daemon thread."""
+    state = StubState(rpm, tpm, latency, window)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
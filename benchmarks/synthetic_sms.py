@@ -0,0 +1,310 @@
+"""
+Deterministic generator for synthetic Android SMS-backup XML files.
+Used by the benchmark scripts in this folder.
+
+generate_messages() is the small fixed template set the older benchmarks
+were calibrated on. generate_inbox() is a realistic inbox at any scale
+(10k to 10M+): bank debits and credits, card spends, bills, recurring
+subscriptions on a real cadence (with a price change and a cancellation),
+OTPs, promos/spam, personal chats, Hindi/Tamil/emoji messages, plus
+duplicate deliveries, broken records and <mms> elements. The same seed
+always gives byte-identical output.
+
+    python benchmarks/synthetic_sms.py --messages 1000000 --out backup.xml
+"""
+import argparse
+import bisect
+import random
+from xml.sax.saxutils import quoteattr
+
+# 2024-01-01 00:00:00 UTC in epoch millis
+START_MILLIS = 1704067200000
+
+TEMPLATES = [
+    ("HP-HDFCBK", "Rs.{amount} debited from a/c XX{acct} on {day}-01-24 to VPA {vendor}@okaxis. Ref {ref}"),
+    ("AX-NFLX", "Your Netflix subscription payment of Rs.{amount} was charged successfully."),
+    ("VM-ICICIB", "INR {amount} credited to your A/c XX{acct}. Info: SALARY. Avl Bal: {ref}"),
+    ("AD-AMAZON", "Your OTP for login is {ref}. Do not share this code with anyone."),
+    ("TM-OFFERS", "Big sale! Flat 50% off on all items this weekend. Shop now at example.com"),
+    ("+919800000000", "Hey, are we still meeting tomorrow at {day}?"),
+    ("JD-SBIINB", "₹{amount} debited from A/c XX{acct} for UPI txn. Ref {ref}"),
+    ("+919811111111", "ok {day}"),
+]
+
+def generate_messages(n_messages, seed=42):
+    """Yields (address, date_millis, body) tuples for a reproducible corpus."""
+    rng = random.Random(seed)
+    date_millis = START_MILLIS
+    for _ in range(n_messages):
+        address, template = rng.choice(TEMPLATES)
+        date_millis += rng.randint(1000, 600000)
+        body = template.format(
+            amount=f"{rng.randint(10, 50000)}.{rng.randint(0, 99):02d}",
+            acct=rng.randint(1000, 9999),
+            day=rng.randint(1, 28),
+            vendor=rng.choice(["swiggy", "zomato", "uber", "jio", "airtel"]),
+            ref=rng.randint(100000, 999999),
+        )
+        yield address, str(date_millis), body
+
+def write_backup(path, n_messages, seed=42):
+    """Writes n_messages <sms> elements in the SMS Backup & Restore layout."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>\n")
+        f.write(f'<smses count="{n_messages}">\n')
+        for address, date_millis, body in generate_messages(n_messages, seed):
+            f.write(
+                f'  <sms protocol="0" address={quoteattr(address)} date="{date_millis}" '
+                f'type="1" body={quoteattr(body)} read="1" status="-1" />\n'
+            )
+        f.write("</smses>\n")
+    return path
+
+# --- REALISTIC INBOX ---
+# Share of each message kind in a typical inbox (recurring subscriptions come on top)
+DEFAULT_MIX = {
+    "bank_debit": 0.18,
+    "bank_credit": 0.05,
+    "card_spend": 0.06,
+    "bill": 0.04,
+    "otp": 0.20,
+    "promo": 0.22,
+    "delivery": 0.04,
+    "personal": 0.11,
+    "non_ascii": 0.10,
+}
+DUPLICATE_RATE = 0.01  # the same SMS delivered twice
+BROKEN_RATE = 0.001    # <sms> without a body
+MMS_RATE = 0.005       # <mms> elements, which ingestion skips
+
+BANKS = ["HP-HDFCBK", "VM-ICICIB", "JD-SBIINB", "AX-AXISBK", "BZ-KOTAKB", "VK-PNBSMS"]
+MERCHANTS = ["SWIGGY", "ZOMATO", "UBER", "OLA", "BLINKIT", "ZEPTO", "BIGBASKET", "DMART", "IRCTC",
+             "MAKEMYTRIP", "MYNTRA", "FLIPKART", "AMAZON", "BOOKMYSHOW", "RAPIDO", "CROMA", "NYKAA"]
+BILLERS = [("AD-AIRTEL", "AIRTEL"), ("JM-JIOINF", "JIO"), ("VM-BESCOM", "BESCOM"), ("AX-TATAPW", "TATAPOWER"),
+           ("BP-ACTFBR", "ACTFIBERNET")]
+PROMO_SENDERS = ["TM-OFFERS", "VK-MYNTRA", "AD-DOMINO", "JD-AJIOIN", "BZ-LENSKT", "VM-PLAYRM", "TX-RUMMY"]
+OTP_SENDERS = ["AD-AMAZON", "VM-PAYTMB", "JD-GOOGLE", "TX-SWIGGY", "AX-HDFCBK", "BZ-PHONPE"]
+PHONES = [f"+9198{n:08d}" for n in range(40)]
+
+TEMPLATES_BY_KIND = {
+    "bank_debit": [
+        "Rs.{amount} debited from A/c XX{acct} on {date}. UPI Ref {ref}. Paid to {merchant}",
+        "INR {amount} debited from your a/c XX{acct} on {date} towards UPI/{ref} to {merchant}",
+        "Dear Customer, Rs {amount} has been debited from account XX{acct} to VPA {vpa}@okaxis on {date}. -{merchant}",
+        "Sent Rs.{amount} from A/c XX{acct} to {merchant}",
+    ],
+    "bank_credit": [
+        "INR {amount} credited to your A/c XX{acct} on {date}. Info: NEFT-{ref}. Avl Bal Rs.{balance} -SALARY",
+        "Rs.{amount} received from {name} in your a/c XX{acct} via UPI Ref {ref}. -REFUND",
+        "Your a/c XX{acct} is credited with Rs {amount} on {date} by {merchant}",
+    ],
+    "card_spend": [
+        "Rs.{amount} spent on your credit card XX{acct} at {merchant} on {date}. Avl limit Rs.{balance}",
+        "Transaction of INR {amount} on card ending {acct} at {merchant}",
+    ],
+    "bill": [
+        "Payment of Rs.{amount} received for your {biller} bill. Txn ID {ref}. Thank you -{biller}",
+        "Your {biller} bill of Rs.{amount} is due on {date}. Pay now to avoid late fee. -{biller}",
+        "Recharge of Rs.{amount} successful on {phone}. Validity 28 days -{biller}",
+    ],
+    "otp": [
+        "{ref} is your OTP for login. Do not share this code with anyone.",
+        "Your verification code is {ref}. It expires in 10 minutes.",
+        "G-{ref} is your Google verification code.",
+        "OTP {ref} for txn of Rs.{amount} at {merchant}. Valid for 5 mins. Never share your OTP.",
+    ],
+    "promo": [
+        "Big sale! Flat {pct}% off on all items this weekend. Shop now at example.com",
+        "Get Rs.{small} cashback on your next recharge of Rs.{amount} or more. T&C apply",
+        "Congratulations! You have won a voucher worth Rs.{amount}. Claim at bit.ly/{ref}",
+        "Pre-approved personal loan of Rs.{balance} at {pct}% p.a. Apply now: example.com/{ref}",
+        "Last chance! Buy 1 Get 1 free on all pizzas today only.",
+    ],
+    "delivery": [
+        "Your order #{ref} from {merchant} has been shipped and will arrive by {date}.",
+        "Delivered: your package #{ref} was handed to a resident.",
+    ],
+    "personal": [
+        "Hey, are we still meeting tomorrow at {day}?",
+        "ok",
+        "Call me when you are free",
+        "Reached home. Talk later",
+        "Happy birthday!! Have a great year ahead",
+        "Can you send me Rs.{small} for the cab, will return tomorrow",
+    ],
+    "non_ascii": [
+        "\u20b9{amount} debited from A/c XX{acct} for UPI txn. Ref {ref}",
+        "\u0906\u092a\u0915\u0947 \u0916\u093e\u0924\u0947 XX{acct} \u0938\u0947 Rs.{amount} "
+        "\u0921\u0947\u092c\u093f\u091f \u0915\u093f\u090f \u0917\u090f\u0964 Ref {ref}",
+        "\u0936\u093e\u0928\u0926\u093e\u0930 \u0911\u092b\u0930! {pct}% \u0915\u0940 \u091b\u0942\u091f, "
+        "\u0906\u091c \u0939\u0940 \u0916\u0930\u0940\u0926\u0947\u0902",
+        "\u0b89\u0b99\u0bcd\u0b95\u0bb3\u0bcd OTP {ref}. \u0baf\u0bbe\u0bb0\u0bbf\u0b9f\u0bae\u0bc1\u0bae\u0bcd "
+        "\u0baa\u0b95\u0bbf\u0bb0 \u0bb5\u0bc7\u0ba3\u0bcd\u0b9f\u0bbe\u0bae\u0bcd",
+        "Happy Diwali \U0001fa94\u2728 Wishing you and your family lots of joy \U0001f60a",
+        "On my way \U0001f697 see you in {day} mins \U0001f44d",
+    ],
+}
+SENDERS_BY_KIND = {
+    "bank_debit": BANKS, "bank_credit": BANKS, "card_spend": BANKS, "otp": OTP_SENDERS,
+    "promo": PROMO_SENDERS, "delivery": ["AD-AMAZON", "VM-FLPKRT", "JD-DELHVY"], "personal": PHONES,
+    "non_ascii": BANKS[:2] + PROMO_SENDERS[:2] + PHONES[:5],
+}
+
+# (sender, merchant, amount, cadence in days, first charge in days, (charge index, new amount) or None,
+#  charges after which the subscription is cancelled or None)
+SUBSCRIPTIONS = [
+    ("AX-NFLX", "NETFLIX", 649.00, 30.44, 4, (8, 799.00), None),
+    ("AD-SPOTFY", "SPOTIFY", 119.00, 30.44, 11, None, None),
+    ("JD-HOTSTR", "HOTSTAR", 299.00, 30.44, 20, None, 7),
+    ("VM-YTPREM", "YOUTUBE", 129.00, 30.44, 2, None, None),
+    ("HP-HDFCBK", "CULTFIT", 1499.00, 30.44, 15, (5, 1699.00), None),
+    ("AD-AMAZON", "PRIMEVIDEO", 1499.00, 365.25, 40, None, None),
+    ("BZ-KOTAKB", "TIMESPRIME", 99.00, 7, 3, None, None),
+]
+SUBSCRIPTION_TEMPLATE = "Rs.{amount} charged on your card XX{acct} towards subscription to {merchant}"
+
+DAY_MILLIS = 86_400_000
+
+class _Fields(dict):
+    """Template values drawn only when a template asks for them (format_map)."""
+    def __init__(self, rng, date_millis):
+        super().__init__()
+        self.rng = rng
+        self.date_millis = date_millis
+
+    def __missing__(self, key):
+        rng = self.rng
+        if key == "amount":
+            value = f"{rng.lognormvariate(6, 1.2):.2f}"
+        elif key == "small":
+            value = rng.choice([50, 100, 150, 200, 500])
+        elif key == "balance":
+            value = f"{rng.randint(1000, 900000)}.{rng.randint(0, 99):02d}"
+        elif key == "acct":
+            value = rng.randint(1000, 9999)
+        elif key == "ref":
+            value = rng.randint(100000, 999999)
+        elif key == "pct":
+            value = rng.choice([10, 20, 30, 50, 70])
+        elif key == "day":
+            value = rng.randint(1, 28)
+        elif key == "date":
+            day = (self.date_millis - START_MILLIS) // DAY_MILLIS
+            value = f"{day % 28 + 1:02d}-{day // 30 % 12 + 1:02d}-{24 + day // 365}"
+        elif key in ("merchant", "vpa"):
+            value = rng.choice(MERCHANTS)
+            value = value.lower() if key == "vpa" else value
+        elif key == "name":
+            value = rng.choice(["RAHUL S", "PRIYA K", "ANIL M", "SNEHA R"])
+        elif key == "phone":
+            value = rng.choice(PHONES)
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+def _subscription_schedule(span_millis):
+    """Every subscription charge inside the span, as (date_millis, address, body), in date order."""
+    charges = []
+    for address, merchant, amount, cadence, first, price_change, cancelled_after in SUBSCRIPTIONS:
+        index = 0
+        date = START_MILLIS + int(first * DAY_MILLIS) + 9 * 3_600_000
+        while date < START_MILLIS + span_millis and (cancelled_after is None or index < cancelled_after):
+            if price_change and index >= price_change[0]:
+                amount = price_change[1]
+            body = SUBSCRIPTION_TEMPLATE.format(amount=f"{amount:.2f}", acct=4321, merchant=merchant)
+            charges.append((date, address, body))
+            index += 1
+            date = START_MILLIS + int((first + index * cadence) * DAY_MILLIS) + 9 * 3_600_000
+    return sorted(charges)
+
+def generate_inbox(n_messages, seed=42, span_days=730, mix=None):
+    """
+    Yields (kind, address, date_millis, body) for a realistic inbox of about
+    n_messages spread over span_days. kind is a DEFAULT_MIX key,
+    'subscription', 'duplicate', 'broken' (body is None) or 'mms'.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    cumulative = []
+    total = 0.0
+    for kind in kinds:
+        total += mix[kind]
+        cumulative.append(total)
+
+    span_millis = span_days * DAY_MILLIS
+    mean_gap = max(1, span_millis // max(n_messages, 1))
+    subscriptions = _subscription_schedule(span_millis)
+    next_subscription = 0
+    date_millis = START_MILLIS
+    previous = None
+
+    for _ in range(n_messages):
+        date_millis += rng.randint(1, 2 * mean_gap)
+        while next_subscription < len(subscriptions) and subscriptions[next_subscription][0] <= date_millis:
+            charge_date, address, body = subscriptions[next_subscription]
+            next_subscription += 1
+            yield "subscription", address, str(charge_date), body
+
+        roll = rng.random()
+        if previous and roll < DUPLICATE_RATE:
+            yield ("duplicate",) + previous[1:]
+            continue
+        if roll < DUPLICATE_RATE + BROKEN_RATE:
+            yield "broken", rng.choice(BANKS), str(date_millis), None
+            continue
+        if roll < DUPLICATE_RATE + BROKEN_RATE + MMS_RATE:
+            yield "mms", rng.choice(PHONES), str(date_millis), "photo"
+            continue
+
+        kind = kinds[min(bisect.bisect(cumulative, rng.random() * total), len(kinds) - 1)]
+        fields = _Fields(rng, date_millis)
+        if kind == "bill":
+            address, fields["biller"] = rng.choice(BILLERS)
+        else:
+            address = rng.choice(SENDERS_BY_KIND[kind])
+        body = rng.choice(TEMPLATES_BY_KIND[kind]).format_map(fields)
+        previous = (kind, address, str(date_millis), body)
+        yield previous
+
+def write_inbox_backup(path, n_messages, seed=42, span_days=730, mix=None):
+    """
+    Writes generate_inbox() in the SMS Backup & Restore layout. Returns
+    {kind: count}, so callers know how many rows each stage should see.
+    """
+    counts = {}
+    lines = []
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>\n")
+        f.write(f'<smses count="{n_messages}">\n')
+        for kind, address, date_millis, body in generate_inbox(n_messages, seed, span_days, mix):
+            counts[kind] = counts.get(kind, 0) + 1
+            if kind == "mms":
+                lines.append(
+                    f'  <mms date="{date_millis}" msg_box="1" address={quoteattr(address)}>'
+                    f'<parts><part seq="0" ct="image/jpeg" name="IMG.jpg" /></parts></mms>\n')
+            elif body is None:
+                lines.append(f'  <sms protocol="0" address={quoteattr(address)} date="{date_millis}" type="1" />\n')
+            else:
+                lines.append(
+                    f'  <sms protocol="0" address={quoteattr(address)} date="{date_millis}" '
+                    f'type="1" body={quoteattr(body)} read="1" status="-1" />\n')
+            if len(lines) >= 10000:
+                f.writelines(lines)
+                lines = []
+        f.writelines(lines)
+        f.write("</smses>\n")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--span-days", type=int, default=730)
+    parser.add_argument("--out", default="synthetic_backup.xml")
+    args = parser.parse_args()
+    counts = write_inbox_backup(args.out, args.messages, args.seed, args.span_days)
+    print(f"Wrote {sum(counts.values()):,} elements to {args.out}:")
+    for kind, count in sorted(counts.items(), key=lambda kv: -kv[1]):
+        print(f"  {kind:<14} {count:>10,}")
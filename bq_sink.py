@@ -0,0 +1,141 @@
+"""
+Buffered warehouse sink for enriched transactions.
+
+Rows are spooled locally to a Parquet file and written with ONE load job
+when the buffer reaches `max_rows` or gets older than `max_age_seconds`,
+instead of one blocking load job per 20-row batch. There is no timer: the
+age is checked when add() or flush_if_due() is called, and the caller
+flushes what is left when its stream ends. `on_flush` is called
+with the auto_ids of the flushed rows only after the load job succeeded,
+so Postgres never marks a row 'processed' before it is in the warehouse.
+
+Loads go through a warehouse backend (warehouse.py), so the same sink
+writes to BigQuery, a local DuckDB file, or a fake BigQuery client.
+
+With a `partition_field`, the months the buffered rows fall into are
+logged in warehouse.DIRTY_MONTHS_TABLE before each load, so the models
+downstream rebuild only those months.
+"""
+import os
+import tempfile
+import time
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import metrics
+import warehouse
+
+# BigQuery column type -> Arrow type for the spool file. TIMESTAMP must carry a
+# time zone: BigQuery reads a naive Parquet timestamp as DATETIME.
+ARROW_TYPES = {
+    "INT64": pa.int64(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    "STRING": pa.string(),
+    "BOOL": pa.bool_(),
+    "FLOAT64": pa.float64(),
+}
+
+LOAD_SECONDS = metrics.histogram('warehouse_load_seconds', 'Duration of one warehouse load job, by table')
+ROWS_LOADED = metrics.counter('warehouse_rows_loaded_total', 'Rows committed to the warehouse, by table')
+LOAD_FAILURES = metrics.counter('warehouse_load_failures_total', 'Load jobs that raised, by table')
+
+class BufferedBigQuerySink:
+    def __init__(self, backend, table_name, schema, on_flush=None,
+                 max_rows=50000, max_age_seconds=300, spool_dir=None, partition_field=None):
+        self.backend = backend
+        self.table_name = table_name
+        self.schema = schema
+        self.on_flush = on_flush
+        self.max_rows = max_rows
+        self.max_age_seconds = max_age_seconds
+        self.spool_dir = spool_dir
+        self.partition_field = partition_field
+        self.arrow_schema = pa.schema([(name, ARROW_TYPES[field_type]) for name, field_type in schema])
+        self.timestamp_columns = [name for name, field_type in schema if field_type == "TIMESTAMP"]
+
+        self.writer = None
+        self.spool_path = None
+        self.buffered_rows = 0
+        self.pending_ids = []
+        self.pending_months = set()
+        self.oldest_row_at = None
+        self.load_jobs = 0
+
+    def as_utc(self, df):
+        """TIMESTAMP columns as UTC; naive values (Postgres timestamp_utc) are taken to be UTC already."""
+        converted = {}
+        for column in self.timestamp_columns:
+            stamps = pd.to_datetime(df[column])
+            converted[column] = stamps.dt.tz_localize("UTC") if stamps.dt.tz is None else stamps.dt.tz_convert("UTC")
+        return df.assign(**converted) if converted else df
+
+    def add(self, df, auto_ids):
+        """Buffers a DataFrame of enriched rows; flushes if a threshold is hit."""
+        if df.empty:
+            return
+        df = self.as_utc(df)
+        if self.writer is None:
+            fd, self.spool_path = tempfile.mkstemp(suffix=".parquet", dir=self.spool_dir)
+            os.close(fd)
+            self.writer = pq.ParquetWriter(self.spool_path, self.arrow_schema)
+            self.oldest_row_at = time.monotonic()
+
+        table = pa.Table.from_pandas(df, schema=self.arrow_schema, preserve_index=False, safe=False)
+        self.writer.write_table(table)
+        self.buffered_rows += len(df)
+        self.pending_ids.extend(auto_ids)
+        if self.partition_field:
+            stamps = pd.to_datetime(df[self.partition_field]).dropna()
+            months = pd.unique(stamps.dt.year * 12 + stamps.dt.month - 1)
+            self.pending_months.update(date(int(m) // 12, int(m) % 12 + 1, 1) for m in months)
+
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flushes when the buffer is full or too old. Returns rows loaded."""
+        return self.flush() if self.should_flush() else 0
+
+    def should_flush(self):
+        if not self.buffered_rows:
+            return False
+        return (self.buffered_rows >= self.max_rows
+                or time.monotonic() - self.oldest_row_at >= self.max_age_seconds)
+
+    def flush(self):
+        """Loads everything buffered in one job, then runs on_flush. Returns rows loaded."""
+        if self.writer is None:
+            return 0
+        self.writer.close()
+        self.writer = None
+
+        rows = self.buffered_rows
+        print(f"Loading {rows} buffered rows into the {self.backend.name} warehouse in one job...")
+        try:
+            # Logged first: a month marked dirty for nothing only costs a rebuild
+            if self.pending_months:
+                warehouse.record_dirty_months(self.backend, self.table_name, self.pending_months)
+            with LOAD_SECONDS.time(table=self.table_name):
+                self.backend.load_parquet(self.spool_path, self.table_name, self.schema)
+        except Exception:
+            LOAD_FAILURES.inc(table=self.table_name)
+            # Keep the spool file for inspection; nothing is marked processed
+            print(f"Load job failed; spooled rows kept at {self.spool_path}")
+            raise
+        self.load_jobs += 1
+        ROWS_LOADED.inc(rows, table=self.table_name)
+        print(f"Successfully loaded {rows} rows to {self.table_name}.")
+
+        # Only now is it safe to tell Postgres these rows are done
+        if self.on_flush:
+            self.on_flush(self.pending_ids)
+
+        os.remove(self.spool_path)
+        self.spool_path = None
+        self.buffered_rows = 0
+        self.pending_ids = []
+        self.pending_months = set()
+        self.oldest_row_at = None
+        return rows
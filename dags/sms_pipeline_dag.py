@@ -1,6 +1,5 @@
 from airflow import DAG
 from airflow.operators.python import PythonOperator
-from airflow.providers.google.cloud.operators.bigquery import BigQueryExecuteQueryOperator
 from datetime import datetime, timedelta
 import sys
 import os
@@ -8,11 +7,32 @@ import os
 # Add your source folder so Airflow can find your scripts
 sys.path.insert(0, "/opt/airflow/projects/src")
 
-# Import your actual scripts
-import ingest_xml
-import pre_filter_data
-import process_nlp_groq
-import run_analytics
+# The task scripts are imported inside the callables, not here: the scheduler
+# re-parses this file constantly and should not pay for pandas, Groq or
+# BigQuery imports. Their clients are built by pipeline_context.py when a task runs.
+def ingest_xml_backup():
+    import ingest_xml
+    ingest_xml.ingest_xml_data()
+
+def pre_filter_sms():
+    import pre_filter_data
+    pre_filter_data.main()
+
+def enrich_transactions_groq():
+    import process_nlp_groq
+    process_nlp_groq.main()
+
+def run_warehouse_models():
+    import run_analytics
+    run_analytics.build_monthly_spend()
+
+def detect_anomalies():
+    import run_analytics
+    run_analytics.run_anomaly_detection()
+
+def detect_subscriptions():
+    import run_analytics
+    run_analytics.run_subscription_detection()
 
 # Default arguments for the DAG
 default_args = {
@@ -35,35 +55,38 @@ with DAG(
     # Task 1: Ingest XML Data
     t1_ingest = PythonOperator(
         task_id='ingest_xml_backup',
-        python_callable=ingest_xml.ingest_xml_data
+        python_callable=ingest_xml_backup
     )
 
     # Task 2: Pre-filter Junk (Regex)
     t2_filter = PythonOperator(
         task_id='pre_filter_sms',
-        python_callable=pre_filter_data.main
+        python_callable=pre_filter_sms
     )
 
     # Task 3: AI Enrichment (Groq)
     t3_enrich = PythonOperator(
         task_id='enrich_transactions_groq',
-        python_callable=process_nlp_groq.main
+        python_callable=enrich_transactions_groq
     )
 
-    # Task 4: BigQuery Data Modeling (SQL)
-   
-    t4_model = BigQueryExecuteQueryOperator(
-        task_id='run_bigquery_models',
-        sql="CALL --",
-        use_legacy_sql=False,
-        gcp_conn_id='google_cloud_default'
+    # Task 4: Data Modeling (SQL on the configured warehouse backend)
+    t4_model = PythonOperator(
+        task_id='run_warehouse_models',
+        python_callable=run_warehouse_models
     )
 
     # Task 5: Anomaly Detection
     t5_analyze = PythonOperator(
         task_id='detect_anomalies',
-        python_callable=run_analytics.run_anomaly_detection
+        python_callable=detect_anomalies
+    )
+
+    # Task 6: Recurring Subscription Detection
+    t6_subscriptions = PythonOperator(
+        task_id='detect_subscriptions',
+        python_callable=detect_subscriptions
     )
 
     # Define the workflow order
-    t1_ingest >> t2_filter >> t3_enrich >> t4_model >> t5_analyze
\ No newline at end of file
+    t1_ingest >> t2_filter >> t3_enrich >> t4_model >> [t5_analyze, t6_subscriptions]
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""
+Concurrent, rate-limit-aware engine for Groq chat completions.
+
+A token bucket tracks both requests per minute and tokens per minute, is
+corrected by the x-ratelimit-* headers Groq sends back, and pauses every
+worker when a 429 arrives. A thread pool keeps as many requests in flight
+as the limits allow instead of sleeping a fixed 3 seconds per message.
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import groq
+
+import metrics
+
+# Errors worth retrying after a pause; anything else is a real failure
+RETRYABLE_ERRORS = (
+    groq.RateLimitError,
+    groq.InternalServerError,
+    groq.APIConnectionError,
+    groq.APITimeoutError,
+)
+
+LLM_REQUEST_SECONDS = metrics.histogram('llm_request_seconds', 'Latency of successful chat completions')
+LLM_TOKENS = metrics.counter('llm_tokens_total', 'Tokens reported by the API', task='enrichment')
+LLM_RETRIES = metrics.counter('llm_retries_total', 'Retried chat completions, by error type')
+LLM_RATE_LIMIT_WAIT = metrics.histogram('llm_rate_limit_wait_seconds', 'Time spent waiting for the rate limiter')
+
+def parse_reset_duration(value):
+    """Parses Groq reset headers like '7.66s', '2m59.56s' or '150ms' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        seconds += float(amount) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return seconds
+
+def estimate_tokens(messages, completion_tokens=150):
+    """Rough prompt size (about 4 characters per token) plus room for the reply."""
+    prompt_chars = sum(len(m['content']) for m in messages)
+    return prompt_chars // 4 + completion_tokens
+
+class RateLimiter:
+    """
+    Token bucket over two budgets: requests/minute and tokens/minute.
+    Both buckets start full and refill continuously. Thread-safe.
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.available_requests = min(
+            self.requests_per_minute, self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(
+            self.tokens_per_minute, self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens):
+        """Blocks until one request and `tokens` tokens can be spent."""
+        # A single request larger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.available_requests >= 1 and self.available_tokens >= tokens:
+                        self.available_requests -= 1
+                        self.available_tokens -= tokens
+                        return
+                    wait = max(
+                        (1 - self.available_requests) * 60 / self.requests_per_minute,
+                        (tokens - self.available_tokens) * 60 / self.tokens_per_minute,
+                    )
+            time.sleep(max(wait, 0.01))
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Corrects the bucket once the real token count of a call is known."""
+        if actual_tokens is None:
+            return
+        with self.lock:
+            self.available_tokens -= actual_tokens - estimated_tokens
+
+    def pause(self, seconds):
+        """Stops every caller for `seconds` (used after a 429)."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """Trusts the server when it reports less budget than we think we have."""
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        with self.lock:
+            self._refill(time.monotonic())
+            if remaining_tokens is not None:
+                self.available_tokens = min(self.available_tokens, float(remaining_tokens))
+        if remaining_requests is not None and float(remaining_requests) <= 0:
+            reset = parse_reset_duration(headers.get('x-ratelimit-reset-requests'))
+            if reset:
+                self.pause(reset)
+
+class GroqEngine:
+    """
+    Runs chat completions through a shared RateLimiter with retries and
+    exponential backoff. `map` fans calls out over a thread pool.
+    """
+    def __init__(self, client, limiter, max_workers=8, max_retries=6, backoff_base=1.0):
+        self.client = client
+        self.limiter = limiter
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'tokens': 0}
+
+    def _count(self, **increments):
+        with self.stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def complete_json(self, messages, model="llama-3.1-8b-instant", completion_tokens=150):
+        """
+        One JSON-mode completion, retried on 429/5xx/connection errors.
+        Returns (parsed JSON, total tokens used). Raises
+        json.JSONDecodeError for a malformed reply and the Groq error once
+        retries are exhausted.
+        """
+        estimated = estimate_tokens(messages, completion_tokens)
+        for attempt in range(self.max_retries + 1):
+            with LLM_RATE_LIMIT_WAIT.time():
+                self.limiter.acquire(estimated)
+            start = time.perf_counter()
+            try:
+                raw = self.client.chat.completions.with_raw_response.create(
+                    messages=messages,
+                    model=model,
+                    temperature=0.0,
+                    response_format={"type": "json_object"},
+                )
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                self._count(retries=1)
+                LLM_RETRIES.inc(error=type(e).__name__)
+                delay = self.backoff_base * 2 ** attempt * (1 + random.random())
+                headers = getattr(getattr(e, 'response', None), 'headers', {}) or {}
+                if isinstance(e, groq.RateLimitError):
+                    self._count(rate_limited=1)
+                    delay = parse_reset_duration(headers.get('retry-after')) or delay
+                    self.limiter.update_from_headers(headers)
+                    self.limiter.pause(delay) # Everyone backs off, not just this thread
+                print(f"  Groq call failed ({type(e).__name__}), retrying in {delay:.1f}s...", file=sys.stderr)
+                time.sleep(delay)
+                continue
+
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start)
+            self.limiter.update_from_headers(raw.headers)
+            completion = raw.parse()
+            total_tokens = completion.usage.total_tokens if completion.usage else None
+            self.limiter.record_usage(estimated, total_tokens)
+            self._count(requests=1, tokens=total_tokens or 0)
+            LLM_TOKENS.inc(total_tokens or 0)
+            return json.loads(completion.choices[0].message.content), total_tokens or 0
+
+    def map(self, fn, items):
+        """Applies fn to every item concurrently and returns results in order."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(fn, items))
@@ -1,23 +1,40 @@
 import xml.etree.ElementTree as ET
-import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import text
+import io
 import os
+import sys
+import time
+import uuid
 import hashlib
-from datetime import datetime
+import multiprocessing
+from datetime import date, datetime
+
+from pipeline_context import get_context
+import metrics
+import pg_partitions
 
 # --- CONFIGURATION ---
 XML_FILE_PATH = " "   
-DB_USER = "your_username_here"
-DB_PASS = os.getenv('VARIABLE_NAME')
-DB_HOST = "your_host_here"
-DB_PORT = "your_port_here"
-DB_NAME = "your_db_name_here"
+# Watermarks are tracked per source, e.g. one per device backup
+SOURCE_NAME = "android_sms_backup"
+# Postgres credentials live in pipeline_context.py; the engine is built when the task runs
+
+# Number of <sms> records parsed and loaded per round trip
+BATCH_SIZE = 5000
+
+# ingest_backups(): a folder of backups (one sub-folder per device) spread over a process pool
+BACKUP_DIR = " "
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(os.cpu_count() or 1)))
+# Backups bigger than this are split into byte ranges parsed in parallel
+SHARD_BYTES = int(os.getenv('INGEST_SHARD_BYTES', str(64 * 1024 * 1024)))
 
-if not DB_PASS:
-    print("ERROR: DB_PASS environment variable not set.")
-    exit(1)
+MESSAGES_PARSED = metrics.counter('ingest_messages_parsed_total', 'SMS records parsed from the backup', task='ingest')
+MESSAGES_SKIPPED = metrics.counter('ingest_messages_skipped_total', 'SMS records not loaded, by reason', task='ingest')
+ROWS_LOADED = metrics.counter('ingest_rows_total', 'Rows sent to Postgres, by outcome', task='ingest')
+COPY_SECONDS = metrics.histogram('ingest_copy_seconds', 'COPY + merge of one batch')
+SHARD_SECONDS = metrics.histogram('ingest_shard_seconds', 'Parse, hash and stage of one byte range')
 
-DATABASE_URL = f'postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+RAW_COLUMNS = ['source_message_id', 'timestamp_utc', 'sender_address', 'message_body', 'processing_status']
 
 def generate_unique_id(address, date_str, body):
     """
@@ -27,76 +44,573 @@ def generate_unique_id(address, date_str, body):
     raw_string = f"{address}{date_str}{body}"
     return hashlib.md5(raw_string.encode('utf-8')).hexdigest()
 
-def ingest_xml_data():
-    print(f"--- Starting Ingestion for {XML_FILE_PATH} ---")
+def build_sms_record(address, date_millis, body):
+    """Turns the attributes of one <sms> element into a raw_notifications row."""
+    if not body or not date_millis:
+        return None # Skip broken records
+
+    # Convert Epoch Millis to DateTime
+    # 1732012639586 -> 2025-11-19 ...
+    timestamp = datetime.fromtimestamp(int(date_millis) / 1000.0)
+
+    return {
+        'source_message_id': generate_unique_id(address, date_millis, body),
+        'timestamp_utc': timestamp,
+        'sender_address': address,
+        'message_body': body,
+        'processing_status': 'pending'
+    }
+
+def boundary_digest(unique_ids):
+    """Order-independent digest of the message IDs sharing the watermark millis."""
+    return hashlib.sha256("\n".join(sorted(unique_ids)).encode('utf-8')).hexdigest()
+
+class Watermark:
+    """
+    The newest `date` millis already ingested for a source, plus a digest of
+    the IDs at exactly that millis. Anything older is skipped before hashing;
+    ties at the boundary are only re-ingested if their IDs changed.
+    """
+    def __init__(self, max_date_millis=None, digest=None):
+        self.max_date_millis = max_date_millis
+        self.digest = digest
+        # The watermark this run will persist once every batch is loaded
+        self.next_max_date_millis = max_date_millis
+        self.next_boundary_ids = []
+
+    def is_old(self, date_millis):
+        return self.max_date_millis is not None and date_millis < self.max_date_millis
+
+    def is_boundary(self, date_millis):
+        return date_millis == self.max_date_millis
+
+    def observe(self, date_millis, unique_id):
+        if self.next_max_date_millis is None or date_millis > self.next_max_date_millis:
+            self.next_max_date_millis = date_millis
+            self.next_boundary_ids = [unique_id]
+        elif date_millis == self.next_max_date_millis:
+            self.next_boundary_ids.append(unique_id)
+
+    def merge(self, max_date_millis, boundary_ids):
+        """Folds in what another shard of the same source observed."""
+        if max_date_millis is None:
+            return
+        if self.next_max_date_millis is None or max_date_millis > self.next_max_date_millis:
+            self.next_max_date_millis = max_date_millis
+            self.next_boundary_ids = list(boundary_ids)
+        elif max_date_millis == self.next_max_date_millis:
+            self.next_boundary_ids.extend(boundary_ids)
+
+    def next_digest(self):
+        if not self.next_boundary_ids:
+            return self.digest # Nothing at or past the old boundary was seen
+        return boundary_digest(self.next_boundary_ids)
+
+def iter_sms_batches(xml_path, batch_size=BATCH_SIZE, watermark=None, boundary_records=None):
+    """
+    Streams the backup (a path or a binary file object) with iterparse and
+    yields lists of at most batch_size records. Every top-level element is
+    cleared from the tree once it is handled, so memory stays flat no
+    matter how big the file is.
+
+    With a watermark, messages older than it are dropped before hashing and
+    the ones sharing its millis are held back until the end of the file.
+    Pass a boundary_records list to collect those instead, when the file
+    is only one shard of the backup and the caller decides on them.
+    """
+    batch = []
+    hold_boundary = boundary_records is None
+    if hold_boundary:
+        boundary_records = []
+    depth = 0
+    root = None
+    old = 0
+    broken = 0
+
+    for event, elem in ET.iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue # Only direct children of <smses> are messages
+
+        # The file format is usually <smses><sms ... /><sms ... /></smses>
+        # We take everything and let the NLP filter handle it.
+        date_millis = elem.get('date')
+        if elem.tag == 'sms' and date_millis:
+            if watermark and watermark.is_old(int(date_millis)):
+                root.clear()
+                old += 1
+                continue # Already ingested by an earlier run
+
+            record = build_sms_record(elem.get('address'), date_millis, elem.get('body'))
+            if record is None:
+                broken += 1
+            if record and watermark:
+                watermark.observe(int(date_millis), record['source_message_id'])
+                if watermark.is_boundary(int(date_millis)):
+                    boundary_records.append(record)
+                    record = None
+            if record:
+                batch.append(record)
+
+        # Drop the handled element (and any <mms> subtree) from the root
+        root.clear()
+
+        if len(batch) >= batch_size:
+            MESSAGES_PARSED.inc(len(batch))
+            yield batch
+            batch = []
+
+    # The boundary millis is done if it still holds exactly the same messages
+    if hold_boundary and boundary_records:
+        ids = [r['source_message_id'] for r in boundary_records]
+        if boundary_digest(ids) != watermark.digest:
+            batch.extend(boundary_records)
+        else:
+            MESSAGES_SKIPPED.inc(len(boundary_records), reason='boundary_unchanged')
+    MESSAGES_SKIPPED.inc(old, reason='watermark')
+    MESSAGES_SKIPPED.inc(broken, reason='broken')
+
+    if batch:
+        MESSAGES_PARSED.inc(len(batch))
+        yield batch
+
+def ensure_watermark_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS ingest_watermarks (
+                source_name TEXT PRIMARY KEY,
+                max_date_millis BIGINT NOT NULL,
+                boundary_digest TEXT NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+
+def load_watermark(engine, source_name):
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("SELECT max_date_millis, boundary_digest FROM ingest_watermarks WHERE source_name = :source"),
+            {'source': source_name}
+        ).fetchone()
+    if row is None:
+        return Watermark()
+    return Watermark(row.max_date_millis, row.boundary_digest)
+
+def save_watermark(engine, source_name, watermark):
+    """Persists the watermark reached by this run. Only call after every batch is loaded."""
+    if watermark.next_max_date_millis is None:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO ingest_watermarks (source_name, max_date_millis, boundary_digest)
+            VALUES (:source, :max_millis, :digest)
+            ON CONFLICT (source_name) DO UPDATE
+            SET max_date_millis = EXCLUDED.max_date_millis,
+                boundary_digest = EXCLUDED.boundary_digest,
+                updated_at = now()
+        """), {
+            'source': source_name,
+            'max_millis': watermark.next_max_date_millis,
+            'digest': watermark.next_digest(),
+        })
+
+def ensure_dedup_index(engine):
+    """
+    ON CONFLICT DO NOTHING needs a unique index on the message ID to skip
+    duplicates. On the partitioned table it has to include timestamp_utc;
+    the ID is a hash of the date, so the pair is exactly as unique as the
+    ID. A table not yet migrated (pg_partitions.py) keeps the index on the
+    ID alone, so COPY merges don't maintain two.
+    """
+    pg_partitions.ensure_raw_notifications(engine)
+    with engine.begin() as conn:
+        if pg_partitions.is_partitioned(conn):
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS raw_notifications_message_key "
+                "ON raw_notifications (source_message_id, timestamp_utc)"
+            ))
+        else:
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS raw_notifications_source_message_id_key "
+                "ON raw_notifications (source_message_id)"
+            ))
+            conn.execute(text("DROP INDEX IF EXISTS raw_notifications_message_key"))
+
+def batch_months(batch):
+    return {date(r['timestamp_utc'].year, r['timestamp_utc'].month, 1) for r in batch}
+
+def to_copy_field(value):
+    """Escapes one value for COPY's text format (NULL is \\N)."""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def to_copy_buffer(batch, first_row_num=None):
+    """The batch in COPY text format, optionally with a running row number in front."""
+    buffer = io.StringIO()
+    for i, record in enumerate(batch):
+        if first_row_num is not None:
+            buffer.write(f"{first_row_num + i}\t")
+        buffer.write('\t'.join(to_copy_field(record[col]) for col in RAW_COLUMNS))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+def stage_and_merge(cur, buffer, returning=None):
+    """
+    COPYs a to_copy_buffer() into the session's temp staging table and
+    merges it into raw_notifications, skipping IDs that are already there.
+    Returns the number of rows inserted, or the inserted rows' `returning`
+    columns. The caller commits.
+    """
+    columns = ", ".join(RAW_COLUMNS)
+    # Lives as long as the pooled connection, emptied on every commit
+    cur.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS raw_notifications_staging ON COMMIT DELETE ROWS "
+        f"AS SELECT {columns} FROM raw_notifications WITH NO DATA"
+    )
+    cur.copy_expert(f"COPY raw_notifications_staging ({columns}) FROM STDIN", buffer)
+    # No conflict target: the dedup index differs before and after partitioning
+    cur.execute(
+        f"INSERT INTO raw_notifications ({columns}) "
+        f"SELECT {columns} FROM raw_notifications_staging "
+        f"ON CONFLICT DO NOTHING"
+        + (f" RETURNING {returning}" if returning else "")
+    )
+    return cur.fetchall() if returning else cur.rowcount
+
+def copy_batch_to_postgres(batch, engine):
+    """
+    Streams one batch into a temp staging table with COPY, then merges it
+    into raw_notifications, skipping IDs that are already there.
+    Returns (inserted, skipped).
+    """
+    pg_partitions.ensure_partitions(engine, batch_months(batch))
+    buffer = to_copy_buffer(batch)
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cur:
+            inserted = stage_and_merge(cur, buffer)
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+    return inserted, len(batch) - inserted
+
+@metrics.task('ingest')
+def ingest_xml_data(xml_path=XML_FILE_PATH, source_name=SOURCE_NAME):
+    print(f"--- Starting Ingestion for {xml_path} ---")
     
     try:
-        # 1. Parse the XML
-        print("Parsing XML file (this might take a moment)...")
-        tree = ET.parse(XML_FILE_PATH)
-        root = tree.getroot()
-        
-        sms_list = []
-        
-        # 2. Iterate through every <sms> tag
-        # The file format is usually <smses><sms ... /><sms ... /></smses>
-        for sms in root.findall('sms'):
-            
-            # We only want RECEIVED messages (type='1' is usually Inbox)
-            # But for safety, let's take everything and let the NLP filter handle it.
-            
-            address = sms.get('address') # Sender (e.g., "HP-HDFCBK")
-            body = sms.get('body')       # The text
-            date_millis = sms.get('date') # Timestamp in milliseconds
-            
-            if not body or not date_millis:
-                continue # Skip broken records
-
-            # Convert Epoch Millis to DateTime
-            # 1732012639586 -> 2025-11-19 ...
-            timestamp = datetime.fromtimestamp(int(date_millis) / 1000.0)
-            
-            # Create a unique ID
-            unique_id = generate_unique_id(address, date_millis, body)
-            
-            sms_list.append({
-                'source_message_id': unique_id,
-                'timestamp_utc': timestamp,
-                'sender_address': address,
-                'message_body': body,
-                'processing_status': 'pending'
-            })
-            
-        print(f"Parsed {len(sms_list)} SMS messages.")
-        
-        # 3. Convert to DataFrame
-        df = pd.DataFrame(sms_list)
-        
-        # 4. Load to Postgres
-        engine = create_engine(DATABASE_URL)
-        
-        # We use "ON CONFLICT DO NOTHING" logic via pandas (loading all, removing dupes)
-        # Ideally, we check existing IDs, but for a portfolio project, 
-        # cleaning the table first is acceptable.
-        
-        print("Inserting into Postgres...")
-        
-        # chunksize helps prevent memory errors with large XMLs
-        df.to_sql('raw_notifications', 
-                  engine, 
-                  if_exists='append', 
-                  index=False, 
-                  method='multi',
-                  chunksize=1000) 
-
-        print(f"Successfully ingested {len(df)} messages into Postgres.")
+        engine = get_context().pg_engine
+        ensure_dedup_index(engine)
+        ensure_watermark_table(engine)
+        total_inserted = 0
+        total_skipped = 0
+
+        # 1. Only messages newer than the last run (or tied with it) are parsed
+        watermark = load_watermark(engine, source_name)
+        if watermark.max_date_millis is not None:
+            print(f"Resuming '{source_name}' from date millis {watermark.max_date_millis}.")
+
+        # 2. Stream the XML in fixed-size batches instead of building the whole tree
+        print(f"Streaming XML file in batches of {BATCH_SIZE}...")
+        for batch in iter_sms_batches(xml_path, BATCH_SIZE, watermark):
+
+            # 3. COPY each batch to Postgres as soon as it is parsed.
+            # Messages we already have are skipped, so re-running on the same backup is safe.
+            with COPY_SECONDS.time():
+                inserted, skipped = copy_batch_to_postgres(batch, engine)
+            total_inserted += inserted
+            total_skipped += skipped
+            ROWS_LOADED.inc(inserted, outcome='inserted')
+            ROWS_LOADED.inc(skipped, outcome='duplicate')
+
+        # 4. Advance the watermark only once everything is safely loaded
+        save_watermark(engine, source_name, watermark)
+
+        print(f"Successfully ingested {total_inserted} new messages into Postgres "
+              f"({total_skipped} duplicates skipped).")
 
     except FileNotFoundError:
-        print(f"🚨 ERROR: File {XML_FILE_PATH} not found.")
+        print(f"🚨 ERROR: File {xml_path} not found.")
+    except Exception as e:
+        print(f"Error during ingestion: {e}")
+
+# --- PARALLEL INGESTION OF MANY BACKUPS ---
+# An <sms element is '<sms' followed by whitespace or '/' ('<smses' is the root).
+# '<' is always escaped inside attribute values, so this only ever matches markup.
+SMS_TAG = b'<sms'
+TAG_FOLLOWERS = b' \t\r\n/>'
+SCAN_CHUNK = 1024 * 1024
+
+def find_backups(paths):
+    """The .xml backups in the given files and folders, in a stable (sorted) order."""
+    if isinstance(paths, str):
+        paths = [paths]
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, files in os.walk(path):
+                found.update(os.path.join(folder, f) for f in files if f.lower().endswith('.xml'))
+        else:
+            found.add(path)
+    return sorted(os.path.abspath(p) for p in found)
+
+def source_for_backup(path):
+    """Backups are kept in one folder per device; the folder names the watermark source."""
+    return os.path.basename(os.path.dirname(path))
+
+def next_sms_offset(f, offset, limit):
+    """Byte offset of the first <sms element at or after `offset`, or `limit` if none starts before it."""
+    f.seek(offset)
+    position = offset
+    carry = b''
+    while position < limit:
+        chunk = f.read(min(SCAN_CHUNK, limit - position))
+        if not chunk:
+            break
+        data = carry + chunk
+        base = position - len(carry)
+        i = data.find(SMS_TAG)
+        while 0 <= i < len(data) - len(SMS_TAG):
+            if data[i + len(SMS_TAG)] in TAG_FOLLOWERS:
+                return base + i
+            i = data.find(SMS_TAG, i + 1)
+        # A tag split across two reads is found on the next pass
+        carry = data[-len(SMS_TAG):]
+        position += len(chunk)
+    return limit
+
+def plan_shards(path, shard_bytes=SHARD_BYTES):
+    """
+    Splits one backup into (start, end) byte ranges of about shard_bytes,
+    each starting on an <sms element, so every range holds whole elements.
+    The XML header and the closing </smses> fall outside every range.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        tail_start = max(0, size - SCAN_CHUNK)
+        f.seek(tail_start)
+        close = f.read().rfind(b'</smses>')
+        end = tail_start + close if close >= 0 else size
+
+        cuts = [next_sms_offset(f, 0, end)]
+        for offset in range(cuts[0] + shard_bytes, end, shard_bytes):
+            cut = next_sms_offset(f, max(offset, cuts[-1] + 1), end)
+            if cut >= end:
+                break
+            cuts.append(cut)
+    if cuts[0] >= end:
+        return [] # No messages at all
+    return list(zip(cuts, cuts[1:] + [end]))
+
+class ShardReader:
+    """Binary file object over one byte range, wrapped in a root element so iterparse can read it."""
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+        self.parts = [b'</smses>', None, b'<smses>'] # popped from the end; None is the range itself
+
+    def read(self, size=-1):
+        while self.parts:
+            part = self.parts[-1]
+            if part is not None:
+                return self.parts.pop()
+            if self.remaining > 0:
+                data = self.file.read(self.remaining if size < 0 else min(size, self.remaining))
+                self.remaining -= len(data)
+                if data:
+                    return data
+            self.parts.pop()
+        return b''
+
+    def close(self):
+        self.file.close()
+
+def stage_table_name(run_id, shard_seq):
+    return f"ingest_stage_{run_id}_{shard_seq}"
+
+# Set in pool worker processes, which each need their own connections
+_shard_engine = None
+
+def init_shard_worker():
+    global _shard_engine
+    _shard_engine = get_context().create_pg_engine()
+
+def ingest_shard(task):
+    """
+    Parses and hashes one byte range and COPYs its records into a staging
+    table of its own, numbered in file order. Messages at the watermark
+    boundary are returned instead: only the whole run can decide on them.
+    """
+    shard_seq, path, start, end, run_id, watermark_state = task
+    in_worker = _shard_engine is not None
+    if in_worker:
+        metrics.REGISTRY.reset()
+    engine = _shard_engine if in_worker else get_context().pg_engine
+    watermark = Watermark(*watermark_state)
+    boundary_records = []
+    months = set()
+    staged = 0
+    table = stage_table_name(run_id, shard_seq)
+    columns = ", ".join(RAW_COLUMNS)
+
+    began = time.perf_counter()
+    reader = ShardReader(path, start, end)
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cur:
+            # Created in the same transaction, so a failed shard leaves nothing behind
+            cur.execute(f"CREATE UNLOGGED TABLE {table} AS "
+                        f"SELECT 0 AS row_num, {columns} FROM raw_notifications WITH NO DATA")
+            for batch in iter_sms_batches(reader, BATCH_SIZE, watermark, boundary_records):
+                cur.copy_expert(f"COPY {table} (row_num, {columns}) FROM STDIN",
+                                to_copy_buffer(batch, first_row_num=staged))
+                staged += len(batch)
+                months.update(batch_months(batch))
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+        reader.close()
+    SHARD_SECONDS.observe(time.perf_counter() - began)
+
+    return {
+        'table': table,
+        'staged': staged,
+        'months': months,
+        'max_date_millis': watermark.next_max_date_millis,
+        'boundary_ids': watermark.next_boundary_ids,
+        'boundary_records': boundary_records,
+        'metrics': metrics.REGISTRY.snapshot() if in_worker else None,
+    }
+
+def run_shards(tasks, workers):
+    """Yields every shard's result in task order while up to `workers` shards are parsed at once."""
+    if workers <= 1:
+        for task in tasks:
+            yield ingest_shard(task)
+        return
+    # Don't hand the parent's pooled connections to the children
+    get_context().dispose()
+    with multiprocessing.Pool(workers, initializer=init_shard_worker) as pool:
+        yield from pool.imap(ingest_shard, tasks)
+
+def merge_stage_table(engine, table):
+    """Moves one staged range into raw_notifications in file order. Returns the rows inserted."""
+    columns = ", ".join(RAW_COLUMNS)
+    with engine.begin() as conn:
+        inserted = conn.execute(text(
+            f"INSERT INTO raw_notifications ({columns}) "
+            f"SELECT {columns} FROM {table} ORDER BY row_num "
+            f"ON CONFLICT DO NOTHING"
+        )).rowcount
+        conn.execute(text(f"DROP TABLE {table}"))
+    return inserted
+
+def drop_stage_tables(engine, run_id, n_shards):
+    """Cleans up after a failed run; merged ranges are already gone."""
+    names = [stage_table_name(run_id, seq) for seq in range(n_shards)]
+    with engine.begin() as conn:
+        for i in range(0, len(names), 500):
+            conn.execute(text(f"DROP TABLE IF EXISTS {', '.join(names[i:i + 500])}"))
+
+@metrics.task('ingest')
+def ingest_backups(paths=BACKUP_DIR, workers=INGEST_WORKERS, source_name=None, shard_bytes=SHARD_BYTES):
+    """
+    Ingests every backup in `paths` (folders and/or files) over a process
+    pool. Each backup is cut into byte ranges that the workers parse, hash
+    and stage in parallel; the parent merges the staged ranges in file
+    order, so the first copy of a duplicated message always wins, and
+    gets the lower auto_id, however many workers ran. Every folder is a
+    watermark source unless source_name is given.
+    """
+    print(f"--- Starting Parallel Ingestion for {paths} ---")
+
+    try:
+        engine = get_context().pg_engine
+        ensure_dedup_index(engine)
+        ensure_watermark_table(engine)
+
+        # 1. Plan the byte ranges, each filtered against its source's current watermark
+        backups = find_backups(paths)
+        sources = {path: source_name or source_for_backup(path) for path in backups}
+        watermarks = {source: load_watermark(engine, source) for source in sorted(set(sources.values()))}
+        run_id = uuid.uuid4().hex[:12]
+        tasks = []
+        for path in backups:
+            watermark = watermarks[sources[path]]
+            for start, end in plan_shards(path, shard_bytes):
+                tasks.append((len(tasks), path, start, end, run_id, (watermark.max_date_millis, watermark.digest)))
+        print(f"{len(backups)} backups from {len(watermarks)} sources in {len(tasks)} byte ranges, "
+              f"{max(workers, 1)} workers.")
+
+        # 2. Merge each range as soon as it and every range before it are staged
+        total_inserted = 0
+        total_skipped = 0
+        boundary_records = {source: [] for source in watermarks}
+        results = run_shards(tasks, workers)
+        try:
+            for task, result in zip(tasks, results):
+                if result['metrics']:
+                    metrics.REGISTRY.merge(result['metrics'])
+                source = sources[task[1]]
+                watermarks[source].merge(result['max_date_millis'], result['boundary_ids'])
+                boundary_records[source].extend(result['boundary_records'])
+
+                pg_partitions.ensure_partitions(engine, result['months'])
+                with COPY_SECONDS.time():
+                    inserted = merge_stage_table(engine, result['table'])
+                total_inserted += inserted
+                total_skipped += result['staged'] - inserted
+                ROWS_LOADED.inc(inserted, outcome='inserted')
+                ROWS_LOADED.inc(result['staged'] - inserted, outcome='duplicate')
+        finally:
+            results.close()
+            drop_stage_tables(engine, run_id, len(tasks))
+
+        # 3. Messages at a source's old boundary millis are loaded only if that millis changed
+        for source, records in boundary_records.items():
+            if not records:
+                continue
+            if boundary_digest([r['source_message_id'] for r in records]) == watermarks[source].digest:
+                MESSAGES_SKIPPED.inc(len(records), reason='boundary_unchanged')
+                continue
+            MESSAGES_PARSED.inc(len(records))
+            inserted, skipped = copy_batch_to_postgres(records, engine)
+            total_inserted += inserted
+            total_skipped += skipped
+            ROWS_LOADED.inc(inserted, outcome='inserted')
+            ROWS_LOADED.inc(skipped, outcome='duplicate')
+
+        # 4. Advance the watermarks only once everything is safely loaded
+        for source, watermark in watermarks.items():
+            save_watermark(engine, source, watermark)
+
+        print(f"Successfully ingested {total_inserted} new messages into Postgres "
+              f"({total_skipped} duplicates skipped).")
+
+    except FileNotFoundError as e:
+        print(f"🚨 ERROR: File {e.filename} not found.")
     except Exception as e:
-        # If duplicates exist, it might throw an IntegrityError. 
-        # For a perfect pipeline, we'd handle that gracefully, but this will show us the error.
         print(f"Error during ingestion: {e}")
 
 if __name__ == "__main__":
-    ingest_xml_data()
\ No newline at end of file
+    # python ingest_xml.py <folder or backup> ... runs the parallel mode
+    if len(sys.argv) > 1:
+        ingest_backups(sys.argv[1:])
+    else:
+        ingest_xml_data()
\ No newline at end of file
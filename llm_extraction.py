@@ -0,0 +1,159 @@
+"""
+Prompts and response handling for extracting transaction fields from SMS.
+
+Messages can be sent one per request (extract_single) or K per request
+(extract_batch). In batch mode every message carries a stable id, each
+returned item is validated on its own, and whatever fails is bisected and
+retried so one poison pill cannot sink its neighbours.
+"""
+import json
+import sys
+
+import metrics
+
+POISON_PILLS = metrics.counter('llm_poison_pills_total', 'Messages the LLM could not extract on their own')
+BATCH_SPLITS = metrics.counter('llm_batch_splits_total', 'Multi-message requests whose reply was unusable and got split')
+
+SYSTEM_PROMPT = """
+    You are an expert financial SMS parser. You will receive a single SMS message
+    that has been pre-filtered and is a financial transaction.
+
+    You MUST respond with a single, valid JSON object.
+
+    For the SMS, extract:
+    1.  "is_transaction": true
+    2.  "vendor_name": (string, or "null")
+    3.  "amount": (float, or "null")
+    4.  "transaction_type": ("debit", "credit", or "info")
+    5.  "inferred_category": (One of: "Food", "Subscription", "Utilities", "Bank Alert", "Transport", "Shopping", "Other")
+    """
+
+BATCH_SYSTEM_PROMPT = """
+    You are an expert financial SMS parser. You will receive a JSON array of SMS
+    messages that have been pre-filtered and are financial transactions. Each
+    element has an "id" and a "text".
+
+    You MUST respond with a single, valid JSON object of the form
+    {"results": [...]}, with exactly one result per message. Copy each
+    message's "id" into its result unchanged.
+
+    For each SMS, extract:
+    1.  "id": (the message id, unchanged)
+    2.  "is_transaction": true
+    3.  "vendor_name": (string, or "null")
+    4.  "amount": (float, or "null")
+    5.  "transaction_type": ("debit", "credit", or "info")
+    6.  "inferred_category": (One of: "Food", "Subscription", "Utilities", "Bank Alert", "Transport", "Shopping", "Other")
+    """
+
+REQUIRED_FIELDS = ("is_transaction", "vendor_name", "amount", "transaction_type", "inferred_category")
+TRANSACTION_TYPES = {"debit", "credit", "info"}
+
+# Rough reply size per message, used for the rate limiter's token estimate
+COMPLETION_TOKENS_PER_MESSAGE = 60
+
+def validate_extraction(item):
+    """True when one extracted item has every field, a boolean is_transaction and a usable amount and type."""
+    if not isinstance(item, dict) or any(field not in item for field in REQUIRED_FIELDS):
+        return False
+    if not isinstance(item["is_transaction"], bool):
+        return False
+    if str(item["transaction_type"]).lower() not in TRANSACTION_TYPES:
+        return False
+    amount = item["amount"]
+    if amount is None or amount == "null":
+        return True
+    try:
+        float(amount)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def extract_single(engine, message_text, auto_id, model):
+    """
+    Processes a SINGLE pre-filtered message.
+    Returns (result or None, tokens used).
+    """
+    user_prompt_content = f"Here is the SMS message to process:\n{message_text}"
+
+    try:
+        response_data, tokens = engine.complete_json(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user_prompt_content}],
+            model=model,
+            completion_tokens=COMPLETION_TOKENS_PER_MESSAGE,
+        )
+
+        item = None
+        if isinstance(response_data, dict):
+            results = response_data.get("results")
+            if isinstance(results, list) and len(results) > 0:
+                item = results[0]
+            elif "is_transaction" in response_data:
+                item = response_data
+
+        # Same per-item check as batch replies; failed batch items end up here
+        if not validate_extraction(item):
+            raise ValueError("Single response was not a valid extraction")
+        item.pop("id", None)
+        return item, tokens
+
+    except (json.JSONDecodeError, ValueError) as e:
+        POISON_PILLS.inc()
+        print(f"  POISON PILL: ID {auto_id} failed. Reason: {e}.", file=sys.stderr)
+        return None, 0 # Mark as "error"
+    # 429s are retried by the engine; anything it gives up on stops the script
+
+def extract_batch(engine, messages, model):
+    """
+    Extracts K messages in one request. `messages` is a list of
+    (auto_id, message_text). Returns ({auto_id: result or None}, tokens, calls).
+
+    Items missing from the reply or failing validation are retried on their
+    own; if a whole request fails it is split in half, down to single
+    messages, which go through extract_single.
+    """
+    if len(messages) == 1:
+        auto_id, message_text = messages[0]
+        result, tokens = extract_single(engine, message_text, auto_id, model)
+        return {auto_id: result}, tokens, 1
+
+    payload = [{"id": str(auto_id), "text": text} for auto_id, text in messages]
+    user_prompt_content = f"Here are the SMS messages to process:\n{json.dumps(payload, ensure_ascii=False)}"
+
+    results = {}
+    tokens = 0
+    try:
+        response_data, tokens = engine.complete_json(
+            [{"role": "system", "content": BATCH_SYSTEM_PROMPT}, {"role": "user", "content": user_prompt_content}],
+            model=model,
+            completion_tokens=COMPLETION_TOKENS_PER_MESSAGE * len(messages),
+        )
+        items = response_data.get("results") if isinstance(response_data, dict) else None
+        if not isinstance(items, list):
+            items = [] # An unusable reply counts as empty, so the batch is bisected
+        by_id = {str(item.get("id")): item for item in items if isinstance(item, dict)}
+        for auto_id, _ in messages:
+            item = by_id.get(str(auto_id))
+            if validate_extraction(item):
+                item.pop("id", None)
+                results[auto_id] = item
+    except json.JSONDecodeError as e:
+        print(f"  Batch of {len(messages)} returned invalid JSON ({e}), splitting...", file=sys.stderr)
+
+    calls = 1
+    failed = [m for m in messages if m[0] not in results]
+    if failed:
+        # Retry just the failures; if nothing came back at all, bisect
+        if len(failed) == len(messages):
+            BATCH_SPLITS.inc()
+            middle = len(failed) // 2
+            parts = [failed[:middle], failed[middle:]]
+        else:
+            parts = [failed]
+        for part in parts:
+            part_results, part_tokens, part_calls = extract_batch(engine, part, model)
+            results.update(part_results)
+            tokens += part_tokens
+            calls += part_calls
+
+    return results, tokens, calls
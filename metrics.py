@@ -0,0 +1,416 @@
+"""
+Counters, histograms and timers for the pipeline stages, plus an optional
+profiler per task.
+
+Stages record into one process-wide registry instead of printing a line
+per row or request:
+
+    PARSED = metrics.counter('ingest_messages_parsed_total', 'SMS records parsed', task='ingest')
+    PARSED.inc(len(batch))
+    with LOAD_SECONDS.time():
+        ...
+
+A task is wrapped with metrics.task('ingest') (as a decorator or a `with`
+block). When it ends, the registry is written to METRICS_DIR as
+<task>.prom (Prometheus text format, for node_exporter's textfile
+collector) and/or <task>.json (a summary with percentiles and per-second
+rates for the counters that belong to the task), and a short summary is
+printed.
+
+Profiling is off unless the task is named in PROFILE_TASKS ('all' for
+every task):
+    PROFILE_MODE=cprofile  deterministic, writes <task>.prof (pstats) and prints the top functions
+    PROFILE_MODE=sample    a background thread samples every thread's stack every
+                           PROFILE_INTERVAL_MS; low overhead, writes <task>.folded
+                           (collapsed stacks for flamegraph.pl / speedscope)
+"""
+import bisect
+import cProfile
+import contextlib
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+
+# --- CONFIG ---
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+# Comma-separated: 'json', 'prometheus', or '' to only print the summary
+METRICS_FORMATS = [f for f in os.getenv('METRICS_FORMATS', 'json,prometheus').split(',') if f]
+PROFILE_TASKS = [t for t in os.getenv('PROFILE_TASKS', '').split(',') if t]
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sample')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', METRICS_DIR)
+
+# Seconds, from a fast local call to a slow LLM request or load job
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Samples kept per histogram series for the JSON percentiles
+RESERVOIR_SIZE = 2048
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _series_name(name, key):
+    return name + ''.join(f'[{v}]' for _, v in key)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, task=None):
+        self.name = name
+        self.help = help_text
+        self.task = task
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def snapshot(self):
+        with self.lock:
+            return {'values': dict(self.values)}
+
+    def merge(self, snapshot):
+        with self.lock:
+            for key, value in snapshot['values'].items():
+                self.values[key] = self.values.get(key, 0) + value
+
+    def prometheus_lines(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def merge(self, snapshot):
+        with self.lock:
+            self.values.update(snapshot['values'])
+
+class _Series:
+    def __init__(self, n_buckets):
+        self.buckets = [0] * (n_buckets + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = float('-inf')
+        self.samples = []
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, task=None):
+        self.name = name
+        self.help = help_text
+        self.task = task
+        self.bounds = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            s = self.series.get(key)
+            if s is None:
+                s = self.series[key] = _Series(len(self.bounds))
+            s.buckets[bisect.bisect_left(self.bounds, value)] += 1
+            s.count += 1
+            s.sum += value
+            s.max = max(s.max, value)
+            # Reservoir sampling keeps an unbiased sample for percentiles
+            if len(s.samples) < RESERVOIR_SIZE:
+                s.samples.append(value)
+            else:
+                slot = random.randrange(s.count)
+                if slot < RESERVOIR_SIZE:
+                    s.samples[slot] = value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the duration of the block in seconds, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return {'series': {key: vars(s).copy() | {'buckets': list(s.buckets), 'samples': list(s.samples)}
+                               for key, s in self.series.items()}}
+
+    def merge(self, snapshot):
+        with self.lock:
+            for key, other in snapshot['series'].items():
+                s = self.series.get(key)
+                if s is None:
+                    s = self.series[key] = _Series(len(self.bounds))
+                s.buckets = [a + b for a, b in zip(s.buckets, other['buckets'])]
+                s.count += other['count']
+                s.sum += other['sum']
+                s.max = max(s.max, other['max'])
+                samples = s.samples + other['samples']
+                s.samples = random.sample(samples, RESERVOIR_SIZE) if len(samples) > RESERVOIR_SIZE else samples
+
+    def summary(self, key):
+        s = self.series[key]
+        ordered = sorted(s.samples)
+
+        def pct(q):
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+        return {'count': s.count, 'sum': s.sum, 'mean': s.sum / s.count if s.count else None,
+                'p50': pct(0.5), 'p95': pct(0.95), 'p99': pct(0.99), 'max': s.max if s.count else None}
+
+    def prometheus_lines(self):
+        for key, s in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.bounds + (float('inf'),), s.buckets):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {s.sum}"
+            yield f"{self.name}_count{_format_labels(key)} {s.count}"
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def reset(self):
+        """Clears every value but keeps the registered metrics (module-level handles stay valid)."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            with metric.lock:
+                if isinstance(metric, Histogram):
+                    metric.series = {}
+                else:
+                    metric.values = {}
+
+    def snapshot(self):
+        """Picklable copy of every value, e.g. to send back from a worker process."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {m.name: (m.kind, m.snapshot()) for m in metrics}
+
+    def merge(self, snapshot):
+        for name, (kind, values) in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is not None and metric.kind == kind:
+                metric.merge(values)
+
+    def task_seconds(self):
+        gauge = self.metrics.get('task_duration_seconds')
+        return {dict(key)['task']: value for key, value in gauge.values.items()} if gauge else {}
+
+    def to_prometheus(self):
+        lines = []
+        for metric in sorted(self.metrics.values(), key=lambda m: m.name):
+            body = list(metric.prometheus_lines())
+            if not body:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(body)
+        return "\n".join(lines) + "\n"
+
+    def to_summary(self):
+        """counters/gauges by series, histogram percentiles, and counter rates per task second."""
+        task_seconds = self.task_seconds()
+        summary = {'counters': {}, 'gauges': {}, 'histograms': {}, 'rates_per_second': {}}
+        for metric in sorted(self.metrics.values(), key=lambda m: m.name):
+            if isinstance(metric, Histogram):
+                for key in sorted(metric.series):
+                    summary['histograms'][_series_name(metric.name, key)] = metric.summary(key)
+                continue
+            section = 'gauges' if metric.kind == 'gauge' else 'counters'
+            for key, value in sorted(metric.values.items()):
+                series = _series_name(metric.name, key)
+                summary[section][series] = value
+                if metric.kind == 'counter' and task_seconds.get(metric.task):
+                    summary['rates_per_second'][series] = value / task_seconds[metric.task]
+        return summary
+
+REGISTRY = Registry()
+
+def counter(name, help_text='', task=None):
+    """`task` ties the counter to a task, so the summary reports it per second of that task."""
+    return REGISTRY._get(Counter, name, help_text, task=task)
+
+def gauge(name, help_text=''):
+    return REGISTRY._get(Gauge, name, help_text)
+
+def histogram(name, help_text='', buckets=DEFAULT_BUCKETS, task=None):
+    return REGISTRY._get(Histogram, name, help_text, buckets=buckets, task=task)
+
+TASK_SECONDS = gauge('task_duration_seconds', 'Wall-clock duration of the last run of each task')
+TASK_FAILURES = counter('task_failures_total', 'Task runs that raised')
+
+# --- EXPORT ---
+def _write_atomic(path, content):
+    # The textfile collector must never read a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def export(name, directory=METRICS_DIR, formats=METRICS_FORMATS):
+    """Writes <name>.prom / <name>.json. Returns the paths written."""
+    if not formats:
+        return []
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    if 'prometheus' in formats:
+        paths.append(os.path.join(directory, f"{name}.prom"))
+        _write_atomic(paths[-1], REGISTRY.to_prometheus())
+    if 'json' in formats:
+        paths.append(os.path.join(directory, f"{name}.json"))
+        _write_atomic(paths[-1], json.dumps(REGISTRY.to_summary(), indent=2, default=str))
+    return paths
+
+def print_summary():
+    summary = REGISTRY.to_summary()
+    for series, value in summary['counters'].items():
+        rate = summary['rates_per_second'].get(series)
+        print(f"  {series:<58} {value:>12,}" + (f"  ({rate:,.1f}/s)" if rate else ""))
+    for series, value in summary['gauges'].items():
+        if not series.startswith(TASK_SECONDS.name):
+            print(f"  {series:<58} {value:>12,.3f}" if isinstance(value, float) else f"  {series:<58} {value:>12,}")
+    for series, h in summary['histograms'].items():
+        print(f"  {series:<58} n={h['count']:<8,} p50={h['p50']:.4f} p95={h['p95']:.4f} max={h['max']:.4f}")
+
+# --- PROFILING ---
+class SamplingProfiler:
+    """Samples the stacks of all other threads at a fixed interval; counts collapsed stacks."""
+    def __init__(self, interval_seconds):
+        self.interval = interval_seconds
+        self.stacks = _Tally()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit=15):
+        """Functions by share of samples where they were on top of the stack."""
+        own = _Tally()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        total = sum(own.values()) or 1
+        return [(name, count / total) for name, count in own.most_common(limit)]
+
+def _should_profile(name):
+    return 'all' in PROFILE_TASKS or name in PROFILE_TASKS
+
+@contextlib.contextmanager
+def _profiled(name):
+    if not _should_profile(name):
+        yield
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if PROFILE_MODE == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = os.path.join(PROFILE_DIR, f"{name}.prof")
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(15)
+            print(f"cProfile for '{name}' written to {path}:\n{out.getvalue()}")
+    else:
+        profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000)
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = os.path.join(PROFILE_DIR, f"{name}.folded")
+            profiler.write(path)
+            print(f"Sampled {profiler.samples} stacks for '{name}', written to {path}. Hottest functions:")
+            for function, share in profiler.top():
+                print(f"  {share:6.1%}  {function}")
+
+# --- TASKS ---
+@contextlib.contextmanager
+def task(name):
+    """
+    Times a task, profiles it if requested, and exports the metrics when
+    it ends (also when it fails). Works as a decorator too.
+    """
+    REGISTRY.reset()
+    start = time.perf_counter()
+    try:
+        with _profiled(name):
+            yield
+    except BaseException:
+        TASK_FAILURES.inc(task=name)
+        raise
+    finally:
+        TASK_SECONDS.set(time.perf_counter() - start, task=name)
+        try:
+            paths = export(name)
+            print(f"--- Metrics for '{name}' ({TASK_SECONDS.value(task=name):.2f}s)"
+                  + (f", written to {', '.join(paths)}" if paths else "") + " ---")
+            print_summary()
+        except OSError as e:
+            print(f"Could not write metrics for '{name}': {e}")
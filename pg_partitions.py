@@ -0,0 +1,186 @@
+"""
+Monthly range partitions for raw_notifications in Postgres.
+
+raw_notifications is partitioned by timestamp_utc month
+(raw_notifications_p2025_11 holds November 2025), so a stage that only
+needs recent messages never reads older months. The loaders call
+ensure_partitions() before loading a batch that needs a new month.
+
+Statuses change in place. A row goes pending -> pre_filtered -> processed,
+and moving it between LIST sub-partitions at every step would rewrite the
+row and all its indexes each time. The open statuses get partial indexes
+instead; they stay small because finished rows drop out of them.
+
+Every stage bounds its queries by open_window_start(), the oldest
+timestamp still pending or pre_filtered. The bound is a constant when the
+query is planned, so the planner prunes every month before it.
+explain_scan() shows which partitions a query touches.
+
+An existing unpartitioned table is converted (and kept, renamed) with
+
+    python pg_partitions.py
+"""
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from pipeline_context import get_context
+
+OPEN_STATUSES = ('pending', 'pre_filtered')
+# Window start that keeps every partition
+EARLIEST = datetime.min
+# Serializes partition creation between concurrent loaders
+PARTITION_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('raw_notifications_partitions'))"
+
+RAW_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS raw_notifications (
+        auto_id BIGSERIAL,
+        source_message_id TEXT,
+        timestamp_utc TIMESTAMP NOT NULL,
+        sender_address TEXT,
+        message_body TEXT,
+        processing_status TEXT DEFAULT 'pending',
+        PRIMARY KEY (auto_id, timestamp_utc)
+    ) PARTITION BY RANGE (timestamp_utc)
+"""
+
+def status_list(statuses):
+    return ", ".join(f"'{status}'" for status in statuses)
+
+def create_raw_notifications(conn):
+    """Creates the partitioned table and the index that finds the open window, if missing."""
+    conn.execute(text(RAW_TABLE_DDL))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS raw_notifications_open_window_idx ON raw_notifications (timestamp_utc) "
+        f"WHERE processing_status IN ({status_list(OPEN_STATUSES)})"
+    ))
+
+def ensure_raw_notifications(engine):
+    with engine.begin() as conn:
+        create_raw_notifications(conn)
+
+def is_partitioned(conn):
+    return bool(conn.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('raw_notifications')"
+    )).scalar())
+
+def partition_name(year, month):
+    return f"raw_notifications_p{year:04d}_{month:02d}"
+
+def month_bounds(year, month):
+    return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+
+def create_partitions(conn, timestamps):
+    """
+    Creates the monthly partitions these timestamps fall into. A no-op on
+    an unpartitioned table. Returns the names of the partitions created.
+    """
+    months = {partition_name(t.year, t.month): (t.year, t.month) for t in timestamps if t is not None}
+    if not months:
+        return []
+    existing = set(conn.execute(
+        text("SELECT relname FROM pg_class WHERE relname = ANY(:names)"), {'names': list(months)}
+    ).scalars())
+    missing = sorted(name for name in months if name not in existing)
+    if not missing or not is_partitioned(conn):
+        return []
+    conn.execute(text(PARTITION_LOCK_SQL))
+    for name in missing:
+        lower, upper = month_bounds(*months[name])
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF raw_notifications "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        ))
+    print(f"Created partitions: {', '.join(missing)}")
+    return missing
+
+def ensure_partitions(engine, timestamps):
+    """create_partitions in its own short transaction, before a load that needs them."""
+    with engine.begin() as conn:
+        return create_partitions(conn, timestamps)
+
+def open_window_start(engine, statuses=OPEN_STATUSES):
+    """
+    Oldest timestamp_utc among rows in the given statuses, or None when
+    there are none. Rows older than this are finished, so every query of
+    the run can skip their partitions.
+    """
+    with engine.connect() as conn:
+        return conn.execute(text(
+            f"SELECT MIN(timestamp_utc) FROM raw_notifications WHERE processing_status IN ({status_list(statuses)})"
+        )).scalar()
+
+def explain_scan(engine, sql, params=None):
+    """
+    Runs a query under EXPLAIN (ANALYZE, BUFFERS) and rolls it back.
+    Returns the partitions it read, the shared buffers it touched and the
+    rows it returned.
+    """
+    partitions = set()
+
+    def walk(node):
+        if 'Relation Name' in node:
+            partitions.add(node['Relation Name'])
+        for child in node.get('Plans', []):
+            walk(child)
+
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params or {}).scalar()
+        finally:
+            transaction.rollback()
+    root = plan[0]['Plan']
+    walk(root)
+    return {
+        'partitions': sorted(partitions),
+        'buffers': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0),
+        'rows': root.get('Actual Rows', 0),
+    }
+
+def migrate_raw_notifications(engine):
+    """
+    Converts an unpartitioned raw_notifications in one transaction: the
+    old table (with its indexes and sequence) is renamed to
+    raw_notifications_unpartitioned and its rows are copied, with their
+    auto_ids, into monthly partitions. Drop the old table once checked.
+    """
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            print("raw_notifications is already partitioned.")
+            return
+        conn.execute(text("LOCK TABLE raw_notifications IN ACCESS EXCLUSIVE MODE"))
+        missing_timestamps = conn.execute(text(
+            "SELECT COUNT(*) FROM raw_notifications WHERE timestamp_utc IS NULL")).scalar()
+        if missing_timestamps:
+            raise RuntimeError(f"{missing_timestamps} rows have no timestamp_utc; fix or delete them first.")
+
+        # Free the names the new table needs
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence('raw_notifications', 'auto_id')")).scalar()
+        conn.execute(text("ALTER TABLE raw_notifications RENAME TO raw_notifications_unpartitioned"))
+        indexes = conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'raw_notifications_unpartitioned'")).scalars().all()
+        for index in indexes:
+            conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index[:50]}_unpartitioned"'))
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO raw_notifications_unpartitioned_auto_id_seq"))
+
+        create_raw_notifications(conn)
+        months = conn.execute(text(
+            "SELECT DISTINCT date_trunc('month', timestamp_utc) FROM raw_notifications_unpartitioned")).scalars().all()
+        create_partitions(conn, months)
+
+        columns = "auto_id, source_message_id, timestamp_utc, sender_address, message_body, processing_status"
+        copied = conn.execute(text(
+            f"INSERT INTO raw_notifications ({columns}) "
+            f"SELECT {columns} FROM raw_notifications_unpartitioned ORDER BY auto_id"
+        )).rowcount
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('raw_notifications', 'auto_id'), "
+            "COALESCE((SELECT MAX(auto_id) FROM raw_notifications), 0) + 1, false)"
+        ))
+    print(f"Copied {copied} rows into {len(months)} monthly partitions. "
+          f"The old table is kept as raw_notifications_unpartitioned.")
+
+if __name__ == "__main__":
+    migrate_raw_notifications(get_context().pg_engine)
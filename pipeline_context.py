@@ -0,0 +1,132 @@
+"""
+Clients shared by the pipeline tasks, built the first time they are used.
+
+The task modules and the DAG file used to create SQLAlchemy engines,
+Groq and BigQuery clients at import time (and exit when a credential was
+missing), so every Airflow scheduler parse paid for them. Now a task
+calls get_context() when it runs; the context builds each client on
+first access and keeps it for the rest of the process, so engines keep
+their connection pools across batches. Importing this module touches no
+network and checks no credentials.
+
+    ctx = get_context()
+    ctx.pg_engine          # SQLAlchemy engine for the Postgres staging DB
+    ctx.warehouse          # warehouse.py backend (BigQuery or DuckDB)
+    ctx.groq_engine        # GroqEngine with the plan's rate limits
+
+Benchmarks and local runs can install their own context with
+set_context(PipelineContext(database_url=..., warehouse=DuckDBBackend(path))).
+"""
+import os
+import threading
+
+# --- 1. CREDENTIALS ---
+DB_USER = "your_username_here"
+DB_PASS = os.getenv('VARIABLE_NAME')
+DB_HOST = "your_host_here"
+DB_PORT = "your_port_here"
+DB_NAME = "your_db_name_here"
+# A full URL here wins over the DB_* settings above
+PIPELINE_DATABASE_URL = os.getenv('PIPELINE_DATABASE_URL')
+
+GROQ_API_KEY = os.getenv('VARIABLE_NAME')
+GOOGLE_APPLICATION_CREDENTIALS = r"path"
+
+# --- 2. CLIENT SETTINGS ---
+# Our Groq plan's limits; the engine never goes above them
+GROQ_RPM_LIMIT = int(os.getenv('GROQ_RPM_LIMIT', '30'))
+GROQ_TPM_LIMIT = int(os.getenv('GROQ_TPM_LIMIT', '6000'))
+GROQ_MAX_CONCURRENCY = int(os.getenv('GROQ_MAX_CONCURRENCY', '8'))
+
+class PipelineContext:
+    """
+    Holds the pipeline's clients. Each one is built on first access;
+    `clients` can pass already built ones instead (e.g. warehouse=DuckDBBackend(path)
+    or groq_engine=GroqEngine(stub_client, ...)), which the context then owns.
+    """
+    def __init__(self, database_url=None, warehouse_kind=None, groq_api_key=None, **clients):
+        self.database_url = database_url or PIPELINE_DATABASE_URL
+        self.warehouse_kind = warehouse_kind
+        self.groq_api_key = groq_api_key or GROQ_API_KEY
+        self.lock = threading.Lock()
+        self._clients = dict(clients)
+
+    def _get(self, name, build):
+        # Pipeline stages run in threads; build every client exactly once
+        with self.lock:
+            if name not in self._clients:
+                self._clients[name] = build()
+            return self._clients[name]
+
+    def create_pg_engine(self):
+        """A new engine with its own pool, e.g. for a worker process."""
+        from sqlalchemy import create_engine
+        url = self.database_url
+        if not url:
+            if not DB_PASS:
+                raise RuntimeError("DB_PASS environment variable not set.")
+            url = f'postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+        return create_engine(url)
+
+    @property
+    def pg_engine(self):
+        return self._get('pg_engine', self.create_pg_engine)
+
+    @property
+    def warehouse(self):
+        def build():
+            import warehouse
+            kind = self.warehouse_kind or warehouse.WAREHOUSE_BACKEND
+            if kind == 'bigquery':
+                os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", GOOGLE_APPLICATION_CREDENTIALS)
+            backend = warehouse.get_backend(kind)
+            print(f"Warehouse backend '{backend.name}' created successfully.")
+            return backend
+        return self._get('warehouse', build)
+
+    @property
+    def groq_engine(self):
+        def build():
+            from groq import Groq
+            from groq_engine import GroqEngine, RateLimiter
+            if not self.groq_api_key:
+                raise RuntimeError("GROQ_API_KEY environment variable not set.")
+            # Retries are handled by the engine so they go through the rate limiter
+            client = Groq(api_key=self.groq_api_key, max_retries=0)
+            return GroqEngine(client, RateLimiter(GROQ_RPM_LIMIT, GROQ_TPM_LIMIT),
+                              max_workers=GROQ_MAX_CONCURRENCY)
+        return self._get('groq_engine', build)
+
+    def dispose(self):
+        """Drops pooled connections, e.g. before forking worker processes."""
+        with self.lock:
+            engine = self._clients.get('pg_engine')
+        if engine is not None:
+            engine.dispose()
+
+    def close(self):
+        with self.lock:
+            clients, self._clients = self._clients, {}
+        if 'pg_engine' in clients:
+            clients['pg_engine'].dispose()
+        if 'warehouse' in clients:
+            clients['warehouse'].close()
+
+# --- 3. SHARED CONTEXT ---
+_context = None
+_context_lock = threading.Lock()
+
+def get_context():
+    """The process-wide context, created on the first call (i.e. at task execution)."""
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = PipelineContext()
+        return _context
+
+def set_context(context):
+    """Installs a context (or None to reset); returns the previous one."""
+    global _context
+    with _context_lock:
+        previous, _context = _context, context
+        return previous
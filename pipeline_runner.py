@@ -0,0 +1,162 @@
+"""
+Producer/consumer pipelining for batch stages.
+
+Each stage runs in its own thread and hands batches to the next through a
+bounded queue, so while batch N is being enriched, batch N+1 is already
+being fetched and batch N-1 is being written. A full queue blocks the
+stage before it (backpressure), so memory stays at about
+`queue_size` batches per stage no matter how far ahead the source could
+run. The first exception in any stage stops every stage and is re-raised
+by run() once all threads have exited.
+"""
+import queue
+import threading
+import time
+
+import metrics
+
+# Marks the end of the stream in a queue
+_END = object()
+POLL_SECONDS = 0.1
+
+STAGE_BATCH_SECONDS = metrics.histogram('pipeline_stage_batch_seconds', 'Time a stage spent on one batch')
+STAGE_WAITING_SECONDS = metrics.gauge('pipeline_stage_waiting_seconds', 'Time a stage spent blocked on its queues in the last run')
+
+class Pipeline:
+    def __init__(self, queue_size=2):
+        self.queue_size = queue_size
+        self.stop_event = threading.Event()
+        self.error = None
+        self.error_lock = threading.Lock()
+        self.stats = {}
+
+    def _fail(self, stage, exc):
+        with self.error_lock:
+            if self.error is None:
+                print(f"Pipeline stage '{stage}' failed: {exc}")
+                self.error = exc
+        self.stop_event.set()
+
+    def _put(self, q, item):
+        """Blocks while the next stage is behind; gives up if the pipeline stopped."""
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _new_stats(self, name):
+        self.stats[name] = {'batches': 0, 'busy_seconds': 0.0, 'waiting_seconds': 0.0}
+        return self.stats[name]
+
+    def _busy(self, name, stats, started):
+        seconds = time.perf_counter() - started
+        stats['busy_seconds'] += seconds
+        stats['batches'] += 1
+        STAGE_BATCH_SECONDS.observe(seconds, stage=name)
+
+    def _run_source(self, name, source, out_q):
+        stats = self._new_stats(name)
+        try:
+            iterator = iter(source)
+            while not self.stop_event.is_set():
+                started = time.perf_counter()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                self._busy(name, stats, started)
+                started = time.perf_counter()
+                if not self._put(out_q, batch):
+                    return
+                stats['waiting_seconds'] += time.perf_counter() - started
+            self._put(out_q, _END)
+        except Exception as e:
+            self._fail(name, e)
+
+    def _run_stage(self, name, fn, in_q, out_q):
+        stats = self._new_stats(name)
+        try:
+            while True:
+                started = time.perf_counter()
+                batch = self._get(in_q)
+                stats['waiting_seconds'] += time.perf_counter() - started
+                if batch is _END:
+                    self._put(out_q, _END)
+                    return
+                started = time.perf_counter()
+                result = fn(batch)
+                self._busy(name, stats, started)
+                # A stage may drop a batch by returning None
+                if result is not None:
+                    started = time.perf_counter()
+                    if not self._put(out_q, result):
+                        return
+                    stats['waiting_seconds'] += time.perf_counter() - started
+        except Exception as e:
+            self._fail(name, e)
+
+    def run(self, source, stages, sink, source_name='fetch', sink_name='load'):
+        """
+        `source` is an iterable of batches, `stages` a list of (name, fn)
+        transforms, and `sink(batch)` runs in the calling thread (so clients
+        that must stay on one thread can live there). Returns per-stage stats.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(source_name, source, queues[0]),
+                                    name=source_name, daemon=True)]
+        for i, (name, fn) in enumerate(stages):
+            threads.append(threading.Thread(target=self._run_stage, args=(name, fn, queues[i], queues[i + 1]),
+                                            name=name, daemon=True))
+
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        stats = self._new_stats(sink_name)
+        try:
+            while True:
+                started = time.perf_counter()
+                batch = self._get(queues[-1])
+                stats['waiting_seconds'] += time.perf_counter() - started
+                if batch is _END:
+                    break
+                started = time.perf_counter()
+                sink(batch)
+                self._busy(sink_name, stats, started)
+        except Exception as e:
+            self._fail(sink_name, e)
+        finally:
+            # Unblocks any stage still waiting on a queue
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        self.stats['total_seconds'] = time.perf_counter() - started_at
+        for name, stage_stats in self.stats.items():
+            if isinstance(stage_stats, dict):
+                STAGE_WAITING_SECONDS.set(stage_stats['waiting_seconds'], stage=name)
+        if self.error is not None:
+            raise self.error
+        return self.stats
+
+def format_stats(stats):
+    """One line per stage: busy vs. waiting time shows which stage is the bottleneck."""
+    lines = []
+    for name, stage in stats.items():
+        if name == 'total_seconds':
+            continue
+        lines.append(f"  {name:<10} {stage['batches']:>6} batches, busy {stage['busy_seconds']:7.2f}s, "
+                     f"waiting {stage['waiting_seconds']:7.2f}s")
+    lines.append(f"  wall clock {stats['total_seconds']:.2f}s")
+    return "\n".join(lines)
@@ -1,104 +1,181 @@
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import os
-import re
-import sys
-
-# --- 1. SET CREDENTIALS ---
-DB_USER = "your_username_here"
-DB_PASS = os.getenv('VARIABLE_NAME')
-DB_HOST = "your_host_here"
-DB_PORT = "your_port_here"
-DB_NAME = "your_db_name_here"
-
-if not DB_PASS:
-    print("ERROR: DB_PASS environment variable not set.")
-    sys.exit(1)
-
-POSTGRES_URL = f'postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-pg_engine = create_engine(POSTGRES_URL)
-
-# --- 2. DEFINE FILTERS ---
-TRANSACTION_KEYWORDS_REGEX = re.compile(
-    r'\b(rs\.?|inr|paid|received|credited|debited|a/c|transaction|payment|charged|sent to|received from|spent|recharge of)\b',
-    re.IGNORECASE
-)
-OTP_KEYWORDS_REGEX = re.compile(
-    r'\b(otp|code|verification|verify)\b|G-\d{6}',
-    re.IGNORECASE
-)
-
-def pre_filter_message(message_body):
-    """Uses Regex to classify a message. Returns: 'pre_filtered', 'junk'"""
-    if pd.isna(message_body) or len(message_body) < 15:
-        return 'junk'
-    
-    # Check for non-English chars
-    if not all(ord(c) < 128 for c in message_body):
-        return 'junk'
-        
-    if TRANSACTION_KEYWORDS_REGEX.search(message_body):
-        return 'pre_filtered' # This is a potential transaction
-        
-    if OTP_KEYWORDS_REGEX.search(message_body):
-        return 'junk'
-    
-    # Everything else is junk
-    return 'junk'
-
-def update_status_in_db(id_list, status):
-    """Helper function to update statuses in bulk"""
-    if not id_list:
-        return
-    
-    print(f"  Updating {len(id_list)} rows to '{status}'...")
-    id_tuple = tuple(id_list)
-    sql_safe_ids = ""
-    if len(id_tuple) == 1:
-        sql_safe_ids = f"({id_tuple[0]})"
-    else:
-        sql_safe_ids = str(id_tuple)     
+import time
+import multiprocessing
 
-    with pg_engine.connect() as conn:
-        conn.execute(
-            text(f"UPDATE raw_notifications SET processing_status = '{status}' WHERE auto_id IN {sql_safe_ids}")
-        )
-        conn.commit()
+from status_updates import apply_status_updates
+from pipeline_context import get_context
+import metrics
+import sender_index
+import pg_partitions
 
-# --- 3. MAIN FILTERING LOOP ---
-def main():
-    print("--- Starting Pre-filtering Script ---")
-    BATCH_SIZE = 10000 # Process 10,000 rows at a time
+# --- 1. SETTINGS ---
+# Postgres credentials live in pipeline_context.py; the engine is built when the task runs
+BATCH_SIZE = 10000 # Process 10,000 rows at a time
+# Worker processes claiming disjoint batches; 1 keeps everything in-process
+PRE_FILTER_WORKERS = int(os.getenv('PRE_FILTER_WORKERS', '1'))
+# Route messages from senders with a known outcome without the regex (sender_index.py)
+SENDER_ROUTING = os.getenv('SENDER_ROUTING', '1') == '1'
+
+ROWS_CLASSIFIED = metrics.counter('prefilter_rows_classified_total',
+                                  'Rows labelled by the pre-filter, by status and by sender route or regex', task='pre_filter')
+BATCH_SECONDS = metrics.histogram('prefilter_batch_seconds', 'Claim, classify and update of one batch')
+
+# --- 2. FILTERS ---
+# The regex rules live in sms_classifier.py so they can be used without a database.
+
+# --- 3. BATCH CLAIMING ---
+# Keyset cursor over the partial index below: each query starts right after the
+# last auto_id this worker saw, and SKIP LOCKED lets several workers claim
+# disjoint batches without waiting on each other. The window start prunes
+# every month partition that has no pending rows left (pg_partitions.py).
+CLAIM_BATCH_SQL = text("""
+    SELECT auto_id, sender_address, message_body
+    FROM raw_notifications
+    WHERE processing_status = 'pending' AND auto_id > :last_seen AND auto_id <= :max_id
+      AND timestamp_utc >= :window_start
+    ORDER BY auto_id ASC
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+""")
+# auto_id is a BIGSERIAL; the upper bound when the caller sets none
+MAX_AUTO_ID = 2 ** 63 - 1
+
+def ensure_pending_index(engine):
+    """Partial index so finding the next pending rows never rescans finished ones."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS raw_notifications_pending_idx "
+            "ON raw_notifications (auto_id) WHERE processing_status = 'pending'"
+        ))
+
+def pre_filter_rows(conn, df, routes=None, window_start=None):
+    """
+    Classifies rows (auto_id, sender_address, message_body) and writes their
+    statuses on an open connection, inside the caller's transaction.
+    `routes` is sender_index.load_routes() output; senders found there skip
+    the regex, except for the audit sample. Every row must be at or after
+    window_start. Returns (good rows, junk rows, routed rows).
+    """
+    # Senders with a known outcome skip the regex; the rest get the fast, local filter
+    df['filter_status'], routed, audited = sender_index.classify_with_routes(df, routes)
+    if audited.any():
+        sender_index.record_audit(
+            conn, df.loc[audited, 'sender_address'], routed[audited], df.loc[audited, 'filter_status'])
+
+    good_rows = df[df['filter_status'] == 'pre_filtered']['auto_id'].tolist()
+    junk_rows = df[df['filter_status'] == 'junk']['auto_id'].tolist()
+
+    # Update the database (both statuses in one statement, same transaction)
+    apply_status_updates(conn, {'pre_filtered': good_rows, 'junk': junk_rows}, window_start)
+
+    by_sender = pd.notna(routed) & ~audited
+    for status in ('pre_filtered', 'junk'):
+        is_status = df['filter_status'].to_numpy() == status
+        ROWS_CLASSIFIED.inc(int((is_status & by_sender).sum()), status=status, route='sender')
+        ROWS_CLASSIFIED.inc(int((is_status & ~by_sender).sum()), status=status, route='regex')
+    return len(good_rows), len(junk_rows), int(by_sender.sum())
+
+def filter_next_batch(engine, last_seen, routes=None, window_start=None, max_id=None):
+    """
+    Claims, classifies and marks one batch inside a single transaction.
+    Only rows at or after window_start (all of them without one) and up to
+    max_id are looked at. Returns (last auto_id in the batch, good rows,
+    junk rows, routed rows), or None when there is nothing left to claim.
+    """
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        window_start = window_start or pg_partitions.EARLIEST
+        df = pd.read_sql(CLAIM_BATCH_SQL, conn, params={
+            'last_seen': last_seen, 'batch_size': BATCH_SIZE, 'window_start': window_start,
+            'max_id': MAX_AUTO_ID if max_id is None else max_id})
+        if df.empty:
+            return None
+        good, junk, routed = pre_filter_rows(conn, df, routes, window_start)
+
+    BATCH_SECONDS.observe(time.perf_counter() - start)
+    return int(df['auto_id'].max()), good, junk, routed
+
+def filter_worker(worker_id, window_start=None, max_id=None):
+    """
+    Runs batches until no pending rows up to max_id are left. Returns
+    (good, junk, routed) totals and, from a worker process, its metrics for
+    the parent to merge.
+    """
+    # Each worker process needs its own connections (and starts with empty metrics)
+    if worker_id is not None:
+        metrics.REGISTRY.reset()
+    context = get_context()
+    engine = context.pg_engine if worker_id is None else context.create_pg_engine()
+    label = "" if worker_id is None else f"[worker {worker_id}] "
+    routes = sender_index.load_routes(engine) if SENDER_ROUTING else None
+    last_seen = 0
     total_good = 0
     total_junk = 0
-    
+    total_routed = 0
+
     while True:
-        print(f"\nFetching next {BATCH_SIZE} rows...")
-        df = pd.read_sql(
-            f"SELECT auto_id, message_body FROM raw_notifications WHERE processing_status = 'pending' ORDER BY auto_id ASC LIMIT {BATCH_SIZE}",
-            pg_engine
-        )
-        
-        if df.empty:
-            print("No more pending rows found.")
-            break
-            
-        # Apply the fast, local filter
-        df['filter_status'] = df['message_body'].apply(pre_filter_message)
-        
-        good_rows = df[df['filter_status'] == 'pre_filtered']['auto_id'].tolist()
-        junk_rows = df[df['filter_status'] == 'junk']['auto_id'].tolist()
-        
-        # Update the database
-        update_status_in_db(good_rows, 'pre_filtered')
-        update_status_in_db(junk_rows, 'junk')
-        
-        total_good += len(good_rows)
-        total_junk += len(junk_rows)
-        
+        result = filter_next_batch(engine, last_seen, routes, window_start, max_id)
+        if result is None:
+            if last_seen == 0:
+                print(f"{label}No more pending rows found.")
+                break
+            # Rows another worker claimed and then rolled back are 'pending'
+            # again behind the cursor; one more pass from the start finds them
+            last_seen = 0
+            continue
+
+        last_seen, good, junk, routed = result
+        total_good += good
+        total_junk += junk
+        total_routed += routed
+
+    snapshot = None if worker_id is None else metrics.REGISTRY.snapshot()
+    return total_good, total_junk, total_routed, snapshot
+
+# --- 4. MAIN FILTERING LOOP ---
+@metrics.task('pre_filter')
+def main(workers=PRE_FILTER_WORKERS):
+    print("--- Starting Pre-filtering Script ---")
+    context = get_context()
+    pg_engine = context.pg_engine
+    ensure_pending_index(pg_engine)
+    if SENDER_ROUTING:
+        sender_index.ensure_sender_tables(pg_engine)
+        sender_index.refresh_sender_index(pg_engine)
+
+    # Months older than the oldest pending row are never read
+    window_start = pg_partitions.open_window_start(pg_engine, ('pending',))
+    if window_start is None:
+        print("No pending rows.")
+    else:
+        print(f"Pending rows start at {window_start}; older partitions are skipped.")
+    # Rows that arrive during the run wait for the next one, so the run always ends
+    with pg_engine.connect() as conn:
+        max_id = conn.execute(text("SELECT COALESCE(MAX(auto_id), 0) FROM raw_notifications")).scalar()
+
+    if workers <= 1:
+        totals = [filter_worker(None, window_start, max_id)]
+    else:
+        print(f"Running {workers} worker processes...")
+        # Don't hand the parent's pooled connections to the children
+        context.dispose()
+        with multiprocessing.Pool(workers) as pool:
+            totals = pool.starmap(filter_worker, [(worker_id, window_start, max_id) for worker_id in range(workers)])
+        for *_, snapshot in totals:
+            metrics.REGISTRY.merge(snapshot)
+
+    total_good = sum(good for good, _, _, _ in totals)
+    total_junk = sum(junk for _, junk, _, _ in totals)
+    total_routed = sum(routed for _, _, routed, _ in totals)
+
     print("\n--- Pre-filtering Complete ---")
     print(f"Total Transactions: {total_good}")
     print(f"Total Junk Rows:    {total_junk}")
+    print(f"Routed by sender:   {total_routed} (regex skipped)")
+    if SENDER_ROUTING:
+        sender_index.precision_report(pg_engine)
     print("You can now run 'process_nlp_groq.py' to enrich the transactions.")
 
 if __name__ == "__main__":
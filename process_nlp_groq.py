@@ -1,203 +1,317 @@
 import pandas as pd
-from sqlalchemy import create_engine, text
-import psycopg2
-from google.cloud import bigquery
-from groq import Groq
-import json
+from sqlalchemy import text
 import sys
-import time
 import os
 
- 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = r"path"
+from llm_extraction import BATCH_SYSTEM_PROMPT, SYSTEM_PROMPT, extract_batch
+from template_cache import TemplateCache
+from bq_sink import BufferedBigQuerySink
+import result_memo
+from pipeline_context import get_context
+import metrics
+from status_updates import update_statuses
+from pipeline_runner import Pipeline, format_stats
+from pre_filter_data import SENDER_ROUTING, filter_next_batch
+import sender_index
+import pg_partitions
 
-DB_USER = "your_username_here"
-DB_PASS = os.getenv('VARIABLE_NAME')
-DB_HOST = "your_host_here"
-DB_PORT = "your_port_here"
-DB_NAME = "your_db_name_here"
+# Credentials and the Groq rate limits live in pipeline_context.py; the Postgres
+# engine, Groq engine and warehouse backend are built when the task runs
+GROQ_MODEL = "llama-3.1-8b-instant"
+# SMS packed into one chat completion (1 = the old one-message prompt)
+GROQ_MESSAGES_PER_REQUEST = int(os.getenv('GROQ_MESSAGES_PER_REQUEST', '10'))
 
-GROQ_API_KEY = os.getenv('VARIABLE_NAME')
+# Memoized results are only reused while the model and prompts are unchanged
+PROMPT_VERSION = result_memo.prompt_version(GROQ_MODEL, SYSTEM_PROMPT, BATCH_SYSTEM_PROMPT)
 
-if not DB_PASS or not GROQ_API_KEY:
-    print("ERROR: DB_PASS or GROQ_API_KEY environment variables not set.")
-    sys.exit(1)
+# Learned extractors for repeat SMS templates (see template_cache.py)
+TEMPLATE_CACHE_PATH = os.getenv('TEMPLATE_CACHE_PATH', 'template_cache.sqlite3')
+TEMPLATE_CACHE_MAX_ENTRIES = int(os.getenv('TEMPLATE_CACHE_MAX_ENTRIES', '50000'))
 
-BIGQUERY_TABLE_ID = "your_bq_table_id"
-POSTGRES_URL = f'postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+# Table in the warehouse backend (BigQuery or DuckDB, see warehouse.py)
+TRANSACTIONS_TABLE = "enriched_transactions"
+# (column, BigQuery type); backends build their own schema objects from it
+BQ_SCHEMA = [
+    ("message_auto_id", "INT64"),
+    ("timestamp_utc", "TIMESTAMP"),
+    ("sender_address", "STRING"),
+    ("message_body", "STRING"),
+    ("is_transaction", "BOOL"),
+    ("vendor_name", "STRING"),
+    ("amount", "FLOAT64"),
+    ("currency", "STRING"), 
+    ("transaction_type", "STRING"),
+    ("inferred_category", "STRING"),
+]
+# Free-text result fields, coerced to strings before they reach the sink
+LLM_STRING_COLUMNS = ('vendor_name', 'transaction_type', 'inferred_category')
+# Enriched rows are buffered and loaded in one job per flush (see bq_sink.py)
+BQ_FLUSH_MAX_ROWS = int(os.getenv('BQ_FLUSH_MAX_ROWS', '50000'))
+BQ_FLUSH_MAX_AGE_SECONDS = int(os.getenv('BQ_FLUSH_MAX_AGE_SECONDS', '300'))
+# Rows per fetch. The engine's rate limiter, not the batch size, keeps us
+# inside the RPM/TPM limits, so batches can be much larger.
+BATCH_SIZE = 200
+# Batches each stage may run ahead of the next one
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '2'))
+# Pre-filter pending rows on the fly once the pre_filtered backlog is drained
+PIPELINE_PREFILTER = os.getenv('PIPELINE_PREFILTER', '0') == '1'
 
-# --- 2. SETUP API CLIENTS ---
-try:
-    pg_engine = create_engine(POSTGRES_URL)
-    bq_client = bigquery.Client()
-    groq_client = Groq(api_key=GROQ_API_KEY)
-except Exception as e:
-    print(f"Error setting up clients: {e}", file=sys.stderr)
-    sys.exit(1)
+# Where each message's result came from: memo, template cache, LLM, or nowhere (error)
+MESSAGES_ENRICHED = metrics.counter('enrichment_messages_total', 'Messages enriched, by result source', task='enrichment')
+REQUEST_SIZE = metrics.histogram('llm_messages_per_request', 'Distinct messages packed into one request',
+                                 buckets=(1, 2, 5, 10, 20, 50))
+TOKENS_PER_MESSAGE = metrics.histogram('llm_tokens_per_message', 'Tokens per message of a request',
+                                       buckets=(25, 50, 100, 150, 200, 300, 500, 1000))
+# A request batch takes more than one call when its reply had to be split and retried
+LLM_CALLS = metrics.counter('llm_calls_total', 'Chat completions made, including split retries', task='enrichment')
+REQUEST_SUCCESS = metrics.histogram('llm_request_success_ratio', 'Messages parsed / attempted per request batch',
+                                    buckets=(0.5, 0.8, 0.9, 0.95, 0.99, 1.0))
 
 # --- 3. HELPER FUNCTIONS ---
 
-def get_groq_response_single(message_text, auto_id):
-    """Processes a SINGLE pre-filtered message."""
-    system_prompt = """
-    You are an expert financial SMS parser. You will receive a single SMS message
-    that has been pre-filtered and is a financial transaction.
-    
-    You MUST respond with a single, valid JSON object.
-    
-    For the SMS, extract:
-    1.  "is_transaction": true
-    2.  "vendor_name": (string, or "null")
-    3.  "amount": (float, or "null")
-    4.  "transaction_type": ("debit", "credit", or "info")
-    5.  "inferred_category": (One of: "Food", "Subscription", "Utilities", "Bank Alert", "Transport", "Shopping", "Other")
+def get_groq_response_batch(messages):
     """
-    user_prompt_content = f"Here is the SMS message to process:\n{message_text}"
+    Processes up to GROQ_MESSAGES_PER_REQUEST (auto_id, message_text) pairs
+    in one request. Returns ({auto_id: result or None}, tokens, calls).
+    """
+    return extract_batch(get_context().groq_engine, messages, GROQ_MODEL)
 
-    try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt_content}],
-            model="llama-3.1-8b-instant",
-            temperature=0.0,
-            response_format={"type": "json_object"},
+def mark_processed(message_ids, window_start=None):
+    """Called by the sink once a load job has committed these rows to the warehouse."""
+    update_statuses(get_context().pg_engine, {'processed': message_ids}, window_start)
+
+# --- 4. PIPELINE STAGES ---
+# fetch -> enrich -> load run concurrently over bounded queues (pipeline_runner.py)
+
+def fetch_batches(batch_size=BATCH_SIZE, window_start=None):
+    """
+    Yields pages of 'pre_filtered' rows by keyset. When they run out and
+    PIPELINE_PREFILTER is on, classifies the next batch of 'pending' rows
+    so new messages flow straight through instead of waiting for the
+    pre-filter task to finish. Month partitions before window_start
+    (see pg_partitions.py) are never read, and neither are rows that
+    arrive after the run started, so the task ends while ingestion goes on.
+    """
+    pg_engine = get_context().pg_engine
+    with pg_engine.connect() as conn:
+        max_id = conn.execute(text("SELECT COALESCE(MAX(auto_id), 0) FROM raw_notifications")).scalar()
+    # Buffered rows stay 'pre_filtered' until their flush, so page past them
+    last_seen = 0
+    pending_last_seen = 0
+    routes = None
+    while True:
+        df = pd.read_sql(
+            text("SELECT auto_id, timestamp_utc, sender_address, message_body FROM raw_notifications "
+                 "WHERE processing_status = 'pre_filtered' AND auto_id > :last_seen "
+                 "AND auto_id <= :max_id AND timestamp_utc >= :window_start "
+                 "ORDER BY auto_id ASC LIMIT :batch_size"),
+            pg_engine,
+            params={'last_seen': last_seen, 'max_id': max_id, 'batch_size': batch_size,
+                    'window_start': window_start or pg_partitions.EARLIEST}
         )
-        response_text = chat_completion.choices[0].message.content
-        response_data = json.loads(response_text)
-        
-        if isinstance(response_data, dict):
-            if "results" in response_data and isinstance(response_data["results"], list) and len(response_data["results"]) > 0:
-                return response_data["results"][0]
-            elif "is_transaction" in response_data:
-                return response_data
-        
-        raise ValueError("Single response was not a valid JSON object.")
-
-    except (json.JSONDecodeError, ValueError) as e:
-        print(f"  POISON PILL: ID {auto_id} failed. Reason: {e}.", file=sys.stderr)
-        return None # Mark as "error"
-    # Any other error (like 429) will stop the script
-
-def load_dataframe_to_bigquery(df):
-    if df.empty:
-        print("No valid rows to load into BigQuery.")
-        return
-    print(f"Loading {len(df)} processed rows into BigQuery...")
-    job_config = bigquery.LoadJobConfig(
-        schema=[
-            bigquery.SchemaField("message_auto_id", "INT64"),
-            bigquery.SchemaField("timestamp_utc", "TIMESTAMP"),
-            bigquery.SchemaField("sender_address", "STRING"),
-            bigquery.SchemaField("message_body", "STRING"),
-            bigquery.SchemaField("is_transaction", "BOOL"),
-            bigquery.SchemaField("vendor_name", "STRING"),
-            bigquery.SchemaField("amount", "FLOAT64"),
-            bigquery.SchemaField("currency", "STRING"), 
-            bigquery.SchemaField("transaction_type", "STRING"),
-            bigquery.SchemaField("inferred_category", "STRING"),
-        ],
-        write_disposition="WRITE_APPEND",
-    )
-    job = bq_client.load_table_from_dataframe(
-        df, BIGQUERY_TABLE_ID, job_config=job_config
+        if df.empty:
+            if PIPELINE_PREFILTER:
+                if routes is None:
+                    routes = {}
+                    if SENDER_ROUTING:
+                        sender_index.ensure_sender_tables(pg_engine)
+                        routes = sender_index.load_routes(pg_engine)
+                filtered = filter_next_batch(pg_engine, pending_last_seen, routes, window_start, max_id)
+                if filtered is not None:
+                    # The rows just classified all lie above the previous pending cursor,
+                    # which can be below last_seen, so page again from there
+                    last_seen = min(last_seen, pending_last_seen)
+                    pending_last_seen, good, junk, routed = filtered
+                    print(f"  Pre-filtered pending rows up to {pending_last_seen}: {good} transactions, "
+                          f"{junk} junk ({routed} routed by sender)")
+                    continue
+            print("\nNo more 'pre_filtered' rows found.")
+            return
+        last_seen = int(df['auto_id'].max())
+        yield df
+
+def as_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and pd.isna(value):
+        return None
+    return str(value)
+
+def conform_results(final_df):
+    """
+    Coerces result columns to BQ_SCHEMA's types, since one value Arrow
+    can't convert would fail the sink's whole buffer. Rows whose
+    is_transaction is not a bool are dropped. Returns (df, dropped auto_ids).
+    """
+    # str 'null' -> pd.NA
+    final_df['amount'] = pd.to_numeric(final_df['amount'], errors='coerce')
+    for column in LLM_STRING_COLUMNS:
+        final_df[column] = final_df[column].map(as_text)
+    not_bool = ~final_df['is_transaction'].map(lambda value: isinstance(value, bool))
+    return final_df[~not_bool].copy(), set(final_df.loc[not_bool, 'message_auto_id'])
+
+def enrich_batch(df, template_cache):
+    """
+    Memo -> template cache -> Groq for one page. Returns
+    (final_df or None, processed_ids, error_ids, memo hits).
+    """
+    print(f"\n--- Processing Batch (Rows {df['auto_id'].min()}-{df['auto_id'].max()}) ---")
+    context = get_context()
+
+    processed_data_list = []
+    processed_ids = []
+    error_ids = []
+
+    rows_by_id = {row['auto_id']: row for _, row in df.iterrows()}
+    hash_by_id = {auto_id: result_memo.content_hash(row['message_body']) for auto_id, row in rows_by_id.items()}
+
+    # 1. Reuse results for bodies we have already paid for (one query per batch)
+    memoized = result_memo.lookup_many(context.pg_engine, list(hash_by_id.values()), PROMPT_VERSION)
+    results_by_id = {
+        auto_id: dict(memoized[h]) for auto_id, h in hash_by_id.items() if h in memoized
+    }
+    batch_memo_hits = len(results_by_id)
+
+    # 2. Answer messages whose template we already know, locally
+    remaining_df = df[~df['auto_id'].isin(list(results_by_id))]
+    template_results = template_cache.lookup_many(
+        list(zip(remaining_df['auto_id'], remaining_df['sender_address'], remaining_df['message_body']))
     )
-    job.result()
-    print(f"Successfully loaded {len(df)} rows to {BIGQUERY_TABLE_ID}.")
-
-def update_postgres_status(message_ids, status="processed"):
-    if not message_ids:
-        return
-    print(f"Updating {len(message_ids)} rows in Postgres to '{status}'...")
-    id_tuple = tuple(message_ids)
-    sql_safe_ids = ""
-    if len(id_tuple) == 1:
-        sql_safe_ids = f"({id_tuple[0]})"
+    results_by_id.update(template_results)
+    MESSAGES_ENRICHED.inc(batch_memo_hits, source='memo')
+    MESSAGES_ENRICHED.inc(len(template_results), source='template_cache')
+
+    # 3. Send one copy of each remaining distinct body to Groq, K per request,
+    # concurrently. Duplicates inside the batch share the answer.
+    ids_by_hash = {}
+    for auto_id in remaining_df['auto_id']:
+        if auto_id not in results_by_id:
+            ids_by_hash.setdefault(hash_by_id[auto_id], []).append(auto_id)
+    messages = [(ids[0], rows_by_id[ids[0]]['message_body']) for ids in ids_by_hash.values()]
+    request_batches = [
+        messages[i:i + GROQ_MESSAGES_PER_REQUEST]
+        for i in range(0, len(messages), GROQ_MESSAGES_PER_REQUEST)
+    ]
+    batch_outputs = context.groq_engine.map(get_groq_response_batch, request_batches)
+
+    observations = []
+    new_memo = {}
+    for request_batch, (results, tokens, calls) in zip(request_batches, batch_outputs):
+        REQUEST_SIZE.observe(len(request_batch))
+        TOKENS_PER_MESSAGE.observe(tokens / len(request_batch))
+        LLM_CALLS.inc(calls)
+        REQUEST_SUCCESS.observe(sum(1 for result in results.values() if result) / len(request_batch))
+        for auto_id, result in results.items():
+            if result:
+                body_hash = hash_by_id[auto_id]
+                new_memo[body_hash] = result
+                for duplicate_id in ids_by_hash[body_hash]:
+                    results_by_id[duplicate_id] = dict(result)
+                MESSAGES_ENRICHED.inc(len(ids_by_hash[body_hash]), source='llm')
+                observations.append((rows_by_id[auto_id]['sender_address'], rows_by_id[auto_id]['message_body'], dict(result)))
+
+    result_memo.store_many(context.pg_engine, new_memo, PROMPT_VERSION)
+
+    # Teach the cache from this batch's LLM answers
+    template_cache.learn_many(observations)
+
+    for auto_id, row in rows_by_id.items():
+        single_result = results_by_id.get(auto_id)
+        if single_result:
+            single_result.update({
+                'message_auto_id': auto_id,
+                'timestamp_utc': row['timestamp_utc'],
+                'sender_address': row['sender_address'],
+                'message_body': row['message_body']
+            })
+            processed_data_list.append(single_result)
+            processed_ids.append(auto_id)
+        else:
+            error_ids.append(auto_id)
+
+    final_df = None
+    if processed_data_list:
+        final_df = pd.DataFrame(processed_data_list)
+
+        final_df, bad_ids = conform_results(final_df)
+        if bad_ids:
+            print(f"  {len(bad_ids)} results without a boolean is_transaction marked as errors")
+            error_ids.extend(bad_ids)
+            processed_ids = [auto_id for auto_id in processed_ids if auto_id not in bad_ids]
+
+        final_df['currency'] = 'INR'
+        final_df.rename(columns={'auto_id': 'message_auto_id'}, inplace=True)
+        final_df = final_df.reindex(columns=[name for name, _ in BQ_SCHEMA])
+        if final_df.empty:
+            final_df = None
+
+    MESSAGES_ENRICHED.inc(len(error_ids), source='error')
+    return final_df, processed_ids, error_ids, batch_memo_hits
+
+def load_batch(sink, enriched, window_start=None):
+    """Buffers good rows for the warehouse and marks poison pills as 'error'."""
+    final_df, processed_ids, error_ids, _ = enriched
+    if final_df is not None:
+        # Marked 'processed' only once the sink's load job succeeds
+        sink.add(final_df, processed_ids)
     else:
-        sql_safe_ids = str(id_tuple)     
-    with pg_engine.connect() as conn:
-        conn.execute(
-            text(f"UPDATE raw_notifications SET processing_status = '{status}' WHERE auto_id IN {sql_safe_ids}")
-        )
-        conn.commit() 
+        # The age limit still applies when a batch brings no good rows
+        sink.flush_if_due()
+
+    context = get_context()
+    update_statuses(context.pg_engine, {'error': error_ids}, window_start)
+
+    print(f"--- Batch complete. Good: {len(processed_ids)}, Poison Pills: {len(error_ids)}, "
+          f"Buffered for the warehouse: {sink.buffered_rows} ---")
 
-# --- 4. MAIN ORCHESTRATION (THE EFFICIENT ROW-BY-ROW LOGIC) ---
+# --- 5. MAIN ORCHESTRATION ---
+@metrics.task('enrichment')
 def main():
-    print("--- Starting NLP Enrichment Script (Row-by-Row) ---")
-    
-    # We will fetch 20 rows at a time.
-    # 20 rows/batch * 3 sec/req = 60 seconds.
-    # This perfectly matches our 20 RPM Groq limit.
-    BATCH_SIZE = 20 
-    
+    print("--- Starting NLP Enrichment Script (Pipelined) ---")
+
+    context = get_context()
+    template_cache = TemplateCache(TEMPLATE_CACHE_PATH, max_entries=TEMPLATE_CACHE_MAX_ENTRIES)
+    result_memo.ensure_memo_table(context.pg_engine)
+    memo_hits = 0
+    # Every row this run can touch is at or after the oldest open one
+    window_start = pg_partitions.open_window_start(context.pg_engine)
+    print(f"Open rows start at {window_start}; older partitions are skipped.")
+    # Month-partitioned and clustered when the warehouse supports it (warehouse.py)
+    context.warehouse.ensure_table(TRANSACTIONS_TABLE, BQ_SCHEMA)
+    sink = BufferedBigQuerySink(
+        context.warehouse, TRANSACTIONS_TABLE, BQ_SCHEMA,
+        on_flush=lambda message_ids: mark_processed(message_ids, window_start),
+        max_rows=BQ_FLUSH_MAX_ROWS,
+        max_age_seconds=BQ_FLUSH_MAX_AGE_SECONDS,
+        partition_field='timestamp_utc',
+    )
+
+    def enrich(df):
+        nonlocal memo_hits
+        enriched = enrich_batch(df, template_cache)
+        memo_hits += enriched[3]
+        return enriched
+
     try:
-        while True:
-            # 1. Fetch ONLY pre-filtered rows
-            df = pd.read_sql(
-                f"SELECT auto_id, timestamp_utc, sender_address, message_body FROM raw_notifications WHERE processing_status = 'pre_filtered' ORDER BY auto_id ASC LIMIT {BATCH_SIZE}",
-                pg_engine
-            )
-            
-            if df.empty:
-                print("\nNo more 'pre_filtered' rows found. Pipeline complete.")
-                break 
-
-            print(f"\n--- Processing Batch (Rows {df['auto_id'].min()}-{df['auto_id'].max()}) ---")
-            
-            processed_data_list = []
-            processed_ids = []
-            error_ids = []
-            
-            # 2. Loop row-by-row (this is reliable)
-            for index, row in df.iterrows():
-                auto_id = row['auto_id']
-                message_text = row['message_body']
-                
-                print(f"    Processing ID: {auto_id}...", end="")
-                
-                single_result = get_groq_response_single(message_text, auto_id)
-                
-                if single_result:
-                    print(" OK")
-                    single_result.update({
-                        'message_auto_id': auto_id,
-                        'timestamp_utc': row['timestamp_utc'],
-                        'sender_address': row['sender_address'],
-                        'message_body': message_text
-                    })
-                    processed_data_list.append(single_result)
-                    processed_ids.append(auto_id)
-                else:
-                    print(" FAILED (Poison Pill)")
-                    error_ids.append(auto_id)
-                
-                # --- THIS IS THE 20 RPM RATE LIMIT FIX ---
-                time.sleep(3) # 60 sec / 20 req = 3 sec/req
-            
-            # 3. Load & Update
-            if processed_data_list:
-                final_df = pd.DataFrame(processed_data_list)
-
-                print("  Cleaning data types (str 'null' -> pd.NA)...")
-                final_df['amount'] = pd.to_numeric(final_df['amount'], errors='coerce')
-
-                final_df['currency'] = 'INR'
-                final_df.rename(columns={'auto_id': 'message_auto_id'}, inplace=True)
-                bq_columns = [
-                    'message_auto_id', 'timestamp_utc', 'sender_address', 'message_body',
-                    'is_transaction', 'vendor_name', 'amount', 'currency',
-                    'transaction_type', 'inferred_category'
-                ]
-                final_df = final_df.reindex(columns=bq_columns)
-                load_dataframe_to_bigquery(final_df)
-            
-            update_postgres_status(processed_ids, status="processed")
-            update_postgres_status(error_ids, status="error")
-                
-            print(f"--- Batch complete. Good: {len(processed_ids)}, Poison Pills: {len(error_ids)} ---")
+        # Fetch of page N+1, enrichment of page N and loading of page N-1 overlap
+        stats = Pipeline(queue_size=PIPELINE_QUEUE_SIZE).run(
+            fetch_batches(window_start=window_start),
+            [('enrich', enrich)],
+            lambda enriched: load_batch(sink, enriched, window_start),
+        )
+
+        # Whatever is still buffered goes out in one final load job
+        sink.flush()
+        print(f"Warehouse load jobs this run: {sink.load_jobs}. Groq: {context.groq_engine.stats}")
+        print(f"Pipeline stages:\n{format_stats(stats)}")
 
     except Exception as e:
         print(f"A CRITICAL, unrecoverable error occurred: {e}", file=sys.stderr)
         print("Stopping the pipeline to prevent data corruption.")
         sys.exit(1)
+    finally:
+        print(f"Memo hits: {memo_hits}. Template cache: {template_cache.stats}, hit rate {template_cache.hit_rate():.0%}")
+        template_cache.close()
 
     print("\n--- NLP Enrichment Run Complete ---")
 
@@ -0,0 +1,465 @@
+"""
+Real-time SMS push ingestion: devices POST messages as they arrive
+instead of waiting for the daily XML export.
+
+    python realtime_ingest.py          # listens on REALTIME_HOST:REALTIME_PORT
+
+Devices authenticate with "Authorization: Bearer $REALTIME_API_TOKEN";
+without a token the service refuses to listen on anything but loopback.
+
+    POST /sms      one message, a JSON list of them, or {"messages": [...]}; each is
+                   {"address": "VM-HDFCBK", "date": 1732012639586, "body": "..."}
+                   (the attributes of a backup's <sms>, so the ID is the same and a
+                   later XML import of the same messages inserts nothing)
+    GET /healthz   liveness and the number of records waiting to be written
+    GET /metrics   the metrics registry in Prometheus text format
+
+Requests are not written one by one. Their records are buffered and
+written as one COPY per micro-batch, when FLUSH_MAX_RECORDS are waiting
+or the oldest has waited FLUSH_MAX_DELAY_MS, by FLUSH_WRITERS threads on
+pooled connections. The same transaction runs the pre-filter on the rows
+that were new, so they reach enrichment as 'pre_filtered' or 'junk'
+without waiting for the daily pre-filter run. A request is answered once
+its batch is committed: a 200 means the messages are stored, and anything
+else can be retried safely, because duplicates are skipped by ID.
+
+Memory is bounded: at most MAX_CONNECTIONS connections, MAX_BODY_BYTES per
+request and MAX_PENDING_RECORDS accepted but not yet committed. Past that
+the service answers 503 with Retry-After instead of queueing more.
+
+The HTTP/1.1 handling is just what the devices need (Content-Length
+bodies, keep-alive, pipelining) and runs on asyncio alone.
+"""
+import asyncio
+import collections
+import contextlib
+import hmac
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from pipeline_context import get_context
+import ingest_xml
+import metrics
+import pg_partitions
+import pre_filter_data
+import sender_index
+
+# --- 1. SETTINGS ---
+# Postgres credentials live in pipeline_context.py
+REALTIME_HOST = os.getenv('REALTIME_HOST', '0.0.0.0')
+REALTIME_PORT = int(os.getenv('REALTIME_PORT', '8080'))
+# Devices send "Authorization: Bearer <token>". Without a token there is no check,
+# which is only allowed when listening on a loopback address
+REALTIME_API_TOKEN = os.getenv('REALTIME_API_TOKEN')
+LOOPBACK_HOSTS = {'127.0.0.1', 'localhost', '::1'}
+
+# A micro-batch is written when this many records wait, or the oldest has waited this long
+FLUSH_MAX_RECORDS = int(os.getenv('REALTIME_FLUSH_RECORDS', '2000'))
+FLUSH_MAX_DELAY_MS = float(os.getenv('REALTIME_FLUSH_MS', '5'))
+# Concurrent micro-batch writes (each holds one pooled connection)
+FLUSH_WRITERS = int(os.getenv('REALTIME_WRITERS', '2'))
+# Pre-filter new rows in the write transaction; off leaves them 'pending' for the daily run
+REALTIME_PRE_FILTER = os.getenv('REALTIME_PRE_FILTER', '1') == '1'
+# Sender routes (sender_index.py) are reloaded this often
+ROUTES_REFRESH_SECONDS = 600
+
+# Backpressure: records accepted but not committed, and the size of one connection's state
+MAX_PENDING_RECORDS = int(os.getenv('REALTIME_MAX_PENDING', '50000'))
+MAX_CONNECTIONS = int(os.getenv('REALTIME_MAX_CONNECTIONS', '2000'))
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+IDLE_TIMEOUT_SECONDS = 60
+RETRY_AFTER_SECONDS = 1
+# Dates this far ahead of the server clock are rejected (they would create far-future partitions)
+MAX_FUTURE_SKEW = timedelta(days=1)
+
+RETURNING_COLUMNS = ['auto_id', 'source_message_id', 'timestamp_utc', 'sender_address', 'message_body']
+
+REQUESTS = metrics.counter('realtime_requests_total', 'HTTP requests, by path and status code')
+RECORDS = metrics.counter('realtime_records_total', 'Pushed SMS records, by outcome (new, duplicate, invalid)')
+REQUEST_SECONDS = metrics.histogram('realtime_request_seconds', 'POST /sms from request read to response')
+FLUSH_SECONDS = metrics.histogram('realtime_flush_seconds', 'COPY, merge and pre-filter of one micro-batch')
+FLUSH_RECORDS = metrics.histogram('realtime_flush_records', 'Records per micro-batch',
+                                  buckets=(1, 10, 50, 100, 250, 500, 1000, 2000, 5000, 10000))
+FLUSH_FAILURES = metrics.counter('realtime_flush_failures_total', 'Micro-batches that failed to commit')
+PENDING_RECORDS = metrics.gauge('realtime_pending_records', 'Records accepted and not yet committed')
+OPEN_CONNECTIONS = metrics.gauge('realtime_open_connections', 'Open client connections')
+
+# --- 2. RECORDS ---
+def is_storable(value):
+    """Postgres text cannot hold NUL, and COPY needs valid UTF-8 (JSON allows lone surrogates)."""
+    if '\x00' in value:
+        return False
+    try:
+        value.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+def parse_record(item, now=None):
+    """One pushed message as a raw_notifications row, or None when it cannot be stored."""
+    if not isinstance(item, dict):
+        return None
+    address, date_millis, body = item.get('address'), item.get('date'), item.get('body')
+    if not isinstance(body, str) or not is_storable(body) or isinstance(date_millis, bool):
+        return None
+    if address is not None and not (isinstance(address, str) and is_storable(address)):
+        return None
+    try:
+        # Same string as a backup's date attribute, so the ID matches the XML import
+        record = ingest_xml.build_sms_record(address, str(int(date_millis)), body)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if record and record['timestamp_utc'] > (now or datetime.now()) + MAX_FUTURE_SKEW:
+        return None
+    return record
+
+def parse_payload(body):
+    """The records of a POST /sms body and how many items were unusable. Raises HttpError."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HttpError(400, "Body is not valid JSON.")
+    if isinstance(payload, dict) and 'messages' in payload:
+        payload = payload['messages']
+    items = payload if isinstance(payload, list) else [payload]
+    now = datetime.now()
+    records = [parse_record(item, now) for item in items]
+    valid = [record for record in records if record is not None]
+    return valid, len(records) - len(valid)
+
+# --- 3. MICRO-BATCHED WRITES ---
+class Overloaded(Exception):
+    """More records are waiting than MAX_PENDING_RECORDS allows."""
+
+class MicroBatcher:
+    """
+    Collects the records of many requests and writes them in micro-batches.
+    submit() returns a future per request that resolves to its (new,
+    duplicate) counts once its batch is committed.
+    """
+    def __init__(self, engine, max_records=FLUSH_MAX_RECORDS, max_delay_ms=FLUSH_MAX_DELAY_MS,
+                 writers=FLUSH_WRITERS, max_pending=MAX_PENDING_RECORDS, pre_filter=REALTIME_PRE_FILTER):
+        self.engine = engine
+        self.max_records = max_records
+        self.max_delay = max_delay_ms / 1000
+        self.max_pending = max_pending
+        self.pre_filter = pre_filter
+        self.buffer = collections.deque() # (records, future, arrival time) per request, oldest first
+        self.buffered = 0
+        self.pending = 0 # buffered + being written
+        self.wakeup = asyncio.Event()
+        self.writer_slots = asyncio.Semaphore(writers)
+        self.executor = ThreadPoolExecutor(writers, thread_name_prefix='realtime-writer')
+        self.flushes = set()
+        self.closing = False
+        # Months whose partition exists; only new months cost a round trip.
+        # Shared by the writer threads.
+        self.known_months = set()
+        self.months_lock = threading.Lock()
+        self.routes = None
+        self.routes_loaded_at = None
+
+    def submit(self, records):
+        if self.closing or self.pending + len(records) > self.max_pending:
+            raise Overloaded()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self.buffer or self.buffered + len(records) >= self.max_records:
+            self.wakeup.set() # starts the delay timer, or flushes a full batch now
+        self.buffer.append((records, future, loop.time()))
+        self.buffered += len(records)
+        self.pending += len(records)
+        PENDING_RECORDS.set(self.pending)
+        return future
+
+    def take(self):
+        """Whole requests from the front of the buffer, up to about max_records."""
+        batch = []
+        n_records = 0
+        while self.buffer and n_records < self.max_records:
+            records, future, _ = self.buffer.popleft()
+            batch.append((records, future))
+            n_records += len(records)
+        self.buffered -= n_records
+        return batch
+
+    async def run(self):
+        """Flush loop; returns once close() was called and everything is written."""
+        loop = asyncio.get_running_loop()
+        while self.buffer or not self.closing:
+            if not self.buffer:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            wait = self.buffer[0][2] + self.max_delay - loop.time()
+            if self.buffered < self.max_records and wait > 0 and not self.closing:
+                self.wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                continue
+            # With every writer busy the buffer keeps growing until submit() sheds load
+            await self.writer_slots.acquire()
+            task = asyncio.create_task(self.flush(self.take()))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+        if self.flushes:
+            await asyncio.gather(*self.flushes)
+        self.executor.shutdown()
+
+    async def close(self, flusher):
+        self.closing = True
+        self.wakeup.set()
+        await flusher
+
+    async def current_routes(self, loop):
+        if not (self.pre_filter and pre_filter_data.SENDER_ROUTING):
+            return None
+        if self.routes_loaded_at is None or time.monotonic() - self.routes_loaded_at > ROUTES_REFRESH_SECONDS:
+            self.routes_loaded_at = time.monotonic()
+            self.routes = await loop.run_in_executor(self.executor, sender_index.load_routes, self.engine)
+        return self.routes
+
+    async def flush(self, batch):
+        loop = asyncio.get_running_loop()
+        records = [record for request_records, _ in batch for record in request_records]
+        try:
+            routes = await self.current_routes(loop)
+            with FLUSH_SECONDS.time():
+                new_ids = await loop.run_in_executor(self.executor, self.write, records, routes)
+        except Exception as e:
+            print(f"Writing a micro-batch of {len(records)} records failed: {e}")
+            FLUSH_FAILURES.inc()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            FLUSH_RECORDS.observe(len(records))
+            for request_records, future in batch:
+                new = 0
+                for record in request_records:
+                    # A message sent twice in one batch is new only once
+                    if record['source_message_id'] in new_ids:
+                        new_ids.discard(record['source_message_id'])
+                        new += 1
+                RECORDS.inc(new, outcome='new')
+                RECORDS.inc(len(request_records) - new, outcome='duplicate')
+                if not future.done():
+                    future.set_result((new, len(request_records) - new))
+        finally:
+            self.pending -= len(records)
+            PENDING_RECORDS.set(self.pending)
+            self.writer_slots.release()
+
+    def write(self, records, routes):
+        """
+        COPY + merge of one micro-batch, and the pre-filter of the rows that
+        were new, in one transaction (runs in a writer thread). Returns the
+        IDs that were inserted.
+        """
+        with self.months_lock:
+            months = ingest_xml.batch_months(records) - self.known_months
+            if months:
+                pg_partitions.ensure_partitions(self.engine, months)
+                self.known_months |= months
+        with self.engine.begin() as conn:
+            with conn.connection.cursor() as cur:
+                rows = ingest_xml.stage_and_merge(
+                    cur, ingest_xml.to_copy_buffer(records), returning=", ".join(RETURNING_COLUMNS))
+            if self.pre_filter and rows:
+                df = pd.DataFrame(rows, columns=RETURNING_COLUMNS)
+                # Only the batch's own months are touched
+                window_start = df['timestamp_utc'].min().to_pydatetime()
+                pre_filter_data.pre_filter_rows(conn, df, routes, window_start)
+        return {row[1] for row in rows}
+
+# --- 4. HTTP ---
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed',
+           411: 'Length Required', 413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+           501: 'Not Implemented', 503: 'Service Unavailable'}
+
+Request = collections.namedtuple('Request', 'method path headers body keep_alive')
+
+class HttpError(Exception):
+    """Answered with its status; the connection is closed unless the request was read completely."""
+    def __init__(self, status, message, headers=(), keep_alive=False):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+        self.keep_alive = keep_alive
+
+def http_response(status, payload, keep_alive, headers=(), content_type='application/json'):
+    body = payload.encode('utf-8') if isinstance(payload, str) else json.dumps(payload).encode('utf-8')
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head.extend(f"{name}: {value}" for name, value in headers)
+    return ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+async def read_request(reader, writer):
+    """The next request on the connection, or None when the client closed it between requests."""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "Request headers are too large.")
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HttpError(400, "Malformed request line.")
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    if 'transfer-encoding' in headers:
+        raise HttpError(501, "Chunked bodies are not supported; send Content-Length.")
+    try:
+        length = int(headers.get('content-length', '0'))
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length.")
+    if length < 0:
+        raise HttpError(400, "Invalid Content-Length.")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Bodies are limited to {MAX_BODY_BYTES} bytes; split the batch.")
+    if length and headers.get('expect', '').lower() == '100-continue':
+        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+    body = await reader.readexactly(length) if length else b''
+    return Request(method, target.split('?', 1)[0], headers, body, keep_alive)
+
+class IngestServer:
+    def __init__(self, batcher, api_token=REALTIME_API_TOKEN, max_connections=MAX_CONNECTIONS):
+        self.batcher = batcher
+        self.api_token = api_token
+        self.max_connections = max_connections
+        self.connections = set()
+
+    async def handle_connection(self, reader, writer):
+        if len(self.connections) >= self.max_connections:
+            REQUESTS.inc(path='*', status=503)
+            writer.write(http_response(503, {'error': "Too many connections."}, False,
+                                       [('Retry-After', RETRY_AFTER_SECONDS)]))
+            with contextlib.suppress(ConnectionError):
+                await writer.drain()
+            writer.close()
+            return
+        self.connections.add(writer)
+        OPEN_CONNECTIONS.set(len(self.connections))
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader, writer), IDLE_TIMEOUT_SECONDS)
+                    if request is None:
+                        break
+                    status, payload, headers, content_type = await self.dispatch(request)
+                    keep_alive = request.keep_alive
+                    path = request.path
+                except HttpError as e:
+                    status, payload, headers, content_type = e.status, {'error': str(e)}, e.headers, 'application/json'
+                    keep_alive = e.keep_alive
+                    path = '*'
+                REQUESTS.inc(path=path, status=status)
+                writer.write(http_response(status, payload, keep_alive, headers, content_type))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass # Idle, or gone mid-request
+        finally:
+            self.connections.discard(writer)
+            OPEN_CONNECTIONS.set(len(self.connections))
+            writer.close()
+
+    async def dispatch(self, request):
+        """(status, payload, extra headers, content type) for one request."""
+        if request.path == '/sms':
+            if request.method != 'POST':
+                raise HttpError(405, "Use POST.", [('Allow', 'POST')], keep_alive=request.keep_alive)
+            start = time.perf_counter()
+            try:
+                return (200, await self.post_sms(request), (), 'application/json')
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - start)
+        if request.path == '/healthz':
+            return 200, {'status': 'ok', 'pending_records': self.batcher.pending}, (), 'application/json'
+        if request.path == '/metrics':
+            return 200, metrics.REGISTRY.to_prometheus(), (), 'text/plain; version=0.0.4'
+        raise HttpError(404, f"No route for {request.path}.", keep_alive=request.keep_alive)
+
+    async def post_sms(self, request):
+        keep_alive = request.keep_alive
+        if self.api_token:
+            supplied = request.headers.get('authorization', '').removeprefix('Bearer ').strip()
+            if not hmac.compare_digest(supplied.encode(), self.api_token.encode()):
+                raise HttpError(401, "Missing or wrong API token.", keep_alive=keep_alive)
+        records, invalid = parse_payload(request.body)
+        RECORDS.inc(invalid, outcome='invalid')
+        if len(records) > self.batcher.max_pending:
+            raise HttpError(413, "Too many messages in one request; split the batch.", keep_alive=keep_alive)
+
+        new = duplicates = 0
+        if records:
+            try:
+                new, duplicates = await self.batcher.submit(records)
+            except Overloaded:
+                raise HttpError(503, "Busy; retry later.", [('Retry-After', RETRY_AFTER_SECONDS)], keep_alive)
+            except Exception:
+                raise HttpError(503, "Could not store the messages; retry later.",
+                                [('Retry-After', RETRY_AFTER_SECONDS)], keep_alive)
+        return {'received': len(records) + invalid, 'new': new, 'duplicates': duplicates, 'invalid': invalid}
+
+# --- 5. MAIN ---
+async def serve(host=REALTIME_HOST, port=REALTIME_PORT):
+    print("--- Starting Real-time Ingestion Service ---")
+    if not REALTIME_API_TOKEN and host not in LOOPBACK_HOSTS:
+        print(f"CRITICAL: refusing to listen on {host} without REALTIME_API_TOKEN; "
+              "set a token or bind REALTIME_HOST to a loopback address.", file=sys.stderr)
+        sys.exit(1)
+    engine = get_context().pg_engine
+    ingest_xml.ensure_dedup_index(engine)
+    if REALTIME_PRE_FILTER and pre_filter_data.SENDER_ROUTING:
+        sender_index.ensure_sender_tables(engine)
+
+    batcher = MicroBatcher(engine)
+    flusher = asyncio.create_task(batcher.run())
+    ingest_server = IngestServer(batcher)
+    server = await asyncio.start_server(ingest_server.handle_connection, host, port,
+                                        limit=MAX_HEADER_BYTES, backlog=1024)
+    print(f"Listening on {host}:{port} (micro-batches of {FLUSH_MAX_RECORDS} records or "
+          f"{FLUSH_MAX_DELAY_MS:g} ms, {FLUSH_WRITERS} writers, "
+          f"pre-filter {'on' if REALTIME_PRE_FILTER else 'off'}).")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    # Stop accepting, answer what was accepted, then drop idle keep-alive connections
+    print("Shutting down: writing the records still buffered...")
+    server.close()
+    await batcher.close(flusher)
+    for writer in list(ingest_server.connections):
+        writer.close()
+    await server.wait_closed()
+    get_context().close()
+    metrics.export('realtime_ingest')
+    metrics.print_summary()
+
+if __name__ == "__main__":
+    asyncio.run(serve())
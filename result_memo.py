@@ -0,0 +1,63 @@
+"""
+Exact-content memo of LLM extraction results, stored in Postgres.
+
+The same SMS body often arrives under several auto_ids (duplicate
+deliveries, re-imported backups, forwarded alerts). Results are keyed by a
+hash of the whitespace-normalized body plus a prompt version, so a change
+to the model or the system prompts invalidates old entries automatically.
+Lookups and inserts are one statement per batch.
+"""
+import hashlib
+import json
+
+from sqlalchemy import text
+
+def normalize_body(message_body):
+    return ' '.join((message_body or '').split())
+
+def content_hash(message_body):
+    return hashlib.sha256(normalize_body(message_body).encode('utf-8')).hexdigest()
+
+def prompt_version(model, *prompts):
+    """Short digest of everything that shapes the LLM's answer."""
+    return hashlib.sha256("\x1f".join((model,) + prompts).encode('utf-8')).hexdigest()[:16]
+
+def ensure_memo_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS llm_result_memo (
+                content_hash TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                result JSONB NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (content_hash, prompt_version)
+            )
+        """))
+
+def lookup_many(engine, hashes, version):
+    """Returns {content_hash: result} for every hash memoized under `version`."""
+    if not hashes:
+        return {}
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT content_hash, result FROM llm_result_memo "
+                 "WHERE prompt_version = :version AND content_hash = ANY(CAST(:hashes AS TEXT[]))"),
+            {'version': version, 'hashes': list(set(hashes))},
+        ).fetchall()
+    return {row.content_hash: row.result for row in rows}
+
+def store_many(engine, results_by_hash, version):
+    """Memoizes {content_hash: result}; existing entries are left alone."""
+    if not results_by_hash:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO llm_result_memo (content_hash, prompt_version, result)
+            SELECT h, :version, CAST(r AS JSONB)
+            FROM unnest(CAST(:hashes AS TEXT[]), CAST(:results AS TEXT[])) AS u(h, r)
+            ON CONFLICT (content_hash, prompt_version) DO NOTHING
+        """), {
+            'version': version,
+            'hashes': list(results_by_hash),
+            'results': [json.dumps(result) for result in results_by_hash.values()],
+        })
@@ -1,57 +1,159 @@
 import os
+from datetime import date
 import pandas as pd
-from google.cloud import bigquery
-from scipy import stats
-import sys
 
+from anomaly_scoring import STAT_COLUMNS, apply_changes, score_groups
+from subscription_detector import detect_subscriptions
+from pipeline_context import get_context
+import metrics
+from warehouse import DIRTY_MONTHS_TABLE
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = r"path"
 
-# Set your project and table IDs
-BQ_PROJECT_ID = "your_project_id_here"
-BQ_DATASET_ID = "your_database_id_here"
-SOURCE_TABLE = f"{BQ_PROJECT_ID}.{BQ_DATASET_ID}.agg_monthly_spend"
-DESTINATION_TABLE = f"{BQ_PROJECT_ID}.{BQ_DATASET_ID}.fct_anomalies"
+# Table names in the warehouse; the project/dataset (BigQuery) or file (DuckDB)
+# comes from warehouse.py, selected with WAREHOUSE_BACKEND. The backend itself
+# is built on first use by pipeline_context.py, not at import.
+SOURCE_TABLE = "agg_monthly_spend"
+DESTINATION_TABLE = "fct_anomalies"
+# Enriched transactions loaded by process_nlp_groq.py, and detected subscriptions
+TRANSACTIONS_TABLE = "enriched_transactions"
+SUBSCRIPTIONS_TABLE = "fct_subscriptions"
+# Running statistics per group, and the monthly values already folded into them
+ANOMALY_STATE_TABLE = "anomaly_group_state"
+ANOMALY_SCORED_TABLE = "anomaly_scored_months"
 
 
 ANOMALY_THRESHOLD = 2.5 
+# Rows are compared only within the same group, e.g. add 'vendor_name' or a user column
+ANOMALY_GROUP_COLUMNS = ['inferred_category']
+# 'zscore' (mean/std, the original) or 'mad' (median/MAD, robust to outliers)
+ANOMALY_METHOD = os.getenv('ANOMALY_METHOD', 'zscore')
+# Only fold new/changed months into persisted stats (zscore only); '0' recomputes everything
+ANOMALY_INCREMENTAL = os.getenv('ANOMALY_INCREMENTAL', '1') == '1'
+# '1' rebuilds every month of agg_monthly_spend instead of only the dirty ones
+MODEL_FULL_REBUILD = os.getenv('MODEL_FULL_REBUILD', '0') == '1'
+# Debits read for subscription detection: this many months back (0 = all history).
+# Three years still sees an annual plan charge twice after a missed renewal.
+SUBSCRIPTION_LOOKBACK_MONTHS = int(os.getenv('SUBSCRIPTION_LOOKBACK_MONTHS', '36'))
 
-try:
-    bq_client = bigquery.Client()
-    print("BigQuery client created successfully.")
-except Exception as e:
-    print(f" CRITICAL: Could not create BigQuery client. Check credentials. Error: {e}")
-    sys.exit(1)
+ROWS_SCORED = metrics.counter('analytics_rows_scored_total', 'Monthly spend rows scored', task='anomalies')
+ANOMALIES_FOUND = metrics.gauge('analytics_anomalies_found', 'Anomalies written by the last run')
+DEBITS_SCANNED = metrics.counter('analytics_debits_scanned_total', 'Debits read for subscription detection', task='subscriptions')
+SUBSCRIPTIONS_FOUND = metrics.gauge('analytics_subscriptions_found', 'Recurring series found by the last run, by flag')
+MONTHS_REBUILT = metrics.gauge('analytics_months_rebuilt', 'Months of agg_monthly_spend recomputed by the last build')
 
-# --- 2. FUNCTION TO CALCULATE Z-SCORE SAFELY ---
-def calculate_safe_zscore(group):
+def table(name):
+    return get_context().warehouse.table(name)
+
+# --- 2. Z-SCORES ---
+# The vectorized scoring engine lives in anomaly_scoring.py
+
+# --- 2b. MODELING: agg_monthly_spend ---
+def month_window(column, months):
     """
-    Calculates Z-score for a group.
-    Handles groups with too few data points to be statistically valid.
+    Constant range predicate covering the given months (consecutive ones
+    merged), which the warehouse can prune partitions / row groups with.
     """
-    # A Z-score is meaningless with 2 or fewer data points
-    if len(group) < 3:
-        group['z_score'] = 0.0 # Assign a neutral score
-    else:
-        # Calculate Z-score for 'total_amount'
-        # nan_policy='omit' will ignore nulls
-        # ddof=0 calculates the population standard deviation
-        group['z_score'] = stats.zscore(group['total_amount'], ddof=0, nan_policy='omit')
-    
-    return group
+    warehouse_backend = get_context().warehouse
+    ranges = []
+    for month in sorted(months):
+        following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        if ranges and ranges[-1][1] == month:
+            ranges[-1][1] = following
+        else:
+            ranges.append([month, following])
+    return " OR ".join(
+        f"({column} >= {warehouse_backend.timestamp_literal(pd.Timestamp(start))} "
+        f"AND {column} < {warehouse_backend.timestamp_literal(pd.Timestamp(end))})"
+        for start, end in ranges
+    )
+
+def monthly_spend_sql(where=""):
+    groups = ", ".join(ANOMALY_GROUP_COLUMNS)
+    return f"""
+        SELECT {get_context().warehouse.month_trunc('timestamp_utc')} AS spend_month, {groups},
+               SUM(amount) AS total_amount
+        FROM {table(TRANSACTIONS_TABLE)}
+        WHERE transaction_type = 'debit' AND amount IS NOT NULL {where}
+        GROUP BY spend_month, {groups}
+    """
+
+def dirty_months():
+    """Months of the transactions logged dirty by the loader, and the newest log entry."""
+    warehouse_backend = get_context().warehouse
+    if not warehouse_backend.table_exists(DIRTY_MONTHS_TABLE):
+        return [], None
+    df = warehouse_backend.query_dataframe(f"""
+        SELECT DISTINCT month, MAX(logged_at) OVER () AS logged_through
+        FROM {table(DIRTY_MONTHS_TABLE)} WHERE table_name = '{TRANSACTIONS_TABLE}'
+    """)
+    if df.empty:
+        return [], None
+    return sorted(pd.to_datetime(df['month']).dt.date), pd.Timestamp(df['logged_through'].iloc[0])
+
+@metrics.task('warehouse_models')
+def build_monthly_spend(full=MODEL_FULL_REBUILD):
+    """
+    Refreshes agg_monthly_spend (debit totals per month and group) from the
+    enriched transactions. Only the months the loader logged as dirty are
+    recomputed, reading just their partitions; the first build (or
+    full=True) rebuilds every month.
+    """
+    warehouse_backend = get_context().warehouse
+    groups = ", ".join(ANOMALY_GROUP_COLUMNS)
+    months, logged_through = dirty_months()
+    clear_log = ""
+    if logged_through is not None:
+        clear_log = (f"DELETE FROM {table(DIRTY_MONTHS_TABLE)} WHERE table_name = '{TRANSACTIONS_TABLE}' "
+                     f"AND logged_at <= {warehouse_backend.timestamp_literal(logged_through)};")
+
+    if full or not warehouse_backend.table_exists(SOURCE_TABLE):
+        print(f"Building {SOURCE_TABLE} from all of {TRANSACTIONS_TABLE}...")
+        warehouse_backend.create_table_as(SOURCE_TABLE, monthly_spend_sql())
+        if clear_log:
+            warehouse_backend.execute(clear_log)
+        built = warehouse_backend.query_dataframe(
+            f"SELECT COUNT(DISTINCT spend_month) AS n FROM {table(SOURCE_TABLE)}")
+        MONTHS_REBUILT.set(int(built['n'].iloc[0]))
+        return
+
+    if not months:
+        print(f"No new transactions since the last build; {SOURCE_TABLE} is up to date.")
+        MONTHS_REBUILT.set(0)
+        return
+
+    # Swap the dirty months in one transaction; only their partitions are read
+    print(f"Rebuilding {len(months)} months of {SOURCE_TABLE}: {', '.join(f'{m:%Y-%m}' for m in months)}")
+    month_list = ", ".join(f"DATE '{month}'" for month in months)
+    warehouse_backend.execute(f"""
+        BEGIN TRANSACTION;
+        DELETE FROM {table(SOURCE_TABLE)} WHERE spend_month IN ({month_list});
+        INSERT INTO {table(SOURCE_TABLE)} (spend_month, {groups}, total_amount)
+        {monthly_spend_sql(f"AND ({month_window('timestamp_utc', months)})")};
+        {clear_log}
+        COMMIT TRANSACTION;
+    """)
+    MONTHS_REBUILT.set(len(months))
 
 # --- 3. MAIN ANALYSIS LOGIC ---
+@metrics.task('anomalies')
 def run_anomaly_detection():
-    print(f"--- Starting Anomaly Detection ---")
+    if ANOMALY_INCREMENTAL and ANOMALY_METHOD == 'zscore':
+        return run_incremental_anomaly_detection()
+    # Medians can't be updated from a running summary, so MAD rescans everything
+    return run_full_anomaly_detection()
+
+def run_full_anomaly_detection():
+    warehouse_backend = get_context().warehouse
+    print(f"--- Starting Anomaly Detection (full recompute) ---")
     
-    # 1. Fetch data from BigQuery
+    # 1. Fetch data from the warehouse
     print(f"Fetching data from {SOURCE_TABLE}...")
     try:
-        query = f"SELECT * FROM `{SOURCE_TABLE}`"
-        df = bq_client.query(query).to_dataframe()
+        query = f"SELECT * FROM {table(SOURCE_TABLE)}"
+        df = warehouse_backend.query_dataframe(query)
         print(f"Fetched {len(df)} rows.")
     except Exception as e:
-        print(f"CRITICAL: Could not fetch data from BigQuery. Error: {e}")
+        print(f"CRITICAL: Could not fetch data from the warehouse. Error: {e}")
         return
 
     if df.empty:
@@ -59,14 +161,13 @@ def run_anomaly_detection():
         return
 
     # 2. Calculate Z-scores
-    print("Calculating Z-scores per category...")
+    print(f"Calculating {ANOMALY_METHOD} scores per {', '.join(ANOMALY_GROUP_COLUMNS)}...")
     # We MUST group by category. A high 'Utilities' bill should not
     # be compared to a 'Food' bill.
-    # .groupby().apply() runs our function on each category subset
-    df_scores = df.groupby('inferred_category').apply(calculate_safe_zscore)
-    
-    # Fill any NaN z_scores (from single-item groups) with 0
-    df_scores['z_score'].fillna(0.0, inplace=True)
+    # One vectorized pass over all groups; NaN scores come back as 0
+    df_scores = df.copy()
+    df_scores['z_score'] = score_groups(df, ANOMALY_GROUP_COLUMNS, method=ANOMALY_METHOD)
+    ROWS_SCORED.inc(len(df_scores))
 
     # 3. Filter for anomalies
     # We only care about rows where the absolute Z-score is high
@@ -77,28 +178,209 @@ def run_anomaly_detection():
         return
 
     print(f"Found {len(anomalies_df)} anomalies!")
+    ANOMALIES_FOUND.set(len(anomalies_df))
     
-    # 4. Prepare and upload to BigQuery
+    # 4. Prepare and upload to the warehouse
     anomalies_df['run_timestamp'] = pd.Timestamp.now(tz='UTC')
     
     # Ensure columns match the BQ schema
-    final_columns = ['spend_month', 'inferred_category', 'total_amount', 'z_score', 'run_timestamp']
+    final_columns = ['spend_month'] + ANOMALY_GROUP_COLUMNS + ['total_amount', 'z_score', 'run_timestamp']
     anomalies_df = anomalies_df[final_columns]
     
     print(f"Uploading anomalies to {DESTINATION_TABLE}...")
-    job_config = bigquery.LoadJobConfig(
+    try:
         # We want to overwrite the table each time we run
-        write_disposition="WRITE_TRUNCATE", 
-    )
-    
+        warehouse_backend.load_dataframe(anomalies_df, DESTINATION_TABLE, mode='truncate')
+        print(f"Successfully uploaded {len(anomalies_df)} anomalies to the warehouse.")
+    except Exception as e:
+        print(f"CRITICAL: Could not upload anomalies to the warehouse. Error: {e}")
+
+# --- 4. INCREMENTAL ANOMALY DETECTION ---
+def key_match(left, right):
+    """NULL-safe join condition on the group columns."""
+    return " AND ".join(f"{left}.{col} IS NOT DISTINCT FROM {right}.{col}" for col in ANOMALY_GROUP_COLUMNS)
+
+def ensure_incremental_tables():
+    """Creates the state tables (with the source's column types) on first run."""
+    warehouse_backend = get_context().warehouse
+    groups = ", ".join(ANOMALY_GROUP_COLUMNS)
+    count, number = warehouse_backend.cast(0, 'INT64'), warehouse_backend.cast(0, 'FLOAT64')
+    warehouse_backend.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table(ANOMALY_SCORED_TABLE)} AS
+        SELECT spend_month, {groups}, total_amount FROM {table(SOURCE_TABLE)} WHERE FALSE;
+        CREATE TABLE IF NOT EXISTS {table(ANOMALY_STATE_TABLE)} AS
+        SELECT {groups}, {count} AS n_rows, {count} AS n_values, {number} AS mean, {number} AS m2
+        FROM {table(SOURCE_TABLE)} WHERE FALSE;
+        CREATE TABLE IF NOT EXISTS {table(DESTINATION_TABLE)} AS
+        SELECT spend_month, {groups}, total_amount, {number} AS z_score,
+               {warehouse_backend.cast('NULL', 'TIMESTAMP')} AS run_timestamp
+        FROM {table(SOURCE_TABLE)} WHERE FALSE;
+    """)
+
+def load_staging(df, name):
+    get_context().warehouse.load_dataframe(df, name, mode='truncate')
+
+def zscore_sql(value, stats):
+    """
+    Population Z-score from a group's persisted stats, with score_groups()'s
+    rules: 0 for groups under 3 rows, constant groups and NULL values.
+    """
+    return (f"CASE WHEN {stats}.n_rows >= 3 AND {stats}.m2 > 0 AND {value} IS NOT NULL "
+            f"THEN ({value} - {stats}.mean) / SQRT({stats}.m2 / {stats}.n_values) ELSE 0 END")
+
+def run_incremental_anomaly_detection():
+    """
+    Scores only what changed since the last run. Per-group count, mean and
+    M2 are persisted; new and changed months are folded in (changed values
+    are first removed with the reverse update, and months gone from the
+    source are subtracted). Only those rows and the touched groups' stats
+    are read; the touched groups are then rescored inside the warehouse
+    and replaced in fct_anomalies. Everything is written in one warehouse
+    transaction, so a failed run leaves the previous state.
+    """
+    warehouse_backend = get_context().warehouse
+    print(f"--- Starting Anomaly Detection (incremental) ---")
+    group_cols = ANOMALY_GROUP_COLUMNS
+    groups = ", ".join(group_cols)
+    key = ["spend_month"] + group_cols
+    try:
+        ensure_incremental_tables()
+
+        # 1. Months that are new, or whose total changed, since the last run
+        changed_df = warehouse_backend.query_dataframe(f"""
+            SELECT s.spend_month, {", ".join(f"s.{col}" for col in group_cols)}, s.total_amount,
+                   p.total_amount AS previous_amount, p.spend_month IS NULL AS is_new
+            FROM {table(SOURCE_TABLE)} s
+            LEFT JOIN {table(ANOMALY_SCORED_TABLE)} p
+              ON s.spend_month = p.spend_month AND {key_match('s', 'p')}
+            WHERE p.spend_month IS NULL OR s.total_amount IS DISTINCT FROM p.total_amount
+        """)
+        # ...and months folded in earlier that are no longer in the source
+        removed_df = warehouse_backend.query_dataframe(f"""
+            SELECT p.spend_month, {", ".join(f"p.{col}" for col in group_cols)}, p.total_amount
+            FROM {table(ANOMALY_SCORED_TABLE)} p
+            WHERE NOT EXISTS (SELECT 1 FROM {table(SOURCE_TABLE)} s
+                              WHERE s.spend_month = p.spend_month AND {key_match('s', 'p')})
+        """)
+    except Exception as e:
+        print(f"CRITICAL: Could not fetch changed months from the warehouse. Error: {e}")
+        return
+
+    if changed_df.empty and removed_df.empty:
+        print("No new, changed or removed months since the last run. Nothing to score.")
+        return
+    print(f"Fetched {len(changed_df)} new/changed rows "
+          f"({int(changed_df['is_new'].sum())} new) and {len(removed_df)} removed rows.")
+
+    staging = {name: f"{DESTINATION_TABLE}_{name}_staging" for name in ("changes", "state")}
+    try:
+        # One staged row per scored month to upsert or delete
+        changes_df = pd.concat([changed_df[key + ['total_amount']].assign(is_removed=False),
+                                removed_df[key + ['total_amount']].assign(is_removed=True)], ignore_index=True)
+        load_staging(changes_df, staging['changes'])
+
+        # 2. Current state of the touched groups (one row per group)
+        state_df = warehouse_backend.query_dataframe(f"""
+            SELECT st.* FROM {table(ANOMALY_STATE_TABLE)} st
+            WHERE EXISTS (SELECT 1 FROM {table(staging['changes'])} c WHERE {key_match('c', 'st')})
+        """)
+
+        # 3. Fold the changes into the running statistics
+        state = state_df.set_index(group_cols)[STAT_COLUMNS]
+        state = apply_changes(state, changed_df, group_cols, removed=removed_df)
+        state = state.astype({'n_rows': 'int64', 'n_values': 'int64'})
+
+        # 4. Swap in the months and state, and rescore the touched groups in the warehouse
+        insert_state = ""
+        if not state.empty:
+            load_staging(state.reset_index()[group_cols + STAT_COLUMNS], staging['state'])
+            insert_state = (f"INSERT INTO {table(ANOMALY_STATE_TABLE)} ({groups}, {', '.join(STAT_COLUMNS)}) "
+                            f"SELECT {groups}, {', '.join(STAT_COLUMNS)} FROM {table(staging['state'])};")
+        run_timestamp = warehouse_backend.timestamp_literal(pd.Timestamp.now(tz='UTC'))
+        touched = f"EXISTS (SELECT 1 FROM {table(staging['changes'])} c WHERE {key_match('c', 't')})"
+        final_columns = ['spend_month'] + group_cols + ['total_amount', 'z_score', 'run_timestamp']
+        z_score = zscore_sql('p.total_amount', 'st')
+        warehouse_backend.execute(f"""
+            BEGIN TRANSACTION;
+            MERGE INTO {table(ANOMALY_SCORED_TABLE)} AS t
+            USING {table(staging['changes'])} AS s
+              ON t.spend_month = s.spend_month AND {key_match('t', 's')}
+            WHEN MATCHED AND s.is_removed THEN DELETE
+            WHEN MATCHED THEN UPDATE SET total_amount = s.total_amount
+            WHEN NOT MATCHED AND NOT s.is_removed THEN INSERT (spend_month, {groups}, total_amount)
+              VALUES (s.spend_month, {", ".join(f"s.{col}" for col in group_cols)}, s.total_amount);
+            DELETE FROM {table(ANOMALY_STATE_TABLE)} AS t WHERE {touched};
+            {insert_state}
+            DELETE FROM {table(DESTINATION_TABLE)} AS t WHERE {touched};
+            INSERT INTO {table(DESTINATION_TABLE)} ({", ".join(final_columns)})
+            SELECT p.spend_month, {", ".join(f"p.{col}" for col in group_cols)}, p.total_amount,
+                   {z_score} AS z_score, {run_timestamp} AS run_timestamp
+            FROM {table(ANOMALY_SCORED_TABLE)} p
+            JOIN {table(ANOMALY_STATE_TABLE)} st ON {key_match('p', 'st')}
+            WHERE ABS({z_score}) >= {ANOMALY_THRESHOLD}
+              AND EXISTS (SELECT 1 FROM {table(staging['changes'])} c WHERE {key_match('c', 'p')});
+            COMMIT TRANSACTION;
+        """)
+        found = warehouse_backend.query_dataframe(
+            f"SELECT COUNT(*) AS n FROM {table(DESTINATION_TABLE)} WHERE run_timestamp = {run_timestamp}")
+        # Only the new/changed months were written and scored for the first time
+        ROWS_SCORED.inc(len(changed_df))
+        ANOMALIES_FOUND.set(int(found['n'].iloc[0]))
+        print(f"Merged {len(changed_df)} new/changed and {len(removed_df)} removed months into "
+              f"{len(state)} touched groups; {int(found['n'].iloc[0])} anomalies merged into {DESTINATION_TABLE}.")
+    except Exception as e:
+        print(f"CRITICAL: Could not merge anomalies into the warehouse. Error: {e}")
+    finally:
+        for name in staging.values():
+            warehouse_backend.execute(f"DROP TABLE IF EXISTS {table(name)}")
+
+# --- 5. RECURRING SUBSCRIPTIONS ---
+@metrics.task('subscriptions')
+def run_subscription_detection():
+    warehouse_backend = get_context().warehouse
+    print(f"--- Starting Subscription Detection ---")
+
+    window = ""
+    if SUBSCRIPTION_LOOKBACK_MONTHS:
+        start = (pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.DateOffset(months=SUBSCRIPTION_LOOKBACK_MONTHS))
+        window = f"AND timestamp_utc >= {warehouse_backend.timestamp_literal(start.normalize().replace(day=1))}"
+    print(f"Fetching debits from {TRANSACTIONS_TABLE} (last {SUBSCRIPTION_LOOKBACK_MONTHS or 'all'} months)...")
+    try:
+        query = f"""
+            SELECT timestamp_utc, vendor_name, sender_address, amount, transaction_type
+            FROM {table(TRANSACTIONS_TABLE)}
+            WHERE transaction_type = 'debit' AND amount IS NOT NULL {window}
+        """
+        df = warehouse_backend.query_dataframe(query)
+        print(f"Fetched {len(df)} debits.")
+        DEBITS_SCANNED.inc(len(df))
+    except Exception as e:
+        print(f"CRITICAL: Could not fetch transactions from the warehouse. Error: {e}")
+        return
+
+    if df.empty:
+        print("No debits in source table. Exiting.")
+        return
+
+    subscriptions_df = detect_subscriptions(df, as_of=pd.Timestamp.now(tz='UTC'))
+    subscriptions_df['run_timestamp'] = pd.Timestamp.now(tz='UTC')
+    SUBSCRIPTIONS_FOUND.set(len(subscriptions_df), flag='all')
+    for flag in ('is_newly_started', 'is_price_changed', 'is_missed'):
+        SUBSCRIPTIONS_FOUND.set(int(subscriptions_df[flag].sum()), flag=flag)
+    print(f"Found {len(subscriptions_df)} recurring subscriptions "
+          f"({int(subscriptions_df['is_newly_started'].sum())} new, "
+          f"{int(subscriptions_df['is_price_changed'].sum())} price changes, "
+          f"{int(subscriptions_df['is_missed'].sum())} missed).")
+
+    print(f"Uploading subscriptions to {SUBSCRIPTIONS_TABLE}...")
     try:
-        job = bq_client.load_table_from_dataframe(
-            anomalies_df, DESTINATION_TABLE, job_config=job_config
-        )
-        job.result()  # Wait for the job to complete
-        print(f"Successfully uploaded {len(anomalies_df)} anomalies to BigQuery.")
+        # A snapshot of every series as of today, so the table is replaced
+        warehouse_backend.load_dataframe(subscriptions_df, SUBSCRIPTIONS_TABLE, mode='truncate')
+        print(f"Successfully uploaded {len(subscriptions_df)} subscriptions to the warehouse.")
     except Exception as e:
-        print(f"CRITICAL: Could not upload anomalies to BigQuery. Error: {e}")
+        print(f"CRITICAL: Could not upload subscriptions to the warehouse. Error: {e}")
 
 if __name__ == "__main__":
-    run_anomaly_detection()
\ No newline at end of file
+    build_monthly_spend()
+    run_anomaly_detection()
+    run_subscription_detection()
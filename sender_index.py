@@ -0,0 +1,199 @@
+"""
+Learned sender-address routing for the pre-filter.
+
+Most senders always produce the same outcome: "HP-HDFCBK" alerts end up
+'processed', marketing short codes end up 'junk'. sender_outcomes counts
+the final status of every message per sender (operator prefix stripped,
+like template_cache.normalize_sender), and a sender with enough history
+and a pure enough record is routed without running the regex:
+
+    junk share >= MIN_PURITY       -> 'junk'           (no LLM call wasted)
+    processed share >= MIN_PURITY  -> 'pre_filtered'   (regex skipped)
+
+Unknown or mixed senders still go through classify_messages. A fixed
+slice of routed messages (AUDIT_PERCENT, picked by auto_id) is classified
+by the regex anyway; disagreements are stored per sender, demote senders
+that drift, and give the routing precision. For routed senders only that
+sample is counted in sender_outcomes, so their routes don't vote for
+themselves.
+
+The index is refreshed incrementally: only rows between the last
+refreshed auto_id and the first row that is still pending/pre_filtered
+(i.e. has no final outcome yet) are counted.
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from sms_classifier import classify_messages
+from template_cache import SENDER_PREFIX_PATTERN
+
+MIN_MESSAGES = 20
+MIN_PURITY = 0.98
+AUDIT_PERCENT = 5
+
+ROUTES = {'junk': 'junk', 'processed': 'pre_filtered'}
+
+# Same normalization as sender_keys(), in SQL; str.strip() trims all whitespace, not just spaces
+SENDER_KEY_SQL = (r"regexp_replace(upper(regexp_replace(COALESCE(sender_address, ''), '^\s+|\s+$', '', 'g')), "
+                  f"'{SENDER_PREFIX_PATTERN}', '')")
+
+def sender_keys(sender_addresses):
+    """Vectorized normalize_sender: 'VM-HDFCBK' -> 'HDFCBK'. Only distinct values are processed."""
+    codes, uniques = pd.factorize(sender_addresses)
+    keys = pd.Series(uniques, dtype='string').str.strip().str.upper()
+    keys = keys.str.replace(SENDER_PREFIX_PATTERN, '', regex=True).fillna('').to_numpy(dtype=object)
+    return np.append(keys, '')[codes]
+
+def ensure_sender_tables(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS sender_outcomes (
+                sender_key TEXT PRIMARY KEY,
+                n_junk BIGINT NOT NULL DEFAULT 0,
+                n_processed BIGINT NOT NULL DEFAULT 0,
+                n_error BIGINT NOT NULL DEFAULT 0,
+                n_audited BIGINT NOT NULL DEFAULT 0,
+                n_audit_disagreed BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS sender_index_state (
+                name TEXT PRIMARY KEY,
+                refreshed_through BIGINT NOT NULL
+            )
+        """))
+        # Finds the first row without a final outcome without a full scan
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS raw_notifications_pre_filtered_idx "
+            "ON raw_notifications (auto_id) WHERE processing_status = 'pre_filtered'"
+        ))
+
+def refresh_sender_index(engine):
+    """
+    Adds the outcomes of rows finished since the last refresh. Rows of
+    currently routed senders count only if they were in the audit sample.
+    Returns (rows counted, new high-water mark).
+    """
+    with engine.begin() as conn:
+        refreshed_through = conn.execute(text(
+            "SELECT refreshed_through FROM sender_index_state WHERE name = 'sender_outcomes' FOR UPDATE"
+        )).scalar() or 0
+        # Everything below the first unfinished row has its final status
+        upper = conn.execute(text("""
+            SELECT COALESCE(
+                LEAST(
+                    (SELECT MIN(auto_id) FROM raw_notifications WHERE processing_status = 'pending'),
+                    (SELECT MIN(auto_id) FROM raw_notifications WHERE processing_status = 'pre_filtered')
+                ) - 1,
+                (SELECT MAX(auto_id) FROM raw_notifications),
+                0
+            )
+        """)).scalar()
+        if upper <= refreshed_through:
+            return 0, refreshed_through
+        routed_keys = list(load_routes(conn))
+
+        result = conn.execute(text(f"""
+            INSERT INTO sender_outcomes (sender_key, n_junk, n_processed, n_error)
+            SELECT {SENDER_KEY_SQL},
+                   COUNT(*) FILTER (WHERE processing_status = 'junk'),
+                   COUNT(*) FILTER (WHERE processing_status = 'processed'),
+                   COUNT(*) FILTER (WHERE processing_status = 'error')
+            FROM raw_notifications
+            WHERE auto_id > :lower AND auto_id <= :upper
+              AND NOT ({SENDER_KEY_SQL} = ANY(CAST(:routed_keys AS TEXT[])) AND auto_id % 100 >= :audit_percent)
+            GROUP BY 1
+            ON CONFLICT (sender_key) DO UPDATE SET
+                n_junk = sender_outcomes.n_junk + EXCLUDED.n_junk,
+                n_processed = sender_outcomes.n_processed + EXCLUDED.n_processed,
+                n_error = sender_outcomes.n_error + EXCLUDED.n_error,
+                updated_at = now()
+        """), {'lower': refreshed_through, 'upper': upper,
+               'routed_keys': routed_keys, 'audit_percent': AUDIT_PERCENT})
+        conn.execute(text("""
+            INSERT INTO sender_index_state (name, refreshed_through) VALUES ('sender_outcomes', :upper)
+            ON CONFLICT (name) DO UPDATE SET refreshed_through = EXCLUDED.refreshed_through
+        """), {'upper': upper})
+    print(f"Sender index refreshed through auto_id {upper} ({result.rowcount} senders updated).")
+    return result.rowcount, upper
+
+def load_routes(engine, min_messages=MIN_MESSAGES, min_purity=MIN_PURITY):
+    """Returns {sender_key: status} for every sender that can skip the regex."""
+    df = pd.read_sql(text("""
+        SELECT sender_key, n_junk, n_processed, n_error, n_audited, n_audit_disagreed
+        FROM sender_outcomes
+        WHERE n_junk + n_processed + n_error >= :min_messages
+    """), engine, params={'min_messages': min_messages})
+
+    total = df['n_junk'] + df['n_processed'] + df['n_error']
+    # Senders whose audited messages disagree too often lose their route
+    audit_ok = df['n_audit_disagreed'] <= (1 - min_purity) * df['n_audited']
+    routes = {}
+    for outcome, status in ROUTES.items():
+        routed = df[(df[f'n_{outcome}'] >= min_purity * total) & audit_ok]
+        routes.update(dict.fromkeys(routed['sender_key'], status))
+    return routes
+
+def route_messages(sender_addresses, routes):
+    """Array of routed statuses, None where the sender is unknown or mixed."""
+    keys = sender_keys(sender_addresses)
+    return np.array([routes.get(key) for key in keys], dtype=object)
+
+def audit_mask(auto_ids, percent=AUDIT_PERCENT):
+    """Deterministic sample of rows that always go through the regex."""
+    return (np.asarray(auto_ids, dtype=np.int64) % 100) < percent
+
+def classify_with_routes(df, routes):
+    """
+    Labels a claimed batch (auto_id, sender_address, message_body): routed
+    senders take their route, everyone else and the audit sample get the
+    regex. Returns (statuses, routed statuses or None, audited mask).
+    """
+    routed = route_messages(df['sender_address'], routes) if routes else np.full(len(df), None, dtype=object)
+    has_route = pd.notna(routed)
+    audited = has_route & audit_mask(df['auto_id'])
+    needs_regex = ~has_route | audited
+
+    statuses = routed.copy()
+    statuses[needs_regex] = classify_messages(df.loc[needs_regex, 'message_body']).to_numpy()
+    return statuses, routed, audited
+
+def record_audit(conn, sender_addresses, routed, regex_status):
+    """Stores per-sender audit counts for audited routed rows. Returns (audited, disagreed)."""
+    audit = pd.DataFrame({
+        'sender_key': sender_keys(sender_addresses),
+        'disagreed': np.asarray(routed) != np.asarray(regex_status),
+    })
+    if audit.empty:
+        return 0, 0
+    per_sender = audit.groupby('sender_key')['disagreed'].agg(['size', 'sum'])
+    conn.execute(text("""
+        UPDATE sender_outcomes AS s
+        SET n_audited = s.n_audited + u.audited, n_audit_disagreed = s.n_audit_disagreed + u.disagreed
+        FROM unnest(CAST(:keys AS TEXT[]), CAST(:audited AS BIGINT[]), CAST(:disagreed AS BIGINT[]))
+            AS u(sender_key, audited, disagreed)
+        WHERE s.sender_key = u.sender_key
+    """), {
+        'keys': per_sender.index.tolist(),
+        'audited': [int(n) for n in per_sender['size']],
+        'disagreed': [int(n) for n in per_sender['sum']],
+    })
+    return len(audit), int(audit['disagreed'].sum())
+
+def precision_report(engine, min_messages=MIN_MESSAGES, min_purity=MIN_PURITY):
+    """Prints routed senders, their share of traffic and audit precision per route."""
+    routes = load_routes(engine, min_messages, min_purity)
+    df = pd.read_sql(text("SELECT * FROM sender_outcomes"), engine)
+    if df.empty:
+        print("Sender index is empty.")
+        return
+    df['total'] = df['n_junk'] + df['n_processed'] + df['n_error']
+    df['route'] = df['sender_key'].map(routes)
+    print(f"Sender index: {len(df)} senders, {len(routes)} routed "
+          f"({df.loc[df['route'].notna(), 'total'].sum() / max(df['total'].sum(), 1):.0%} of messages).")
+    for status, group in df[df['route'].notna()].groupby('route'):
+        audited = group['n_audited'].sum()
+        precision = 1 - group['n_audit_disagreed'].sum() / audited if audited else float('nan')
+        print(f"  -> {status:<12} {len(group):>5} senders, audit precision {precision:.2%} over {audited} audited rows")
@@ -0,0 +1,60 @@
+"""
+Regex rules that separate potential transactions from OTPs and spam.
+Kept free of database setup so they can be imported anywhere.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+TRANSACTION_KEYWORDS_REGEX = re.compile(
+    r'\b(rs\.?|inr|paid|received|credited|debited|a/c|transaction|payment|charged|sent to|received from|spent|recharge of)\b',
+    re.IGNORECASE
+)
+OTP_KEYWORDS_REGEX = re.compile(
+    r'\b(otp|code|verification|verify)\b|G-\d{6}',
+    re.IGNORECASE
+)
+# Batch version of the checks above in one pattern: the whole message is
+# ASCII and contains a transaction keyword. The OTP check can only ever
+# lead to 'junk', which is also the fallback, so it does not need a branch.
+# (The keyword group is made non-capturing so pandas doesn't warn about it.)
+PRE_FILTER_REGEX = re.compile(
+    r'^[\x00-\x7F]*' + TRANSACTION_KEYWORDS_REGEX.pattern.replace('(', '(?:', 1) + r'[\x00-\x7F]*$',
+    re.IGNORECASE | re.DOTALL
+)
+
+def pre_filter_message(message_body):
+    """Uses Regex to classify a message. Returns: 'pre_filtered', 'junk'"""
+    if pd.isna(message_body) or len(message_body) < 15:
+        return 'junk'
+    
+    # Check for non-English chars
+    if not all(ord(c) < 128 for c in message_body):
+        return 'junk'
+        
+    if TRANSACTION_KEYWORDS_REGEX.search(message_body):
+        return 'pre_filtered' # This is a potential transaction
+        
+    if OTP_KEYWORDS_REGEX.search(message_body):
+        return 'junk'
+    
+    # Everything else is junk
+    return 'junk'
+
+def classify_messages(message_bodies):
+    """
+    Vectorized version of pre_filter_message for a whole column of bodies.
+    Runs on Arrow-backed strings, so the length check and PRE_FILTER_REGEX
+    each make one native pass over the batch instead of Python per row.
+    Returns a Series of 'pre_filtered'/'junk' labels with the same index.
+    """
+    bodies = message_bodies.astype('string[pyarrow]')
+
+    long_enough = bodies.str.len().fillna(0).to_numpy() >= 15
+    is_transaction = bodies.str.contains(
+        PRE_FILTER_REGEX.pattern, case=False, regex=True, na=False
+    ).to_numpy(dtype=bool)
+
+    is_transaction &= long_enough
+    return pd.Series(np.where(is_transaction, 'pre_filtered', 'junk'), index=message_bodies.index)
@@ -0,0 +1,47 @@
+"""
+Set-based processing_status updates for raw_notifications, shared by the
+pre-filter and enrichment stages.
+
+Instead of one `UPDATE ... WHERE auto_id IN (<literal tuple>)` per status,
+every (auto_id, status) pair of a batch is sent as two bound arrays and
+applied by a single `UPDATE ... FROM unnest(...)`. The caller's window
+start keeps the update out of month partitions it has no rows in.
+"""
+from sqlalchemy import text
+
+import pg_partitions
+
+STATUS_UPDATE_SQL = text("""
+    UPDATE raw_notifications AS r
+    SET processing_status = u.status
+    FROM unnest(CAST(:auto_ids AS BIGINT[]), CAST(:statuses AS TEXT[])) AS u(auto_id, status)
+    WHERE r.auto_id = u.auto_id AND r.timestamp_utc >= :window_start
+""")
+
+def apply_status_updates(conn, ids_by_status, window_start=None):
+    """
+    Writes all statuses for a batch in one statement on an open connection,
+    so it is part of whatever transaction the caller already has.
+    ids_by_status maps a status to the auto_ids that should get it; they
+    must all be at or after window_start. Returns the number of rows updated.
+    """
+    auto_ids = []
+    statuses = []
+    for status, ids in ids_by_status.items():
+        auto_ids.extend(int(auto_id) for auto_id in ids)
+        statuses.extend([status] * len(ids))
+
+    if not auto_ids:
+        return 0
+
+    result = conn.execute(STATUS_UPDATE_SQL, {'auto_ids': auto_ids, 'statuses': statuses,
+                                              'window_start': window_start or pg_partitions.EARLIEST})
+    return result.rowcount
+
+def update_statuses(engine, ids_by_status, window_start=None):
+    """apply_status_updates in its own transaction (one round trip, one commit)."""
+    summary = ", ".join(f"{len(ids)} -> '{status}'" for status, ids in ids_by_status.items() if len(ids))
+    if summary:
+        print(f"  Updating statuses: {summary}")
+    with engine.begin() as conn:
+        return apply_status_updates(conn, ids_by_status, window_start)
@@ -0,0 +1,197 @@
+"""
+Recurring-subscription detection over enriched transactions.
+
+Debits are keyed by a normalized vendor (vendor_name, or the sender ID
+when the LLM found no vendor), sorted once by (vendor, time), and every
+per-vendor statistic comes from groupby aggregates over that sorted
+frame. There are no pairwise comparisons, so the cost is one
+O(n log n) sort plus linear passes.
+
+A vendor is a subscription when its charges repeat on a weekly, monthly
+or annual cadence within tolerance (a skipped charge counts as a gap,
+not noise) and the amount is stable or drifts steadily. Each series is
+flagged as newly started, price changed or missed as of the run date.
+"""
+import numpy as np
+import pandas as pd
+
+from template_cache import SENDER_PREFIX_PATTERN
+
+# name -> (period in days, tolerance in days)
+CADENCES = {
+    'weekly': (7.0, 2.0),
+    'monthly': (30.44, 4.0),
+    'annual': (365.25, 10.0),
+}
+
+MIN_OCCURRENCES = 3
+# Share of intervals that must be one (or a whole number of) periods long
+MIN_ON_CADENCE_SHARE = 0.75
+# Coefficient of variation below which the amount counts as fixed
+STABLE_AMOUNT_CV = 0.05
+# A steady trend must explain this much of the amount variance to be "drifting"
+DRIFT_MIN_R2 = 0.6
+MAX_DRIFT_CV = 0.35
+# Last charge differing from the usual amount by more than this is a price change
+PRICE_CHANGE_THRESHOLD = 0.05
+# Series whose first charge is within this many periods of the run date are new
+NEW_SERIES_PERIODS = 4
+
+def normalize_names(values, prefix_pattern=None):
+    """Lower-cased, punctuation-collapsed names; None for blanks and "null"."""
+    names = pd.Series(values, dtype='string').str.strip().str.upper()
+    if prefix_pattern:
+        names = names.str.replace(prefix_pattern, '', regex=True)
+    names = names.str.lower().str.replace(r'[^0-9a-z]+', ' ', regex=True).str.strip()
+    return names.mask(names.isin(['', 'null', 'none', 'nan'])).to_numpy(dtype=object)
+
+def normalize_vendor_keys(vendor_names, sender_addresses):
+    """
+    Vectorized vendor key: lower-cased vendor name with punctuation and
+    spacing collapsed, falling back to the sender ID without its operator
+    prefix ("VM-HDFCBK" -> "hdfcbk"). Only distinct names are normalized.
+    """
+    vendor_codes, vendor_uniques = pd.factorize(vendor_names)
+    sender_codes, sender_uniques = pd.factorize(sender_addresses)
+    # Code -1 (missing) picks the None appended at the end
+    vendor = np.append(normalize_names(vendor_uniques), None)[vendor_codes]
+    sender = np.append(normalize_names(sender_uniques, SENDER_PREFIX_PATTERN), None)[sender_codes]
+    return pd.Series(np.where(pd.isna(vendor), sender, vendor), index=vendor_names.index)
+
+def prepare_charges(transactions):
+    """Debits with an amount, one row per vendor and day, sorted by (vendor, time)."""
+    debits = transactions[
+        (transactions['transaction_type'].astype('string').str.lower() == 'debit')
+        & pd.to_numeric(transactions['amount'], errors='coerce').notna()
+    ]
+    charges = pd.DataFrame({
+        'vendor_key': normalize_vendor_keys(debits['vendor_name'], debits['sender_address']),
+        'vendor_name': debits['vendor_name'],
+        'charged_at': pd.to_datetime(debits['timestamp_utc'], utc=True),
+        'amount': pd.to_numeric(debits['amount']).astype('float64'),
+    }).dropna(subset=['vendor_key'])
+    # Split payments or duplicate alerts on the same day are one charge
+    charges['charge_date'] = charges['charged_at'].dt.floor('D')
+    charges = (charges.groupby(['vendor_key', 'charge_date'], sort=True)
+               .agg(vendor_name=('vendor_name', 'last'), amount=('amount', 'sum'))
+               .reset_index())
+    return charges
+
+def detect_subscriptions(transactions, as_of=None):
+    """
+    Returns one row per detected subscription with its cadence, amount
+    pattern and flags. `transactions` needs timestamp_utc, vendor_name,
+    sender_address, amount and transaction_type columns.
+    """
+    charges = prepare_charges(transactions)
+    if as_of is None:
+        as_of = charges['charge_date'].max() if not charges.empty else pd.Timestamp.now(tz='UTC')
+    as_of = pd.Timestamp(as_of)
+    as_of = as_of.tz_localize('UTC') if as_of.tzinfo is None else as_of.tz_convert('UTC')
+
+    vendor = charges['vendor_key']
+    same_vendor = vendor.eq(vendor.shift())
+    interval = (charges['charge_date'] - charges['charge_date'].shift()).dt.total_seconds() / 86400
+    interval = interval.where(same_vendor)
+    position = charges.groupby('vendor_key').cumcount()
+    occurrences = position.groupby(vendor).transform('size')
+
+    # 1. Cadence from the median interval of each vendor
+    median_interval = interval.groupby(vendor).transform('median')
+    period = pd.Series(np.nan, index=charges.index)
+    tolerance = pd.Series(np.nan, index=charges.index)
+    for name, (days, tol) in CADENCES.items():
+        match = period.isna() & ((median_interval - days).abs() <= tol)
+        period = period.mask(match, days)
+        tolerance = tolerance.mask(match, tol)
+
+    # 2. How many intervals land on the cadence (k=1) or on a skipped beat (k>=2)
+    beats = (interval / period).round()
+    on_beat = (interval - beats * period).abs() <= tolerance * beats.clip(lower=1)
+    regular = on_beat & (beats == 1)
+    gaps = on_beat & (beats >= 2)
+
+    # 3. Amount pattern: stats over every charge but the last, then a trend fit
+    is_last = position == occurrences - 1
+    history_amount = charges['amount'].where(~is_last)
+    mean_amount = history_amount.groupby(vendor).transform('mean')
+    centered_x = position - position.where(~is_last).groupby(vendor).transform('mean')
+    centered_y = history_amount - mean_amount
+
+    grouped = pd.DataFrame({
+        'vendor_key': vendor,
+        'vendor_name': charges['vendor_name'],
+        'charge_date': charges['charge_date'],
+        'amount': charges['amount'],
+        'history_amount': history_amount,
+        'period_days': period,
+        'tolerance_days': tolerance,
+        'is_regular': regular,
+        'is_gap': gaps,
+        'has_interval': interval.notna(),
+        'missed_beats': (beats - 1).where(gaps, 0),
+        'xy': centered_x * centered_y,
+        'xx': centered_x.where(~is_last) ** 2,
+        'yy': centered_y ** 2,
+    }).groupby('vendor_key', sort=False)
+
+    series = grouped.agg(
+        vendor_name=('vendor_name', 'last'),
+        period_days=('period_days', 'first'),
+        tolerance_days=('tolerance_days', 'first'),
+        occurrences=('amount', 'size'),
+        first_seen=('charge_date', 'first'),
+        last_seen=('charge_date', 'last'),
+        last_amount=('amount', 'last'),
+        typical_amount=('history_amount', 'median'),
+        mean_amount=('history_amount', 'mean'),
+        intervals=('has_interval', 'sum'),
+        regular_intervals=('is_regular', 'sum'),
+        gap_intervals=('is_gap', 'sum'),
+        missed_in_history=('missed_beats', 'sum'),
+        sxy=('xy', 'sum'),
+        sxx=('xx', 'sum'),
+        syy=('yy', 'sum'),
+    )
+
+    series['on_cadence_share'] = ((series['regular_intervals'] + series['gap_intervals'])
+                                  / series['intervals'].where(series['intervals'] > 0))
+    series = series[
+        series['period_days'].notna()
+        & (series['occurrences'] >= MIN_OCCURRENCES)
+        & (series['regular_intervals'] >= MIN_OCCURRENCES - 1)
+        & (series['on_cadence_share'] >= MIN_ON_CADENCE_SHARE)
+    ].copy()
+
+    std_amount = np.sqrt(series['syy'] / (series['occurrences'] - 1))
+    series['amount_cv'] = (std_amount / series['mean_amount'].abs()).fillna(0.0)
+    slope = series['sxy'] / series['sxx'].where(series['sxx'] > 0)
+    r2 = series['sxy'] ** 2 / (series['sxx'] * series['syy']).where(series['syy'] > 0)
+    series['amount_trend'] = (slope / series['mean_amount'].abs()).fillna(0.0) # relative change per charge
+    series['amount_pattern'] = np.select(
+        [series['amount_cv'] <= STABLE_AMOUNT_CV,
+         (series['amount_cv'] <= MAX_DRIFT_CV) & (r2.fillna(0.0) >= DRIFT_MIN_R2)],
+        ['stable', 'drifting'],
+        default='variable',
+    )
+    series = series[series['amount_pattern'] != 'variable'].copy()
+
+    # 4. Flags as of the run date
+    period_delta = pd.to_timedelta(series['period_days'], unit='D')
+    series['cadence'] = series['period_days'].map({days: name for name, (days, _) in CADENCES.items()})
+    series['next_expected'] = series['last_seen'] + period_delta
+    overdue_days = (as_of - series['next_expected']).dt.total_seconds() / 86400 - series['tolerance_days']
+    series['missed_count'] = np.floor(overdue_days / series['period_days'] + 1).clip(lower=0).astype('int64')
+    series['is_missed'] = series['missed_count'] > 0
+    series['is_newly_started'] = series['first_seen'] >= as_of - period_delta * NEW_SERIES_PERIODS
+    # For a drifting series, the trend line extended to the last charge
+    expected_amount = np.where(series['amount_pattern'] == 'stable', series['typical_amount'],
+                               series['mean_amount'] * (1 + series['amount_trend'] * series['occurrences'] / 2))
+    series['is_price_changed'] = ((series['last_amount'] - expected_amount).abs()
+                                  > PRICE_CHANGE_THRESHOLD * np.abs(expected_amount))
+
+    columns = ['vendor_name', 'cadence', 'period_days', 'occurrences', 'first_seen', 'last_seen',
+               'next_expected', 'typical_amount', 'last_amount', 'amount_cv', 'amount_trend',
+               'amount_pattern', 'on_cadence_share', 'missed_in_history', 'missed_count',
+               'is_newly_started', 'is_price_changed', 'is_missed']
+    return series[columns].reset_index()
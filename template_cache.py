@@ -0,0 +1,214 @@
+"""
+Template-fingerprint cache that answers repeat SMS formats without Groq.
+
+Bank and wallet alerts are the same template with a different amount,
+date or reference. Each message is reduced to a fingerprint: the sender
+(without its operator prefix) plus the body with dates, amounts,
+reference IDs and other numbers masked out. When the LLM has extracted a
+template enough times with the same outcome, the cache learns a local
+extractor for it: constant fields are copied and the amount (and vendor,
+if it varies) is read from the masked slot it came from.
+
+Entries live in a small SQLite file with LRU eviction.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import time
+
+# Order matters: dates before amounts before reference IDs before bare numbers
+SLOT_REGEX = re.compile(r"""
+    (?P<date>\b\d{1,4}[-/.](?:\d{1,2}|[A-Za-z]{3})[-/.]\d{2,4}\b)
+  | (?P<currency>(?:\brs\.?|\binr|₹)\s*)(?P<amount>\d[\d,]*(?:\.\d+)?)
+  | (?P<ref>\b(?=[A-Za-z]*\d)(?=\d*[A-Za-z])[A-Za-z0-9]{4,}\b)
+  | (?P<num>\d[\d,]*(?:\.\d+)?)
+""", re.IGNORECASE | re.VERBOSE)
+
+# Indian sender IDs carry an operator/circle prefix: "VM-HDFCBK", "AD-HDFCBK"
+# (also used by sender_index.py, in SQL too, and subscription_detector.py)
+SENDER_PREFIX_PATTERN = r'^[A-Z]{2}-'
+SENDER_PREFIX_REGEX = re.compile(SENDER_PREFIX_PATTERN)
+
+CONSTANT_FIELDS = ("is_transaction", "transaction_type", "inferred_category")
+
+def normalize_sender(sender_address):
+    return SENDER_PREFIX_REGEX.sub('', (sender_address or '').strip().upper())
+
+def to_number(value):
+    try:
+        return float(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+
+def mask_message(message_body):
+    """Returns (template, slot values) for a message body."""
+    slots = []
+
+    def replace(match):
+        kind = match.lastgroup
+        if kind == 'amount':
+            slots.append(match.group('amount'))
+            return match.group('currency').lower().strip() + ' <AMOUNT>'
+        slots.append(match.group(kind))
+        return f'<{kind.upper()}>'
+
+    template = SLOT_REGEX.sub(replace, message_body or '')
+    return ' '.join(template.split()), slots
+
+def fingerprint(sender_address, message_body):
+    """Returns (fingerprint, template, slot values)."""
+    template, slots = mask_message(message_body)
+    key = hashlib.sha1(f"{normalize_sender(sender_address)}\x1f{template}".encode('utf-8')).hexdigest()
+    return key, template, slots
+
+def derive_extractor(template, slots, sender_address, result):
+    """
+    Works out how an LLM result maps onto this template, or returns None
+    when it can't be explained by the masked slots and the fixed text.
+    """
+    extractor = {field: result.get(field) for field in CONSTANT_FIELDS}
+
+    amount = result.get('amount')
+    if amount is None or amount == "null":
+        extractor['amount_slot'] = None
+    else:
+        amount = to_number(amount)
+        matches = [i for i, value in enumerate(slots) if amount is not None and to_number(value) == amount]
+        if not matches:
+            return None
+        extractor['amount_slot'] = matches[0]
+
+    vendor = result.get('vendor_name')
+    extractor['vendor_slot'] = None
+    extractor['vendor_name'] = vendor
+    if vendor not in (None, "null"):
+        vendor_lower = str(vendor).lower()
+        slot_matches = [i for i, value in enumerate(slots) if value.lower() == vendor_lower]
+        if slot_matches:
+            extractor['vendor_slot'] = slot_matches[0]
+            extractor['vendor_name'] = None
+        elif vendor_lower not in template.lower() and vendor_lower not in (sender_address or '').lower():
+            return None # The model inferred it from context we can't replay
+
+    return extractor
+
+def apply_extractor(extractor, slots):
+    """Builds a result dict for a new message of a known template."""
+    result = {field: extractor[field] for field in CONSTANT_FIELDS}
+    slot = extractor['amount_slot']
+    result['amount'] = to_number(slots[slot]) if slot is not None else "null"
+    slot = extractor['vendor_slot']
+    result['vendor_name'] = slots[slot] if slot is not None else extractor['vendor_name']
+    return result
+
+class TemplateCache:
+    """
+    Persistent fingerprint -> extractor cache. A template is only served
+    after `min_confirmations` LLM results agreed on the same extractor;
+    a disagreeing result resets it.
+    """
+    def __init__(self, path, max_entries=50000, min_confirmations=2):
+        self.max_entries = max_entries
+        self.min_confirmations = min_confirmations
+        # Created on the main thread but used by the pipeline's enrich stage;
+        # only one thread touches it at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS templates (
+                fingerprint TEXT PRIMARY KEY,
+                extractor TEXT NOT NULL,
+                confirmations INTEGER NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS templates_last_used ON templates (last_used)")
+        self.conn.commit()
+        self.stats = {'hits': 0, 'misses': 0, 'learned': 0, 'conflicts': 0, 'evicted': 0}
+
+    def _fetch(self, keys):
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self.conn.execute(
+            f"SELECT fingerprint, extractor, confirmations FROM templates WHERE fingerprint IN ({placeholders})",
+            list(keys),
+        ).fetchall()
+        return {key: (json.loads(extractor), confirmations) for key, extractor, confirmations in rows}
+
+    def lookup_many(self, messages):
+        """
+        `messages` is a list of (auto_id, sender_address, message_body).
+        Returns {auto_id: result} for every message a confirmed template answers.
+        """
+        prints = {auto_id: fingerprint(sender, body) for auto_id, sender, body in messages}
+        known = self._fetch({key for key, _, _ in prints.values()})
+
+        results = {}
+        used = set()
+        for auto_id, (key, _, slots) in prints.items():
+            entry = known.get(key)
+            if entry and entry[1] >= self.min_confirmations:
+                results[auto_id] = apply_extractor(entry[0], slots)
+                used.add(key)
+
+        self.stats['hits'] += len(results)
+        self.stats['misses'] += len(messages) - len(results)
+        if used:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE templates SET hits = hits + 1, last_used = ? WHERE fingerprint = ?",
+                [(now, key) for key in used],
+            )
+            self.conn.commit()
+        return results
+
+    def learn_many(self, observations):
+        """`observations` is a list of (sender_address, message_body, LLM result)."""
+        now = time.time()
+        prints = [(fingerprint(sender, body), sender, result) for sender, body, result in observations]
+        known = self._fetch({key for (key, _, _), _, _ in prints})
+
+        for (key, template, slots), sender, result in prints:
+            extractor = derive_extractor(template, slots, sender, result)
+            if extractor is None:
+                continue
+            current = known.get(key)
+            if current is None or current[0] != extractor:
+                if current is not None:
+                    self.stats['conflicts'] += 1
+                confirmations = 1
+            else:
+                confirmations = current[1] + 1
+                if confirmations == self.min_confirmations:
+                    self.stats['learned'] += 1
+            known[key] = (extractor, confirmations)
+            self.conn.execute(
+                "INSERT INTO templates (fingerprint, extractor, confirmations, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (fingerprint) DO UPDATE SET extractor = excluded.extractor, "
+                "confirmations = excluded.confirmations, last_used = excluded.last_used",
+                (key, json.dumps(extractor), confirmations, now),
+            )
+
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """Drops the least recently used templates beyond max_entries."""
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM templates").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM templates WHERE fingerprint IN "
+                "(SELECT fingerprint FROM templates ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self.stats['evicted'] += excess
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,260 @@
+"""
+Pluggable warehouse backends for the loader, modeling and analytics steps.
+
+BigQueryBackend wraps a bigquery.Client; DuckDBBackend keeps every table
+in one local DuckDB file, so backfills, benchmarks and profiling runs
+need no GCP project. Stages write SQL in the subset both engines accept
+and ask the backend for the few things that differ: quoted table names
+(table()), type names (cast()), month truncation (month_trunc()),
+timestamp literals and the storage layout.
+
+Tables in TABLE_LAYOUTS are partitioned by month of their time column
+and clustered by the listed columns on BigQuery, so a query with a
+constant date window only reads (and bills) those months. DuckDB has no
+partitions, but every row group keeps min/max zone maps: tables are
+rebuilt in time order and a date window skips the other row groups.
+scan_report() shows what a query reads on either backend.
+
+    WAREHOUSE_BACKEND=duckdb WAREHOUSE_DUCKDB_PATH=warehouse.duckdb python run_analytics.py
+"""
+import json
+import os
+import tempfile
+import threading
+from datetime import timezone
+
+import pyarrow.parquet as pq
+
+import metrics
+
+# --- CONFIG ---
+WAREHOUSE_BACKEND = os.getenv('WAREHOUSE_BACKEND', 'bigquery')
+BQ_PROJECT_ID = "your_project_id_here"
+BQ_DATASET_ID = "your_database_id_here"
+WAREHOUSE_DUCKDB_PATH = os.getenv('WAREHOUSE_DUCKDB_PATH', 'warehouse.duckdb')
+
+# table -> (time column, its BigQuery type, clustering columns)
+TABLE_LAYOUTS = {
+    'enriched_transactions': ('timestamp_utc', 'TIMESTAMP', ['inferred_category', 'vendor_name']),
+    'agg_monthly_spend': ('spend_month', 'DATE', ['inferred_category']),
+}
+# Months of a table that received rows since its downstream model last read it
+DIRTY_MONTHS_TABLE = "warehouse_dirty_months"
+
+BYTES_SCANNED = metrics.counter('warehouse_bytes_scanned_total', 'Bytes processed by BigQuery queries')
+
+class BigQueryBackend:
+    name = 'bigquery'
+
+    def __init__(self, project_id=BQ_PROJECT_ID, dataset_id=BQ_DATASET_ID, client=None):
+        from google.cloud import bigquery
+        self.bigquery = bigquery
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.client = client if client is not None else bigquery.Client()
+
+    def table_id(self, name):
+        return f"{self.project_id}.{self.dataset_id}.{name}"
+
+    def table(self, name):
+        return f"`{self.table_id(name)}`"
+
+    def cast(self, expression, bq_type):
+        return f"CAST({expression} AS {bq_type})"
+
+    def month_trunc(self, expression):
+        return f"DATE_TRUNC(DATE({expression}), MONTH)"
+
+    def timestamp_literal(self, value):
+        """A constant the planner can prune partitions with (naive values are UTC)."""
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return f"TIMESTAMP '{value:%Y-%m-%d %H:%M:%S.%f}+00'"
+
+    def layout_clause(self, name):
+        if name not in TABLE_LAYOUTS:
+            return ""
+        column, column_type, cluster = TABLE_LAYOUTS[name]
+        trunc = "TIMESTAMP_TRUNC" if column_type == 'TIMESTAMP' else "DATE_TRUNC"
+        return f"PARTITION BY {trunc}({column}, MONTH) CLUSTER BY {', '.join(cluster)}"
+
+    def table_exists(self, name):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.client.get_table(self.table_id(name))
+            return True
+        except NotFound:
+            return False
+
+    def ensure_table(self, name, schema):
+        """Creates the table with its partitioning and clustering before the first load creates it without."""
+        columns = ", ".join(f"{column} {field_type}" for column, field_type in schema)
+        self.execute(f"CREATE TABLE IF NOT EXISTS {self.table(name)} ({columns}) {self.layout_clause(name)}")
+
+    def create_table_as(self, name, select_sql):
+        self.execute(f"CREATE OR REPLACE TABLE {self.table(name)} {self.layout_clause(name)} AS {select_sql}")
+
+    def relayout_table(self, name):
+        """Rewrites an existing table with its TABLE_LAYOUTS partitioning (BigQuery can't replace it in place)."""
+        copy = f"{name}_relayout"
+        self.execute(f"""
+            CREATE OR REPLACE TABLE {self.table(copy)} {self.layout_clause(name)} AS SELECT * FROM {self.table(name)};
+            DROP TABLE {self.table(name)};
+            ALTER TABLE {self.table(copy)} RENAME TO {name};
+        """)
+
+    def _run(self, sql):
+        job = self.client.query(sql)
+        job.result()
+        BYTES_SCANNED.inc(job.total_bytes_processed or 0)
+        return job
+
+    def query_dataframe(self, sql):
+        return self._run(sql).to_dataframe()
+
+    def execute(self, sql):
+        """Runs DDL/DML, including multi-statement scripts and transactions."""
+        self._run(sql)
+
+    def scan_report(self, sql):
+        """Bytes the query would read, from a free dry run."""
+        job_config = self.bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        job = self.client.query(sql, job_config=job_config)
+        return {'bytes_scanned': job.total_bytes_processed}
+
+    def load_dataframe(self, df, name, mode='append'):
+        disposition = "WRITE_TRUNCATE" if mode == 'truncate' else "WRITE_APPEND"
+        job_config = self.bigquery.LoadJobConfig(write_disposition=disposition)
+        self.client.load_table_from_dataframe(df, self.table_id(name), job_config=job_config).result()
+
+    def load_parquet(self, path, name, schema):
+        """Appends a Parquet file in one load job; `schema` is a list of (name, type) pairs."""
+        job_config = self.bigquery.LoadJobConfig(
+            schema=[self.bigquery.SchemaField(column, field_type) for column, field_type in schema],
+            source_format=self.bigquery.SourceFormat.PARQUET,
+            write_disposition="WRITE_APPEND",
+        )
+        with open(path, "rb") as f:
+            self.client.load_table_from_file(f, self.table_id(name), job_config=job_config).result()
+
+    def close(self):
+        self.client.close()
+
+# BigQuery type -> DuckDB type
+DUCKDB_TYPES = {'INT64': 'BIGINT', 'FLOAT64': 'DOUBLE', 'STRING': 'VARCHAR', 'BOOL': 'BOOLEAN',
+                'TIMESTAMP': 'TIMESTAMPTZ', 'DATE': 'DATE'}
+
+class DuckDBBackend:
+    name = 'duckdb'
+
+    def __init__(self, path=WAREHOUSE_DUCKDB_PATH):
+        import duckdb
+        self.path = path
+        self.conn = duckdb.connect(path)
+        # TIMESTAMP columns are TIMESTAMPTZ; truncate and print them in UTC, like BigQuery
+        self.conn.execute("SET TimeZone = 'UTC'")
+        # One DuckDB connection is shared by the pipeline's threads
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        return f'"{name}"'
+
+    def cast(self, expression, bq_type):
+        return f"CAST({expression} AS {DUCKDB_TYPES.get(bq_type, bq_type)})"
+
+    def month_trunc(self, expression):
+        return f"CAST(date_trunc('month', {expression}) AS DATE)"
+
+    def timestamp_literal(self, value):
+        if value.tzinfo is not None:
+            return f"TIMESTAMPTZ '{value.astimezone(timezone.utc):%Y-%m-%d %H:%M:%S.%f}+00'"
+        return f"TIMESTAMP '{value:%Y-%m-%d %H:%M:%S.%f}'"
+
+    def table_exists(self, name):
+        with self.lock:
+            return self._table_exists(name)
+
+    def ensure_table(self, name, schema):
+        # Nothing to declare up front: the first load creates the table
+        pass
+
+    def create_table_as(self, name, select_sql):
+        """Written in time order, then cluster order, so zone maps can skip row groups."""
+        order = ""
+        if name in TABLE_LAYOUTS:
+            column, _, cluster = TABLE_LAYOUTS[name]
+            order = f" ORDER BY {', '.join([column] + cluster)}"
+        self.execute(f"CREATE OR REPLACE TABLE {self.table(name)} AS SELECT * FROM ({select_sql}){order}")
+
+    def relayout_table(self, name):
+        self.create_table_as(name, f"SELECT * FROM {self.table(name)}")
+
+    def scan_report(self, sql):
+        """Runs the query with profiling on and returns the rows its table scans read."""
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        settings = {'OPERATOR_TYPE': 'true', 'OPERATOR_ROWS_SCANNED': 'true'}
+        try:
+            with self.lock:
+                self.conn.execute("PRAGMA enable_profiling='json'")
+                self.conn.execute(f"PRAGMA profiling_output='{path}'")
+                self.conn.execute(f"SET custom_profiling_settings='{json.dumps(settings)}'")
+                try:
+                    self.conn.execute(sql).fetchall()
+                finally:
+                    self.conn.execute("PRAGMA disable_profiling")
+            with open(path) as f:
+                profile = json.load(f)
+        finally:
+            os.remove(path)
+
+        def rows_scanned(node):
+            own = node.get('operator_rows_scanned', 0) if node.get('operator_type') == 'TABLE_SCAN' else 0
+            return own + sum(rows_scanned(child) for child in node.get('children', []))
+        return {'rows_scanned': rows_scanned(profile)}
+
+    def query_dataframe(self, sql):
+        with self.lock:
+            return self.conn.execute(sql).df()
+
+    def execute(self, sql):
+        with self.lock:
+            self.conn.execute(sql)
+
+    def _table_exists(self, name):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [name]
+        ).fetchone()[0] > 0
+
+    def load_dataframe(self, df, name, mode='append'):
+        with self.lock:
+            self.conn.register('_load_df', df)
+            try:
+                if mode == 'truncate' or not self._table_exists(name):
+                    self.conn.execute(f"CREATE OR REPLACE TABLE {self.table(name)} AS SELECT * FROM _load_df")
+                else:
+                    self.conn.execute(f"INSERT INTO {self.table(name)} BY NAME SELECT * FROM _load_df")
+            finally:
+                self.conn.unregister('_load_df')
+
+    def load_parquet(self, path, name, schema=None):
+        # The spool file already carries the Arrow schema
+        self.load_dataframe(pq.read_table(path), name)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def record_dirty_months(backend, table_name, months):
+    """Logs months of `table_name` that are about to get rows, so models only rebuild those."""
+    import pandas as pd
+    df = pd.DataFrame({'table_name': table_name, 'month': sorted(months),
+                       'logged_at': pd.Timestamp.now(tz='UTC')})
+    backend.load_dataframe(df, DIRTY_MONTHS_TABLE)
+
+def get_backend(kind=WAREHOUSE_BACKEND):
+    if kind == 'bigquery':
+        return BigQueryBackend()
+    if kind == 'duckdb':
+        return DuckDBBackend()
+    raise ValueError(f"Unknown warehouse backend: {kind}")